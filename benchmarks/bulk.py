@@ -0,0 +1,66 @@
+"""
+Compare bulk_save with a save() loop on question stats whose data changed.
+
+Stats are loaded like an evaluation loads them, ``--changed`` percent of them get new
+data and are written back. The stats are created in a throwaway test database.
+
+Usage: python -m benchmarks.bulk [number of stats] [percent changed]
+"""
+import os
+import sys
+import timeit
+
+import django
+
+
+def main(size=1000, changed=100):
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings.test')
+    django.setup()
+    from django.db import connection
+
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    try:
+        run(size, changed)
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+def run(size, changed):
+    from django.utils import timezone
+
+    from reports.bulk import bulk_save
+    from reports.models import QuestionStat, Representation
+    from survey.models import Survey, Question
+
+    now = timezone.now()
+    survey = Survey.objects.create(name='Benchmark', slug='benchmark', start=now, end=now)
+    question = Question.objects.create(survey=survey, type=Question.TYPE_YES_NO, text='Question')
+    representation = Representation.objects.create(question=question, type=Representation.TYPE_YES_NO)
+    data = {'cnt': 10, 'yes': 5, 'reg': {str(i): {'cnt': i, 'yes': i // 2} for i in range(20)}}
+    QuestionStat.objects.bulk_create(
+        QuestionStat(survey=survey, representation=representation, type=representation.type, data=data,
+                     vars={'question_text': 'Question', 'available': True, 'labels': ['label'] * 50})
+        for _ in range(size))
+    step = max(100 // changed, 1) if changed else size + 1
+
+    def load():
+        stats = list(QuestionStat.objects.filter(survey=survey))
+        for i, stat in enumerate(stats):
+            if i % step == 0:
+                stat.data = dict(stat.data, cnt=stat.data['cnt'] + 1)
+        return stats
+
+    def save_loop():
+        for stat in load():
+            stat.save()
+
+    results = {}
+    for name, func in (('save()', save_loop), ('bulk_save', lambda: bulk_save(load()))):
+        results[name] = min(timeit.repeat(func, number=1, repeat=5))
+        print('%-10s %8.1f ms' % (name, results[name] * 1000))
+    print('speedup %.1fx' % (results['save()'] / results['bulk_save']))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
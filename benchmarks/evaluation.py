@@ -0,0 +1,204 @@
+"""
+Time evaluations and report rendering on a generated survey and save the results as JSON.
+
+The survey is generated by ``benchmarks.generator`` in a throwaway test database, then
+every benchmark runs ``--repeat`` times:
+
+- total: ``TotalEvaluator.process_answers``, a recalculation of all answers
+- last: ``LastEvaluator.process_answers`` after ``--new`` answers were submitted
+- update_vars: ``LastEvaluator.process_answers`` without new answers, what ``update_vars`` runs
+- report_europe, report_country: rendering ``ReportsView`` of all countries and of one
+
+Results hold the best and all times of each benchmark with the evaluator profile of
+the best run, the parameters, the commit and the database. ``--compare`` with the
+results of an earlier commit lists the ratios and exits with 1 when a benchmark got
+slower by more than ``--threshold``.
+
+Usage: python -m benchmarks.evaluation [--answers 10000] [--output results.json] [--compare old.json]
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+from time import perf_counter
+
+import django
+
+
+def get_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def parse_question_mix(values):
+    """
+    Question counts given as ``type=count`` arguments.
+    """
+    from survey.models import Question
+
+    types = {t for t, _ in Question.TYPE_CHOICES}
+    mix = {}
+    for value in values:
+        question_type, _, count = value.partition('=')
+        if question_type not in types or not count.isdigit():
+            raise ValueError('Expected one of %s with a count, got %r' % (', '.join(sorted(types)), value))
+        mix[question_type] = int(count)
+    return mix
+
+
+def run(name, func, repeat, setup=None, warmup=False):
+    """
+    Time ``func`` ``repeat`` times, keeping the profile of the evaluator of the fastest run.
+
+    With ``warmup`` it runs once more untimed first, e.g. to load and compile templates.
+    """
+    from reports.profiling import count_queries
+
+    if warmup:
+        func()
+    times = []
+    profile = None
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        with count_queries():
+            start = perf_counter()
+            result = func()
+        times.append(perf_counter() - start)
+        if times[-1] == min(times) and hasattr(result, 'profile'):
+            profile = result.profile.to_dict()
+    print('%-16s %10.1f ms' % (name, min(times) * 1000))
+    return {'best': min(times), 'seconds': times, 'profile': profile}
+
+
+def run_benchmarks(params, repeat, new_answers):
+    from django.core.urlresolvers import reverse
+    from django.test import RequestFactory
+
+    from insights.users.models import User
+    from reports.evaluators import TotalEvaluator, LastEvaluator
+    from reports.views import ReportsView
+    from survey.models import Survey, Region, HCPCategory
+    from .generator import generate_survey, create_answers
+
+    survey = generate_survey(**params)
+    survey_id = survey.pk
+    rnd = random.Random(params['seed'] + 1)
+    questions = list(survey.questions.values_list('pk', 'type'))
+    regions = list(Region.objects.filter(country__in=survey.countries.all()))
+    organizations = list(survey.organizations.all())
+    hcp_categories = list(HCPCategory.objects.all())
+
+    def submit():
+        create_answers(survey, questions, regions, organizations, hcp_categories, new_answers, 1, rnd)
+
+    user = User.objects.create(username='benchmark', email='benchmark@example.com', is_staff=True)
+
+    def render(country):
+        kwargs = {'survey_id': survey_id, 'country': country}
+        request = RequestFactory().get(reverse('reports:advanced', kwargs=kwargs))
+        request.user = user
+        return ReportsView.as_view()(request, **kwargs).render()
+
+    country = survey.countries.order_by('ordering').first()
+    return {
+        'total': run('total', lambda: TotalEvaluator.process_answers(Survey.objects.get(pk=survey_id)), repeat),
+        'last': run('last', lambda: LastEvaluator.process_answers(Survey.objects.get(pk=survey_id)), repeat,
+                    setup=submit),
+        'update_vars': run('update_vars', lambda: LastEvaluator.process_answers(Survey.objects.get(pk=survey_id)),
+                           repeat),
+        'report_europe': run('report_europe', lambda: render('europe'), repeat, warmup=True),
+        'report_country': run('report_country', lambda: render(country.slug), repeat, warmup=True),
+    }
+
+
+def compare(results, previous, threshold):
+    """
+    Print how the best times changed since the previous results, return the names of regressions.
+    """
+    regressions = []
+    print('compared with %s' % (previous.get('commit') or 'previous results'))
+    for name, result in results['benchmarks'].items():
+        old = previous['benchmarks'].get(name)
+        if old is None:
+            continue
+        ratio = result['best'] / old['best']
+        regressed = ratio > 1 + threshold
+        if regressed:
+            regressions.append(name)
+        print('%-16s %10.1f ms %10.1f ms %6.2fx%s'
+              % (name, old['best'] * 1000, result['best'] * 1000, ratio, ' slower' if regressed else ''))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark evaluations and reports on a generated survey')
+    parser.add_argument('--answers', type=int, default=10000)
+    parser.add_argument('--countries', type=int, default=5)
+    parser.add_argument('--regions', type=int, default=3, help='Regions per country, at least one')
+    parser.add_argument('--organizations', type=int, default=4)
+    parser.add_argument('--hcp-categories', type=int, default=3)
+    parser.add_argument('--days', type=int, default=90, help='Days the answers were submitted over')
+    parser.add_argument('--questions', nargs='*', default=[], metavar='TYPE=COUNT',
+                        help='Number of questions of a type, the default mix is used without any')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--new', type=int, default=None, help='Answers submitted before each "last" run, '
+                                                              '1%% of the answers by default')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', help='File to save the results to')
+    parser.add_argument('--compare', help='Results of an earlier run to compare with')
+    parser.add_argument('--threshold', type=float, default=0.1, help='Slowdown reported as a regression')
+    args = parser.parse_args(argv)
+
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings.test')
+    django.setup()
+    from django.db import connection
+
+    try:
+        question_mix = parse_question_mix(args.questions)
+    except ValueError as e:
+        parser.error(str(e))
+
+    params = {
+        'answers': args.answers,
+        'countries': args.countries,
+        'regions': args.regions,
+        'organizations': args.organizations,
+        'hcp_categories': args.hcp_categories,
+        'days': args.days,
+        'question_mix': question_mix or None,
+        'seed': args.seed,
+    }
+    new_answers = args.new if args.new is not None else max(args.answers // 100, 1)
+
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    try:
+        benchmarks = run_benchmarks(params, args.repeat, new_answers)
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    results = {
+        'commit': get_commit(),
+        'python': platform.python_version(),
+        'database': connection.vendor,
+        'params': dict(params, new=new_answers, repeat=args.repeat),
+        'benchmarks': benchmarks,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    if args.compare:
+        with open(args.compare) as f:
+            if compare(results, json.load(f), args.threshold):
+                return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
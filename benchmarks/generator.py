@@ -0,0 +1,132 @@
+"""
+Generate synthetic surveys with answers for benchmarks.
+
+``generate_survey`` creates a survey with questions of every ``Question.TYPE_*``,
+countries with regions, organizations, HCP categories and answers spread over a
+number of days. Answers are bodies like ``pass_view`` stores them, with their
+structured data, and are inserted in bulk, so no evaluation runs while generating.
+The same parameters and seed always give the same survey.
+"""
+import random
+from datetime import timedelta
+
+from django.utils import timezone
+
+from insights.users.models import Country
+from reports.models import Representation
+from survey.models import Survey, Question, Option, Region, Organization, HCPCategory, Answer
+from survey.factories import OPTION_VALUES, make_answer_body
+
+# Number of questions of each type in a generated survey
+DEFAULT_QUESTION_MIX = {
+    Question.TYPE_YES_NO: 4,
+    Question.TYPE_YES_NO_JUMPING: 2,
+    Question.TYPE_TWO_DEPENDEND_FIELDS: 3,
+    Question.TYPE_DEPENDEND_QUESTION: 3,
+    Question.TYPE_SIMPLE_INPUT: 3,
+    Question.TYPE_MULTISELECT_ORDERED: 4,
+    Question.TYPE_MULTISELECT_WITH_OTHER: 3,
+}
+
+# Representation types of the question types, cycled through for questions of the same type
+REPRESENTATION_TYPES = {
+    Question.TYPE_YES_NO: (Representation.TYPE_YES_NO,),
+    Question.TYPE_YES_NO_JUMPING: (Representation.TYPE_YES_NO,),
+    Question.TYPE_TWO_DEPENDEND_FIELDS: (Representation.TYPE_AVERAGE_PERCENT,),
+    Question.TYPE_SIMPLE_INPUT: (Representation.TYPE_AVERAGE_PERCENT,),
+    Question.TYPE_MULTISELECT_ORDERED: (Representation.TYPE_MULTISELECT_TOP, Representation.TYPE_MULTISELECT_TOP5),
+    Question.TYPE_MULTISELECT_WITH_OTHER: (Representation.TYPE_MULTISELECT,),
+}
+
+
+def create_questions(survey, question_mix):
+    """
+    Questions of the survey with their representations and options, as (pk, type) pairs.
+    """
+    questions = []
+    parents = []
+    ordering = 0
+    # Dependend questions are created last, they belong to the questions with two dependend fields
+    types = sorted(question_mix, key=lambda t: t == Question.TYPE_DEPENDEND_QUESTION)
+    for question_type in types:
+        for i in range(question_mix[question_type]):
+            ordering += 1
+            question = Question(survey=survey, type=question_type, ordering=ordering,
+                                text='%s question %s' % (question_type, i + 1))
+            if question_type == Question.TYPE_SIMPLE_INPUT:
+                question.field = (Question.FIELD_PERCENT, Question.FIELD_NUMBER)[i % 2]
+            if question_type == Question.TYPE_DEPENDEND_QUESTION and parents:
+                question.depends_on = parents[i % len(parents)]
+                question.dependency_type = Question.DEPENDENCY_INCLUSION
+            question.save()
+            questions.append((question.pk, question_type))
+
+            if question_type == Question.TYPE_TWO_DEPENDEND_FIELDS:
+                parents.append(question)
+            if question_type in (Question.TYPE_MULTISELECT_ORDERED, Question.TYPE_MULTISELECT_WITH_OTHER):
+                Option.objects.bulk_create(Option(question=question, value=value, ordering=j)
+                                           for j, value in enumerate(OPTION_VALUES) if value)
+            representation_types = REPRESENTATION_TYPES.get(question_type)
+            if representation_types:
+                representation_type = representation_types[i % len(representation_types)]
+                Representation.objects.create(question=question, type=representation_type, ordering=ordering,
+                                              active=True)
+    return questions
+
+
+def create_answers(survey, questions, regions, organizations, hcp_categories, answers, days, rnd,
+                   batch_size=1000):
+    """
+    Insert ``answers`` answers, submitted in the order of their pks over the last ``days`` days.
+    """
+    start = timezone.now().replace(hour=12, minute=0, second=0, microsecond=0) - timedelta(days=days - 1)
+    done = 0
+    while done < answers:
+        size = min(batch_size, answers - done)
+        batch = []
+        for _ in range(size):
+            region = rnd.choice(regions)
+            body = make_answer_body(questions, rnd)
+            batch.append(Answer(survey=survey, country_id=region.country_id, region=region,
+                                organization=rnd.choice(organizations),
+                                hcp_category=rnd.choice(hcp_categories + [None]),
+                                body=body, data=Answer(body=body).parse_body()))
+        Answer.objects.bulk_create(batch)
+
+        # Bulk inserts don't return pks on every database, the new answers are the last ones
+        pks = list(survey.answers.order_by('-pk').values_list('pk', flat=True)[:size])[::-1]
+        days_of_answers = {}
+        for i, pk in enumerate(pks):
+            days_of_answers.setdefault((done + i) * days // answers, []).append(pk)
+        for day, day_pks in days_of_answers.items():
+            Answer.objects.filter(pk__gte=day_pks[0], pk__lte=day_pks[-1]).update(
+                created_at=start + timedelta(days=day))
+        done += size
+
+
+def generate_survey(answers=1000, countries=5, regions=3, organizations=4, hcp_categories=3, days=90,
+                    question_mix=None, seed=0, slug='benchmark'):
+    """
+    Create a survey with ``answers`` answers and return it.
+
+    ``regions`` is the number of regions per country, ``question_mix`` maps question
+    types to the number of questions of the type, DEFAULT_QUESTION_MIX by default.
+    """
+    rnd = random.Random(seed)
+    now = timezone.now()
+    survey = Survey.objects.create(name='Benchmark %s' % slug, slug=slug, active=True,
+                                   start=now - timedelta(days=days), end=now + timedelta(days=days))
+    country_list = [Country.objects.create(name='%s country %s' % (slug, i + 1), slug='%s-country-%s' % (slug, i + 1),
+                                           ordering=i + 1)
+                    for i in range(countries)]
+    survey.countries.set(country_list)
+    region_list = [Region.objects.create(name='Region %s' % (i + 1), country=country, ordering=i + 1)
+                   for country in country_list for i in range(regions)]
+    organization_list = [Organization.objects.create(name='%s organization %s' % (slug, i + 1), ordering=i + 1)
+                         for i in range(organizations)]
+    survey.organizations.set(organization_list)
+    hcp_category_list = [HCPCategory.objects.create(name='HCP category %s' % (i + 1)) for i in range(hcp_categories)]
+
+    questions = create_questions(survey, DEFAULT_QUESTION_MIX if question_mix is None else question_mix)
+    create_answers(survey, questions, region_list, organization_list, hcp_category_list, answers, days, rnd)
+    return survey
@@ -0,0 +1,36 @@
+"""
+Compare parse_answer_body with querystring_parser on generated answer bodies.
+
+Usage: python -m benchmarks.parser [number of bodies]
+"""
+import os
+import random
+import sys
+import timeit
+
+import django
+
+
+def main(size=2000):
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings.test')
+    django.setup()
+
+    from querystring_parser import parser as queryparser
+    from survey.models import Question
+    from survey.parsers import parse_answer_body
+    from survey.factories import make_answer_body
+
+    rnd = random.Random(0)
+    types = [t for t, _ in Question.TYPE_CHOICES]
+    questions = [(qid, rnd.choice(types)) for qid in range(1, 31)]
+    bodies = [make_answer_body(questions, rnd) for _ in range(size)]
+
+    results = {}
+    for name, parse in (('querystring_parser', queryparser.parse), ('parse_answer_body', parse_answer_body)):
+        results[name] = min(timeit.repeat(lambda: [parse(body) for body in bodies], number=1, repeat=5))
+        print('%-20s %8.1f ms' % (name, results[name] * 1000))
+    print('speedup %.1fx' % (results['querystring_parser'] / results['parse_answer_body']))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -54,7 +54,7 @@ LOCAL_APPS = (
     'insights.users.apps.UsersConfig',
     # Your stuff: custom apps go here
     'survey.apps.SurveyConfig',
-    'reports',
+    'reports.apps.ReportsConfig',
 )
 
 # See: https://docs.djangoproject.com/en/dev/ref/settings/#installed-apps
@@ -299,3 +299,21 @@ MESSAGE_TAGS = {
 
 # required for survey form
 DATA_UPLOAD_MAX_NUMBER_FIELDS = 10000
+
+# REPORTS
+# ------------------------------------------------------------------------------
+# Apply every submitted answer to the report stats in the same transaction
+REPORTS_LIVE_STATS = env.bool('REPORTS_LIVE_STATS', default=False)
+# Seconds a submission can take to commit, answers older than that are no longer expected below the last
+# evaluated answer
+REPORTS_SUBMISSION_TIMEOUT = env.int('REPORTS_SUBMISSION_TIMEOUT', default=300)
+# Days finished evaluation jobs are kept, the last done job of every survey and mode is kept longer
+REPORTS_JOB_RETENTION_DAYS = env.int('REPORTS_JOB_RETENTION_DAYS', default=30)
+# Worker processes a total recalculation of a survey is split between
+REPORTS_PROCESSES = env.int('REPORTS_PROCESSES', default=1)
+# Answers per committed chunk of a total recalculation that can resume after interruptions, 0 to recalculate
+# in one transaction
+REPORTS_CHECKPOINT_SIZE = env.int('REPORTS_CHECKPOINT_SIZE', default=0)
+# Recalculate all answers with GROUP BY queries over their expanded values, in one transaction, instead of
+# processing the answers in Python
+REPORTS_AGGREGATE_TOTALS = env.bool('REPORTS_AGGREGATE_TOTALS', default=False)
@@ -51,6 +51,12 @@ DATABASES = {
 TEST_RUNNER = 'django.test.runner.DiscoverRunner'
 
 
+# REPORTS
+# ------------------------------------------------------------------------------
+# Answers of tests are committed when they are created
+REPORTS_SUBMISSION_TIMEOUT = 0
+
+
 # PASSWORD HASHING
 # ------------------------------------------------------------------------------
 # Use fast password hasher so tests run faster
@@ -1,9 +1,28 @@
 from django.contrib import admin
 
-from .models import Representation
+from .models import Representation, EvaluationJob, EvaluationCheckpoint, CubeSlice
 
 
 @admin.register(Representation)
 class RepresentationAdmin(admin.ModelAdmin):
     list_display = ('id', 'type', 'question', 'ordering', 'label1', 'label2', 'label3')
     search_fields = ('label1', 'label2', 'label3')
+
+
+@admin.register(EvaluationJob)
+class EvaluationJobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'survey', 'mode', 'status', 'created_at', 'started_at', 'finished_at')
+    list_filter = ('status', 'mode')
+    readonly_fields = ('messages', 'error', 'created_at', 'started_at', 'finished_at')
+
+
+@admin.register(EvaluationCheckpoint)
+class EvaluationCheckpointAdmin(admin.ModelAdmin):
+    list_display = ('id', 'survey', 'after', 'last', 'started_at', 'updated_at')
+    exclude = ('state',)
+
+
+@admin.register(CubeSlice)
+class CubeSliceAdmin(admin.ModelAdmin):
+    list_display = ('id', 'survey', 'organization', 'hcp_category', 'generation', 'created_at')
+    readonly_fields = ('generation', 'created_at')
@@ -1,5 +1,28 @@
 from django.apps import AppConfig
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete, pre_save
 
 
 class ReportsConfig(AppConfig):
     name = 'reports'
+
+    def ready(self):
+        from survey.models import Answer, Option, Question, Survey
+        from . import columnar, plans
+        from .evaluators import LiveEvaluator
+        from .models import CubeSlice, OptionDict, Representation
+
+        pre_save.connect(LiveEvaluator.on_answer_saving, sender=Answer)
+        post_save.connect(LiveEvaluator.on_answer_saved, sender=Answer)
+        post_delete.connect(LiveEvaluator.on_answer_deleted, sender=Answer)
+        pre_delete.connect(LiveEvaluator.on_survey_deleting, sender=Survey)
+        post_delete.connect(LiveEvaluator.on_survey_deleted, sender=Survey)
+        post_save.connect(columnar.on_answer_changed, sender=Answer)
+        post_delete.connect(columnar.on_answer_changed, sender=Answer)
+
+        for signal in (post_save, post_delete):
+            signal.connect(plans.on_survey_changed, sender=Survey)
+            signal.connect(plans.on_question_changed, sender=Question)
+            signal.connect(plans.on_representation_changed, sender=Representation)
+            signal.connect(plans.on_cube_slice_changed, sender=CubeSlice)
+            signal.connect(OptionDict.on_option_changed, sender=Option)
+        m2m_changed.connect(plans.on_survey_countries_changed, sender=Survey.countries.through)
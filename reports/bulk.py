@@ -0,0 +1,90 @@
+from django.db import connections
+
+
+def _update_from_values(model, objs, fields, connection):
+    # One UPDATE ... FROM (VALUES ...) per batch, every value is cast to the type of its column
+    qn = connection.ops.quote_name
+    table = qn(model._meta.db_table)
+    pk = model._meta.pk
+    columns = [pk.column] + [field.column for field in fields]
+    types = [pk.rel_db_type(connection)] + [field.db_type(connection) for field in fields]
+    row = '(%s)' % ', '.join('%%s::%s' % db_type for db_type in types)
+    sql = 'UPDATE %s SET %s FROM (VALUES %s) AS v (%s) WHERE %s.%s = v.%s' % (
+        table,
+        ', '.join('%s = v.%s' % (qn(field.column), qn(field.column)) for field in fields),
+        ', '.join([row] * len(objs)),
+        ', '.join(qn(column) for column in columns),
+        table, qn(pk.column), qn(pk.column),
+    )
+    params = []
+    for obj in objs:
+        params.append(obj.pk)
+        params += [field.get_db_prep_save(getattr(obj, field.attname), connection) for field in fields]
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+
+
+def _update_many(model, objs, fields, connection):
+    # The same UPDATE of the fields for every object, run as one executemany
+    qn = connection.ops.quote_name
+    pk = model._meta.pk
+    sql = 'UPDATE %s SET %s WHERE %s = %%s' % (
+        qn(model._meta.db_table),
+        ', '.join('%s = %%s' % qn(field.column) for field in fields),
+        qn(pk.column),
+    )
+    params = [[field.get_db_prep_save(getattr(obj, field.attname), connection) for field in fields] + [obj.pk]
+              for obj in objs]
+    with connection.cursor() as cursor:
+        cursor.executemany(sql, params)
+
+
+def bulk_update(objs, fields=None, batch_size=500):
+    """
+    Write ``fields``, by default all concrete fields, of already saved objects.
+
+    PostgreSQL takes the values of a batch in one UPDATE joined to a VALUES list, other
+    databases run the UPDATE of one object for all objects of a batch with executemany.
+    """
+    if not objs:
+        return
+    model = type(objs[0])
+    connection = connections[model.objects.db]
+    if fields is None:
+        fields = [f for f in model._meta.concrete_fields if not f.primary_key]
+    else:
+        fields = [model._meta.get_field(name) for name in fields]
+    if not fields:
+        return
+
+    update = _update_from_values if connection.vendor == 'postgresql' else _update_many
+    for start in range(0, len(objs), batch_size):
+        update(model, objs[start:start + batch_size], fields, connection)
+
+
+def bulk_save(objs, batch_size=500):
+    """
+    Insert new objects and update changed ones in bulk.
+
+    Only the changed fields of objects loaded from the database are written, objects
+    without changes since loading are skipped. Returns the objects that were written.
+    """
+    objs = list(objs)
+    if not objs:
+        return []
+    model = type(objs[0])
+    new = [obj for obj in objs if obj.pk is None]
+    changed = {}
+    for obj in objs:
+        if obj.pk is not None:
+            fields = obj.get_changed_fields()
+            if fields:
+                changed.setdefault(tuple(fields), []).append(obj)
+
+    model.objects.bulk_create(new, batch_size=batch_size)
+    for fields, group in changed.items():
+        bulk_update(group, fields=fields, batch_size=batch_size)
+    written = [obj for group in changed.values() for obj in group]
+    for obj in written:
+        obj.mark_clean()
+    return new + written
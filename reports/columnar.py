@@ -0,0 +1,345 @@
+"""
+Parsed answers of a survey in columns, for reports over ad-hoc slices of the answers.
+
+``AnswerColumns`` keeps NumPy arrays with one row per answer: the ids of its country,
+region, organization and HCP category, the local time it was submitted, and the values
+of the yes/no and average questions. The options of multiselect questions are kept
+sparse, one entry per option an answer selected with its row and rank, as free text
+options are mostly selected once. Any combination of dimensions and a date range is a
+boolean mask over the rows, so reports of a slice are computed with a few vectorized
+operations instead of evaluating answers again.
+
+Columns are built on first use and cached per process. Every ``get_columns`` call
+appends the answers committed since, like evaluators do they read every answer above
+a watermark that was not loaded yet, so answers that commit after answers with higher
+ids are not missed, see ``AbstractEvaluator.get_cutoff``. The columns are built anew
+when the evaluation plan of the survey changes, see ``plans.invalidate_plan``, or an
+answer is edited or deleted, which bumps ``SurveyVersion.answers``.
+"""
+import threading
+
+import numpy as np
+
+from django.utils import timezone
+
+from .dimensions import Dimensions
+from .evaluators import AbstractEvaluator
+from .models import QuestionStat, Representation, OptionDict, SurveyVersion
+from .plans import get_plan
+
+# Survey id to the columns of its answers
+_columns = {}
+# Survey id to the lock of its columns, a survey is built or refreshed by one thread at a time
+_locks = {}
+_lock = threading.Lock()
+
+# Ids of missing dimensions, primary keys start at 1
+NONE_ID = 0
+
+# Counters of the option representations and how many of the first options of an answer they count
+OPTION_RANKS = {
+    Representation.TYPE_MULTISELECT: (('top', None),),
+    Representation.TYPE_MULTISELECT_TOP: (('top1', 1), ('top3', 3)),
+    Representation.TYPE_MULTISELECT_TOP5: (('top5', 5),),
+}
+SCALAR_TYPES = (Representation.TYPE_YES_NO, Representation.TYPE_AVERAGE_PERCENT)
+
+
+def get_dist_positions(values, lowest, highest, num):
+    """
+    Vectorized ``QuestionStat.get_dist_position`` of float values.
+    """
+    piece = (highest - lowest) / num
+    vals = np.trunc(values).astype(np.int64)
+    positions = np.trunc(vals / piece).astype(np.int64)
+    positions[(vals != 0) & (positions * int(piece) == vals)] -= 1
+    return np.minimum(positions, num - 1)
+
+
+class GrowingArray(object):
+    """
+    NumPy array appended to in place, its capacity doubles when it runs full.
+    """
+
+    def __init__(self, dtype):
+        self.buffer = np.zeros(0, dtype=dtype)
+        self.size = 0
+
+    def extend(self, values):
+        values = np.asarray(values, dtype=self.buffer.dtype)
+        size = self.size + len(values)
+        if size > len(self.buffer):
+            buffer = np.zeros(max(size, 2 * len(self.buffer)), dtype=self.buffer.dtype)
+            buffer[:self.size] = self.buffer[:self.size]
+            self.buffer = buffer
+        self.buffer[self.size:size] = values
+        self.size = size
+
+    @property
+    def data(self):
+        return self.buffer[:self.size]
+
+
+class OptionColumn(object):
+    """
+    Options selected in the answers to a multiselect question: the row of the answer,
+    the number of the option and its rank in the answer for every selected option.
+    """
+
+    def __init__(self):
+        # Lowered options in the order of their numbers
+        self.lowers = []
+        self.numbers = {}
+        self.rows = GrowingArray(np.int32)
+        self.options = GrowingArray(np.int32)
+        self.ranks = GrowingArray(np.int16)
+
+    def extend(self, rows, lowers, ranks):
+        options = []
+        for lower in lowers:
+            number = self.numbers.get(lower)
+            if number is None:
+                number = self.numbers[lower] = len(self.lowers)
+                self.lowers.append(lower)
+            options.append(number)
+        self.rows.extend(rows)
+        self.options.extend(options)
+        self.ranks.extend(ranks)
+
+
+class AnswerColumns(object):
+    DIMENSIONS = ('country', 'region', 'organization', 'hcp_category')
+    # Number of answers fetched per query when the columns are refreshed
+    chunk_size = 1000
+
+    process_dependencies = AbstractEvaluator.process_dependencies
+
+    def __init__(self, survey, plan):
+        self.survey = survey
+        self.plan = plan
+        # Version of the answers the columns were built from, see SurveyVersion
+        self.version = None
+        # Every answer up to the watermark is loaded, the ones above it that are loaded are recent
+        self.watermark = 0
+        # Ids of the recent answers to their submission time
+        self.recent = {}
+        self.size = 0
+        self.dimensions = {name: GrowingArray(np.int64) for name in self.DIMENSIONS}
+        self.created_at = GrowingArray('datetime64[s]')
+        # Question id to the values of yes/no (1 or 0) and average questions, NaN where not answered
+        self.values = {}
+        # Question id to the options selected in the answers
+        self.options = {}
+        self.messages = []
+        for qid, r in plan.representations.items():
+            if r.type in SCALAR_TYPES:
+                self.values[qid] = GrowingArray(np.float64)
+            elif r.type in OPTION_RANKS:
+                self.options[qid] = OptionColumn()
+
+    def parse_scalar(self, r, question_data):
+        if r.type == Representation.TYPE_YES_NO:
+            result = question_data.strip() if isinstance(question_data, str) else ''
+            return {'Yes': 1.0, 'No': 0.0}.get(result, np.nan)
+
+        if not isinstance(question_data, dict):
+            return np.nan
+        main_str = question_data.get('main', '').strip()
+        additional_str = question_data.get('additional', '').strip()
+        if main_str:
+            return float(main_str)
+        if additional_str:
+            return float(int(additional_str) * 10)
+        return np.nan
+
+    def parse_options(self, question_data):
+        """
+        Ranks of the distinct options of an answer, by their lowered form.
+        """
+        if not isinstance(question_data, dict):
+            return {}
+        options = question_data.get('') or []
+        if isinstance(options, str):
+            options = [options]
+        ranks = {}
+        for opt in options:
+            normalized = self.plan.normalize_option(str(opt))
+            if normalized is not None and normalized[1] not in ranks:
+                ranks[normalized[1]] = len(ranks)
+        return ranks
+
+    def refresh(self):
+        """
+        Append the answers committed since the last refresh.
+        """
+        cutoff = AbstractEvaluator.get_cutoff()
+        answers = (self.survey.answers.only(*AbstractEvaluator.answer_fields)
+                   .exclude(pk__in=list(self.recent)).order_by('pk'))
+        last_pk = self.watermark
+        while True:
+            chunk = AbstractEvaluator.load_bodies(list(answers.filter(pk__gt=last_pk)[:self.chunk_size]))
+            if chunk:
+                self.append(chunk)
+                self.recent.update((answer.pk, answer.created_at) for answer in chunk)
+                last_pk = chunk[-1].pk
+            if len(chunk) < self.chunk_size:
+                break
+        self.settle(cutoff)
+        return self
+
+    def settle(self, cutoff):
+        """
+        Move the watermark up to the last loaded answer submitted before the cutoff.
+
+        Answers with lower ids were committed when the refresh started, so they are loaded.
+        """
+        settled = [pk for pk, created_at in self.recent.items() if created_at < cutoff]
+        if settled:
+            self.watermark = max(self.watermark, max(settled))
+        self.recent = {pk: created_at for pk, created_at in self.recent.items() if pk > self.watermark}
+
+    def append(self, answers):
+        n = len(answers)
+        dimensions = {name: np.zeros(n, dtype=np.int64) for name in self.DIMENSIONS}
+        created_at = np.zeros(n, dtype='datetime64[s]')
+        values = {qid: np.full(n, np.nan) for qid in self.values}
+        # Question id to the rows, lowered options and ranks of the selected options
+        options = {qid: ([], [], []) for qid in self.options}
+
+        for i, answer in enumerate(answers):
+            for name in self.DIMENSIONS:
+                dimensions[name][i] = getattr(answer, '%s_id' % name) or NONE_ID
+            # Local time like the days of TrendStat
+            created_at[i] = np.datetime64(timezone.make_naive(answer.created_at)
+                                          if timezone.is_aware(answer.created_at) else answer.created_at, 's')
+            try:
+                data = AbstractEvaluator.get_answer_data(answer)
+            except Exception as e:
+                self.messages.append(str(e))
+                continue
+            if not isinstance(data, dict):
+                continue
+            self.process_dependencies(data)
+
+            for qid, question_data in data.items():
+                r = self.plan.representations.get(qid)
+                if r is None:
+                    continue
+                if qid in values:
+                    try:
+                        values[qid][i] = self.parse_scalar(r, question_data)
+                    except ValueError as e:
+                        self.messages.append("Answer %s, Question %s: %s" % (answer.pk, qid, e))
+                elif qid in options:
+                    rows, lowers, ranks = options[qid]
+                    for lower, rank in self.parse_options(question_data).items():
+                        rows.append(self.size + i)
+                        lowers.append(lower)
+                        ranks.append(rank)
+
+        for name in self.DIMENSIONS:
+            self.dimensions[name].extend(dimensions[name])
+        self.created_at.extend(created_at)
+        for qid, column in values.items():
+            self.values[qid].extend(column)
+        for qid, (rows, lowers, ranks) in options.items():
+            self.options[qid].extend(rows, lowers, ranks)
+        self.size += n
+
+    def get_mask(self, countries=None, regions=None, organizations=None, hcp_categories=None,
+                 start=None, end=None):
+        """
+        Rows of the answers in a slice. Dimensions are lists of ids, None in them matches missing ones.
+
+        ``start`` and ``end`` are dates, both included.
+        """
+        mask = np.ones(self.size, dtype=bool)
+        for name, ids in zip(self.DIMENSIONS, (countries, regions, organizations, hcp_categories)):
+            if ids is not None:
+                mask &= np.isin(self.dimensions[name].data, [NONE_ID if pk is None else pk for pk in ids])
+        if start is not None:
+            mask &= self.created_at.data >= np.datetime64(start, 's')
+        if end is not None:
+            mask &= self.created_at.data < np.datetime64(end, 's') + np.timedelta64(1, 'D')
+        return mask
+
+    def summarize_scalar(self, r, values, mask):
+        answered = mask & ~np.isnan(values)
+        selected = values[answered]
+        cnt = int(selected.size)
+        if r.type == Representation.TYPE_YES_NO:
+            yes = int(selected.sum())
+            return {'cnt': cnt, 'yes': yes, 'percent': 100.0 * yes / cnt if cnt else None}
+
+        spec, _ = self.plan.dist_specs[r.question_id]
+        bins = np.zeros(spec[2], dtype=np.int64)
+        np.add.at(bins, get_dist_positions(selected, *spec), 1)
+        return {
+            'cnt': cnt,
+            'mean': float(selected.mean()) if cnt else None,
+            'quartiles': [float(q) for q in np.percentile(selected, [25, 50, 75])] if cnt else None,
+            'bins': bins.tolist(),
+            'labels': QuestionStat.get_dist_labels(r.question.unit, *spec),
+        }
+
+    def summarize_options(self, r, column, mask):
+        selected = mask[column.rows.data]
+        ranks = column.ranks.data
+        # Every answer with options has one option of rank 0
+        summary = {'cnt': int((selected & (ranks == 0)).sum())}
+        OptionDict.load(column.lowers)
+        for name, limit in OPTION_RANKS[r.type]:
+            counted = selected if limit is None else selected & (ranks < limit)
+            counts = np.bincount(column.options.data[counted], minlength=len(column.lowers))
+            summary[name] = sorted(((OptionDict.get(column.lowers[number]), int(counts[number]))
+                                    for number in np.flatnonzero(counts)),
+                                   key=lambda item: (-item[1], item[0]))
+        return summary
+
+    def summarize(self, mask):
+        """
+        Counts of every representation of the survey over the masked answers.
+        """
+        representations = []
+        for r in self.plan.representation_list:
+            qid = r.question_id
+            if qid in self.values:
+                summary = self.summarize_scalar(r, self.values[qid].data, mask)
+            elif qid in self.options:
+                summary = self.summarize_options(r, self.options[qid], mask)
+            else:
+                continue
+            summary.update({'representation': r.pk, 'question': qid, 'type': r.type})
+            representations.append(summary)
+        return {'total': int(mask.sum()), 'representations': representations}
+
+
+def get_columns(survey):
+    """
+    Columns of the answers of the survey, up to date with the committed answers.
+    """
+    plan = get_plan(survey, Dimensions())
+    version = SurveyVersion.get(survey.pk, 'answers')
+    with _lock:
+        lock = _locks.setdefault(survey.pk, threading.Lock())
+    with lock:
+        columns = _columns.get(survey.pk)
+        if columns is None or columns.plan is not plan or columns.version != version:
+            columns = _columns[survey.pk] = AnswerColumns(survey, plan)
+            columns.version = version
+        return columns.refresh()
+
+
+def invalidate_columns(survey_id):
+    _columns.pop(survey_id, None)
+
+
+def clear_columns():
+    _columns.clear()
+
+
+def on_answer_changed(sender, instance, created=False, **kwargs):
+    # New answers are appended, edited and deleted ones are only dropped by building the columns anew
+    if not created:
+        invalidate_columns(instance.survey_id)
+        SurveyVersion.bump([instance.survey_id], 'answers')
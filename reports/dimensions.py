@@ -0,0 +1,56 @@
+from insights.users.models import Country
+from survey.models import Region, Organization, Survey
+
+
+class Dimensions(object):
+    """
+    Shared lookup of the countries, regions and organizations stats are built for.
+
+    One instance can be passed to several evaluators, so that evaluating many
+    surveys queries each dimension table once instead of once per stat row or survey.
+    """
+
+    def __init__(self):
+        self._countries = None
+        self._organizations = None
+        self._regions = None
+
+    @staticmethod
+    def load_survey_links(field, model):
+        """
+        Objects of ``model`` linked to surveys by the many-to-many ``field``, by survey id, in the model ordering.
+        """
+        objects = {obj.pk: obj for obj in model.objects.all()}
+        through = getattr(Survey, field).through
+        column = '%s_id' % model._meta.model_name
+        linked = {}
+        for survey_id, obj_id in through.objects.values_list('survey_id', column):
+            linked.setdefault(survey_id, set()).add(obj_id)
+        # Dicts keep the order of the query, which is the ordering of the model
+        return {survey_id: [obj for pk, obj in objects.items() if pk in ids] for survey_id, ids in linked.items()}
+
+    def get_countries(self, survey):
+        if self._countries is None:
+            self._countries = self.load_survey_links('countries', Country)
+        return self._countries.get(survey.pk, [])
+
+    def get_country(self, survey, country_id):
+        for country in self.get_countries(survey):
+            if country.pk == country_id:
+                return country
+        raise KeyError("Country %s is not in survey %s" % (country_id, survey.pk))
+
+    def get_organizations(self, survey):
+        if self._organizations is None:
+            self._organizations = self.load_survey_links('organizations', Organization)
+        return self._organizations.get(survey.pk, [])
+
+    def get_regions(self, survey, country_id):
+        if country_id is None:
+            return self.get_countries(survey)
+
+        if self._regions is None:
+            self._regions = {}
+            for region in Region.objects.all():
+                self._regions.setdefault(region.country_id, []).append(region)
+        return self._regions.get(country_id, [])
@@ -1,50 +1,95 @@
 import logging
-
-from querystring_parser import parser as queryparser
-
-from django.db import transaction
-
-from survey.models import Country, Survey, Answer, Question
-from .models import SurveyStat, OrganizationStat, QuestionStat, Representation, OptionDict
+import multiprocessing
+import os
+from datetime import timedelta
+from itertools import chain
+from time import perf_counter
+
+from django.conf import settings
+from django.db import connection, connections, transaction
+from django.db.transaction import TransactionManagementError
+from django.db.models import Case, Count, IntegerField, Max, Q, Sum, When
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from survey.models import Survey, Answer, Question
+from survey.parsers import parse_answer_body, normalize_answer_data
+from . import sketches
+from .bulk import bulk_save
+from .dimensions import Dimensions
+from .merge import merge_counters, merge_stat_data, prune_stat_data
+from .plans import get_plan, invalidate_plan
+from .profiling import Profile, get_json_size
+from .models import (SurveyStat, OrganizationStat, QuestionStat, Representation, OptionDict, AnswerValue,
+                     EvaluationCheckpoint, TrendStat, CubeSlice, ExpandedAnswer)
 
 logger = logging.getLogger(__name__)
 
 
-class AbstractEvaluator(object):
+def new_average_data(spec, keep_dist=True):
+    """
+    Empty data of an average question stat, with one bin per part of the distribution ``spec``.
+    """
+    data = {
+        'main_sum': 0.0,
+        'main_cnt': 0,
+        'bins': [0] * spec[2],
+        'bins_spec': spec,
+        'reg_sum': {},
+        'reg_cnt': {},
+        'org_sum': {},
+        'org_cnt': {},
+        'sketch': sketches.new_sketch(),
+        'reg_sketch': {},
+        'org_sketch': {}
+    }
+    if keep_dist:
+        data['dist'] = {}
+    return data
 
-    # https://app.asana.com/0/232511650961646/257462747620886
-    dependencies = [
-        {
-            'source': 3,
-            'target': 5,
-            'type': 'set_radio',
-            'additional': {
-                'options': ['Aripiprazole-oral', 'Aripiprazole-LAI'],
-                'anwser': 'Yes'
-            }
-        },
-        {
-            'source': 11,
-            'target': 13,
-            'type': 'set_radio',
-            'additional': {
-                'options': ['Aripiprazole-oral', 'Aripiprazole-LAI'],
-                'anwser': 'Yes'
-            }
-        }
-    ]
 
-    def __init__(self, survey):
+class AbstractEvaluator(object):
+    # Number of answers fetched per query by iter_answers
+    chunk_size = 1000
+    # Answer columns the processors need, everything else stays in the database. body is
+    # only parsed for answers stored without data, see load_bodies
+    answer_fields = ('id', 'survey', 'country', 'region', 'organization', 'hcp_category', 'created_at', 'data')
+    # The evaluator reads every answer above the watermark that is not in recent, so it can move the watermark up
+    settles = True
+    # The evaluator counts all answers into empty stats, so it can fill the cells of slices that were not evaluated yet
+    fills_new_slices = False
+    # Evaluators filling new slices fill the ones registered up to this time, all of them by default
+    slices_before = None
+
+    def __init__(self, survey, dimensions=None):
         self.survey = survey
+        self.dimensions = dimensions if dimensions is not None else Dimensions()
+        self.generation = self.get_generation()
         self.survey_stat = {}
         self.organization_stat = {}
         self.question_stat = {}
+        self.cube_stat = {}
+        self.cube_cells = set()
+        # (organization id, HCP category id) cells of the slices the answers are counted into,
+        # and the ids of the new slices among them
+        self.slices = set()
+        self.new_slices = []
+        self.trend_stat = {}
+        # Cube and trend stats are loaded when an answer needs them, stats of a new generation don't exist yet
+        self.lookup_stats = self.generation == survey.stat_generation
+        self.plan = None
         self.question_representation_link = {}
         self.question_dict = {}
+        self.processors = {}
         self.messages = []
-        self.load_stat()
-
-    def type_average_percent_processor(self, question_id, question_data, answer):
+        self.profile = Profile()
+        with self.profile.phase('load_stat'):
+            self.load_stat()
+        self.watermark = self.get_watermark()
+        self.recent = self.get_recent()
+        self.cutoff = self.get_cutoff()
+
+    def type_average_percent_processor(self, question_id, question_data, answer, n=1):
         q = self.question_dict[question_id]
         if (q.type != Question.TYPE_TWO_DEPENDEND_FIELDS and
                 (q.type != Question.TYPE_SIMPLE_INPUT or
@@ -63,54 +108,49 @@ class AbstractEvaluator(object):
             main_float = float(additional_str) * 10
             val_str = str(int(additional_str) * 10)
         org_key = str(answer.organization_id)
-        reg_id = answer.region_id
-        country_id = answer.country_id
-        survey_id = answer.survey_id
-
-        r = self.question_representation_link[question_id]
-
-        k0 = (survey_id, None, r.pk)
-        k1 = (survey_id, country_id, r.pk)
-        regs = [(k0, country_id), (k1, reg_id)]
+        spec, keep_dist = self.plan.dist_specs[question_id]
+        position = QuestionStat.get_dist_position(val_str, *spec)
 
-        for k, cur_reg_id in regs:
+        for data, cur_reg_id in self.get_stat_data(question_id, answer):
             reg_key = str(cur_reg_id)
-            data = self.question_stat[k].data
             if not data:
-                data.update({
-                    'main_sum': 0.0,
-                    'main_cnt': 0,
-                    'dist': {},
-                    'reg_sum': {},
-                    'reg_cnt': {},
-                    'org_sum': {},
-                    'org_cnt': {}
-                })
-
-            data = self.question_stat[k].data
-            data['main_sum'] += main_float
-            data['main_cnt'] += 1
-
-            if val_str in data['dist']:
-                data['dist'][val_str] += 1
-            else:
-                data['dist'][val_str] = 1
+                data.update(new_average_data(spec, keep_dist))
+            elif data.get('bins_spec') != spec:
+                QuestionStat.prepare_bins(data, spec, keep_dist)
+            if 'sketch' not in data:
+                # Stats built before the sketches were added, they fill up on the next total recalculation
+                data.update({'sketch': sketches.new_sketch(), 'reg_sketch': {}, 'org_sketch': {}})
+
+            data['main_sum'] += n * main_float
+            data['main_cnt'] += n
+            data['bins'][position] += n
+
+            if keep_dist:
+                if val_str in data['dist']:
+                    data['dist'][val_str] += n
+                else:
+                    data['dist'][val_str] = n
 
             if reg_key in data['reg_sum']:
-                data['reg_sum'][reg_key] += main_float
-                data['reg_cnt'][reg_key] += 1
+                data['reg_sum'][reg_key] += n * main_float
+                data['reg_cnt'][reg_key] += n
             else:
-                data['reg_sum'][reg_key] = main_float
-                data['reg_cnt'][reg_key] = 1
+                data['reg_sum'][reg_key] = n * main_float
+                data['reg_cnt'][reg_key] = n
 
             if org_key in data['org_sum']:
-                data['org_sum'][org_key] += main_float
-                data['org_cnt'][org_key] += 1
+                data['org_sum'][org_key] += n * main_float
+                data['org_cnt'][org_key] += n
             else:
-                data['org_sum'][org_key] = main_float
-                data['org_cnt'][org_key] = 1
+                data['org_sum'][org_key] = n * main_float
+                data['org_cnt'][org_key] = n
 
-    def type_yes_no_processor(self, question_id, question_data, answer):
+            _add_to_sketch(data['sketch'], main_float, n)
+            _add_to_sketch(data['reg_sketch'].setdefault(reg_key, sketches.new_sketch()), main_float, n)
+            _add_to_sketch(data['org_sketch'].setdefault(org_key, sketches.new_sketch()), main_float, n)
+        return main_float
+
+    def type_yes_no_processor(self, question_id, question_data, answer, n=1):
         q = self.question_dict[question_id]
         if q.type != Question.TYPE_YES_NO and q.type != Question.TYPE_YES_NO_JUMPING:
             raise ValueError("type_yes_no_processor doesn't process %s. Question: %s" % (q.type, q.pk))
@@ -125,19 +165,9 @@ class AbstractEvaluator(object):
             return
 
         org_key = str(answer.organization_id)
-        reg_id = answer.region_id
-        country_id = answer.country_id
-        survey_id = answer.survey_id
-
-        r = self.question_representation_link[question_id]
-
-        k0 = (survey_id, None, r.pk)
-        k1 = (survey_id, country_id, r.pk)
-        regs = [(k0, country_id), (k1, reg_id)]
 
-        for k, cur_reg_id in regs:
+        for data, cur_reg_id in self.get_stat_data(question_id, answer):
             reg_key = str(cur_reg_id)
-            data = self.question_stat[k].data
             if not data:
                 data.update({
                     'main_yes': 0,
@@ -148,24 +178,24 @@ class AbstractEvaluator(object):
                     'org_cnt': {}
                 })
 
-            data = self.question_stat[k].data
-            data['main_yes'] += yes
-            data['main_cnt'] += 1
+            data['main_yes'] += n * yes
+            data['main_cnt'] += n
             if reg_key in data['reg_yes']:
-                data['reg_yes'][reg_key] += yes
-                data['reg_cnt'][reg_key] += 1
+                data['reg_yes'][reg_key] += n * yes
+                data['reg_cnt'][reg_key] += n
             else:
-                data['reg_yes'][reg_key] = yes
-                data['reg_cnt'][reg_key] = 1
+                data['reg_yes'][reg_key] = n * yes
+                data['reg_cnt'][reg_key] = n
 
             if org_key in data['org_yes']:
-                data['org_yes'][org_key] += yes
-                data['org_cnt'][org_key] += 1
+                data['org_yes'][org_key] += n * yes
+                data['org_cnt'][org_key] += n
             else:
-                data['org_yes'][org_key] = yes
-                data['org_cnt'][org_key] = 1
+                data['org_yes'][org_key] = n * yes
+                data['org_cnt'][org_key] = n
+        return yes
 
-    def type_multiselect_top_processor(self, question_id, question_data, answer):
+    def type_multiselect_top_processor(self, question_id, question_data, answer, n=1):
         q = self.question_dict[question_id]
         if q.type != Question.TYPE_MULTISELECT_ORDERED:
             raise ValueError("type_multiselect_top_processor doesn't process %s. Question: %s" % (q.type, q.pk))
@@ -182,11 +212,11 @@ class AbstractEvaluator(object):
         top3 = []
 
         for i, opt in enumerate(options):
-            opt = opt.strip()
-            if not opt:
+            normalized = self.plan.normalize_option(opt)
+            if normalized is None:
                 continue
 
-            lower = opt.lower()
+            opt, lower = normalized
             OptionDict.register(lower, opt)
 
             if not i:
@@ -197,15 +227,9 @@ class AbstractEvaluator(object):
             if len(top3) == 3:
                 break
 
-        r = self.question_representation_link[question_id]
         org_key = str(answer.organization_id)
-        country_id = answer.country_id
-        survey_id = answer.survey_id
-        k0 = (survey_id, None, r.pk)
-        k1 = (survey_id, country_id, r.pk)
 
-        for k in [k0, k1]:
-            data = self.question_stat[k].data
+        for data, _ in self.get_stat_data(question_id, answer):
             if not data:
                 data.update({
                     'cnt': 0,
@@ -214,7 +238,7 @@ class AbstractEvaluator(object):
                     'org': {},
                 })
 
-            data['cnt'] += 1
+            data['cnt'] += n
 
             if org_key not in data['org']:
                 data['org'][org_key] = {
@@ -223,30 +247,31 @@ class AbstractEvaluator(object):
                     'top3': {},
                 }
 
-            data['org'][org_key]['cnt'] += 1
+            data['org'][org_key]['cnt'] += n
 
             if top1 in data['top1']:
-                data['top1'][top1] += 1
+                data['top1'][top1] += n
             else:
-                data['top1'][top1] = 1
+                data['top1'][top1] = n
 
             if top1 in data['org'][org_key]['top1']:
-                data['org'][org_key]['top1'][top1] += 1
+                data['org'][org_key]['top1'][top1] += n
             else:
-                data['org'][org_key]['top1'][top1] = 1
+                data['org'][org_key]['top1'][top1] = n
 
             for top_i in top3:
                 if top_i in data['top3']:
-                    data['top3'][top_i] += 1
+                    data['top3'][top_i] += n
                 else:
-                    data['top3'][top_i] = 1
+                    data['top3'][top_i] = n
 
                 if top_i in data['org'][org_key]['top3']:
-                    data['org'][org_key]['top3'][top_i] += 1
+                    data['org'][org_key]['top3'][top_i] += n
                 else:
-                    data['org'][org_key]['top3'][top_i] = 1
+                    data['org'][org_key]['top3'][top_i] = n
+        return len(top3)
 
-    def type_multiselect_processor(self, question_id, question_data, answer):
+    def type_multiselect_processor(self, question_id, question_data, answer, n=1):
         q = self.question_dict[question_id]
         if q.type != Question.TYPE_MULTISELECT_WITH_OTHER:
             raise ValueError("type_multiselect_processor doesn't process %s. Question: %s" % (q.type, q.pk))
@@ -263,25 +288,19 @@ class AbstractEvaluator(object):
         top = []
 
         for i, opt in enumerate(options):
-            opt = opt.strip()
-            if not opt:
+            normalized = self.plan.normalize_option(opt)
+            if normalized is None:
                 continue
 
-            lower = opt.lower()
+            opt, lower = normalized
             OptionDict.register(lower, opt)
 
             if lower not in top:
                 top.append(lower)
 
-        r = self.question_representation_link[question_id]
         org_key = str(answer.organization_id)
-        country_id = answer.country_id
-        survey_id = answer.survey_id
-        k0 = (survey_id, None, r.pk)
-        k1 = (survey_id, country_id, r.pk)
 
-        for k in [k0, k1]:
-            data = self.question_stat[k].data
+        for data, _ in self.get_stat_data(question_id, answer):
             if not data:
                 data.update({
                     'cnt': 0,
@@ -289,7 +308,7 @@ class AbstractEvaluator(object):
                     'org': {},
                 })
 
-            data['cnt'] += 1
+            data['cnt'] += n
 
             if org_key not in data['org']:
                 data['org'][org_key] = {
@@ -297,20 +316,21 @@ class AbstractEvaluator(object):
                     'top': {},
                 }
 
-            data['org'][org_key]['cnt'] += 1
+            data['org'][org_key]['cnt'] += n
 
             for top_i in top:
                 if top_i in data['top']:
-                    data['top'][top_i] += 1
+                    data['top'][top_i] += n
                 else:
-                    data['top'][top_i] = 1
+                    data['top'][top_i] = n
 
                 if top_i in data['org'][org_key]['top']:
-                    data['org'][org_key]['top'][top_i] += 1
+                    data['org'][org_key]['top'][top_i] += n
                 else:
-                    data['org'][org_key]['top'][top_i] = 1
+                    data['org'][org_key]['top'][top_i] = n
+        return len(top)
 
-    def type_multiselect_top5_processor(self, question_id, question_data, answer):
+    def type_multiselect_top5_processor(self, question_id, question_data, answer, n=1):
         q = self.question_dict[question_id]
         if q.type != Question.TYPE_MULTISELECT_ORDERED:
             raise ValueError("type_multiselect_top5_processor doesn't process %s. Question: %s" % (q.type, q.pk))
@@ -327,11 +347,11 @@ class AbstractEvaluator(object):
         top5 = []
 
         for i, opt in enumerate(options):
-            opt = opt.strip()
-            if not opt:
+            normalized = self.plan.normalize_option(opt)
+            if normalized is None:
                 continue
 
-            lower = opt.lower()
+            opt, lower = normalized
             OptionDict.register(lower, opt)
 
             if lower not in top5:
@@ -339,15 +359,9 @@ class AbstractEvaluator(object):
             if len(top5) == 5:
                 break
 
-        r = self.question_representation_link[question_id]
         org_key = str(answer.organization_id)
-        country_id = answer.country_id
-        survey_id = answer.survey_id
-        k0 = (survey_id, None, r.pk)
-        k1 = (survey_id, country_id, r.pk)
 
-        for k in [k0, k1]:
-            data = self.question_stat[k].data
+        for data, _ in self.get_stat_data(question_id, answer):
             if not data:
                 data.update({
                     'cnt': 0,
@@ -355,7 +369,7 @@ class AbstractEvaluator(object):
                     'org': {},
                 })
 
-            data['cnt'] += 1
+            data['cnt'] += n
 
             if org_key not in data['org']:
                 data['org'][org_key] = {
@@ -363,43 +377,157 @@ class AbstractEvaluator(object):
                     'top5': {},
                 }
 
-            data['org'][org_key]['cnt'] += 1
+            data['org'][org_key]['cnt'] += n
 
             for top_i in top5:
                 if top_i in data['top5']:
-                    data['top5'][top_i] += 1
+                    data['top5'][top_i] += n
                 else:
-                    data['top5'][top_i] = 1
+                    data['top5'][top_i] = n
 
                 if top_i in data['org'][org_key]['top5']:
-                    data['org'][org_key]['top5'][top_i] += 1
+                    data['org'][org_key]['top5'][top_i] += n
                 else:
-                    data['org'][org_key]['top5'][top_i] = 1
+                    data['org'][org_key]['top5'][top_i] = n
+        return len(top5)
+
+    def get_stat_data(self, question_id, answer):
+        """
+        Data of the question stats an answer counts to, with the region id each one breaks down by.
+
+        These are the stats of Europe and of the answer's country, and the cells of the cube
+        limited to the answer's organization, to its HCP category and to both.
+        """
+        k0, k1 = self.plan.get_stat_keys(question_id, answer.country_id)
+        regions = [(None, answer.country_id), (answer.country_id, answer.region_id)]
+        targets = [(self.question_stat[k0].data, answer.country_id), (self.question_stat[k1].data, answer.region_id)]
+        representation = self.question_representation_link[question_id]
+        for organization_id, hcp_category_id in self.get_cube_cells(answer.organization_id, answer.hcp_category_id):
+            for country_id, reg_id in regions:
+                stat = self.get_cube_stat(country_id, representation, organization_id, hcp_category_id)
+                targets.append((stat.data, reg_id))
+        return targets
+
+    def get_cube_cells(self, organization_id, hcp_category_id):
+        """
+        ``(organization_id, hcp_category_id)`` cells of the cube an answer counts to, besides the totals.
+
+        Only the cells of the slices reports asked for are kept, see CubeSlice.
+        """
+        cells = [(organization_id, None)]
+        if hcp_category_id is not None:
+            cells += [(None, hcp_category_id), (organization_id, hcp_category_id)]
+        return [cell for cell in cells if cell in self.slices]
+
+    def load_cube_cell(self, country_id, organization_id, hcp_category_id):
+        """
+        Load the stats of all representations in a cell of the cube, once per cell.
+        """
+        cell = (country_id, organization_id, hcp_category_id)
+        if not self.lookup_stats or cell in self.cube_cells:
+            return
+        self.cube_cells.add(cell)
+        quests = self.filter_stat(QuestionStat.objects.cell(organization_id, hcp_category_id)
+                                  .filter(country_id=country_id)
+                                  .select_related('representation', 'representation__question', 'country'))
+        for quest in quests:
+            quest.survey = self.survey
+            self.cube_stat[(quest.survey_id, quest.country_id, quest.representation_id,
+                            organization_id, hcp_category_id)] = quest
+
+    def get_cube_stat(self, country_id, representation, organization_id, hcp_category_id):
+        cube_key = (self.survey.pk, country_id, representation.pk, organization_id, hcp_category_id)
+        if cube_key not in self.cube_stat:
+            self.load_cube_cell(country_id, organization_id, hcp_category_id)
+        stat = self.cube_stat.get(cube_key)
+        if stat is None:
+            country = None if country_id is None else self.dimensions.get_country(self.survey, country_id)
+            stat = QuestionStat(survey=self.survey, country=country, representation=representation,
+                                organization_id=organization_id, hcp_category_id=hcp_category_id,
+                                ordering=representation.ordering,
+                                type=representation.type, generation=self.generation, data={})
+            self.cube_stat[cube_key] = stat
+        return stat
 
     def get_answers(self):
         raise NotImplementedError
 
+    def iter_answers(self, after=0):
+        """
+        Stream answers returned by get_answers in chunks of chunk_size rows, starting after the ``after`` pk.
+
+        Chunks are paginated by primary key, so every query is an index range scan
+        and only one chunk of answers is held in memory at a time.
+        """
+        answers = self.get_answers().only(*self.answer_fields).filter(pk__gt=after).order_by('pk')
+        with self.profile.phase('fetch'):
+            total = answers.count()
+        done = 0
+        last_pk = after
+        while True:
+            with self.profile.phase('fetch'):
+                chunk = self.load_bodies(list(answers.filter(pk__gt=last_pk)[:self.chunk_size]))
+            if not chunk:
+                break
+            for answer in chunk:
+                yield answer
+            done += len(chunk)
+            last_pk = chunk[-1].pk
+            logger.info("Survey %s: %s of %s answers processed", self.survey.pk, done, total)
+
+    @staticmethod
+    def load_bodies(answers):
+        """
+        Fetch body of the answers stored without data with one query, instead of a deferred load per answer.
+        """
+        missing = {answer.pk: answer for answer in answers if answer.data is None}
+        if missing:
+            for pk, body in Answer.objects.filter(pk__in=list(missing)).values_list('pk', 'body'):
+                missing[pk].body = body
+        return answers
+
+    def filter_stat(self, queryset):
+        return queryset.filter(survey=self.survey, generation=self.generation)
+
     def load_stat(self):
-        surveys = SurveyStat.objects.all()
+        surveys = self.filter_stat(SurveyStat.objects.all())
         for survey in surveys:
             self.survey_stat[(survey.survey_id, survey.country_id)] = survey
 
-        orgs = OrganizationStat.objects.all()
+        orgs = self.filter_stat(OrganizationStat.objects.all())
         for org in orgs:
             self.organization_stat[(org.survey_id, org.country_id, org.organization_id)] = org
 
-        quests = (QuestionStat.objects
-            .select_related('representation', 'representation__question', 'country', 'survey')
-            .prefetch_related('survey__organizations')
-            .all())
+        quests = self.filter_stat(QuestionStat.objects.cell()
+                                  .select_related('representation', 'representation__question', 'country'))
         for quest in quests:
+            quest.survey = self.survey
             self.question_stat[(quest.survey_id, quest.country_id, quest.representation_id)] = quest
 
-    def fill_out(self):
-        countries = list(self.survey.countries.all())
+    def get_stat_countries(self):
+        countries = list(self.dimensions.get_countries(self.survey))
         countries.append(None)
-        representations = list(Representation.objects.filter(question__survey_id=self.survey.pk).
-                               select_related('question').filter(active=True))
+        return countries
+
+    def fill_out(self):
+        with self.profile.phase('fill_out'):
+            self.fill_out_stats()
+
+    def fill_out_stats(self):
+        self.plan = get_plan(self.survey, self.dimensions)
+        self.question_dict = self.plan.questions
+        self.question_representation_link = self.plan.representations
+        self.processors = {qid: getattr(self, name) for qid, name in self.plan.processors.items()}
+        OptionDict.load_survey(self.survey.pk)
+        if self.fills_new_slices:
+            slices = list(CubeSlice.objects.registered(self.survey, before=self.slices_before))
+            self.slices = {cube_slice.cell for cube_slice in slices}
+            self.new_slices = [cube_slice.pk for cube_slice in slices if cube_slice.generation is None]
+        else:
+            self.slices = self.plan.cube_cells
+
+        countries = self.get_stat_countries()
+        representations = self.plan.representation_list
 
         for country in countries:
             # Fill out survey stat
@@ -410,14 +538,16 @@ class AbstractEvaluator(object):
             surv_key = (self.survey.pk, country_id)
 
             if surv_key not in self.survey_stat:
-                self.survey_stat[surv_key] = SurveyStat(survey=self.survey, country=country)
+                self.survey_stat[surv_key] = SurveyStat(
+                    survey=self.survey, country=country, generation=self.generation)
 
             # Fill out organizations stat
-            for org in self.survey.organizations.all():
+            for org in self.dimensions.get_organizations(self.survey):
                 org_key = (self.survey.pk, country_id, org.pk)
                 if org_key not in self.organization_stat:
                     self.organization_stat[org_key] = OrganizationStat(
-                        survey=self.survey, country=country, organization=org, ordering=org.ordering)
+                        survey=self.survey, country=country, organization=org, ordering=org.ordering,
+                        generation=self.generation)
                 else:
                     if self.organization_stat[org_key].ordering != org.ordering:
                         self.organization_stat[org_key].ordering = org.ordering
@@ -428,21 +558,20 @@ class AbstractEvaluator(object):
                 if q_key not in self.question_stat:
                     self.question_stat[q_key] = QuestionStat(
                         survey=self.survey, country=country, representation=repr,
-                        ordering=repr.ordering, type=repr.type)
+                        ordering=repr.ordering, type=repr.type, generation=self.generation)
                 else:
                     if self.question_stat[q_key].ordering != repr.ordering:
                         self.question_stat[q_key].ordering = repr.ordering
 
-                # Fill out question representation links
-                if hasattr(repr, 'question'):
-                    self.question_representation_link[repr.question.pk] = repr
-                    if repr.question.pk not in self.question_dict:
-                        self.question_dict[repr.question.pk] = repr.question
-
-    def update_survey_stat(self, surv_key, answer):
+    def update_survey_stat(self, surv_key, answer, n=1):
         survey_id, country_id = surv_key
         if surv_key not in self.survey_stat:
-            self.survey_stat[surv_key] = SurveyStat(survey_id=survey_id, country_id=country_id, last=answer.created_at)
+            self.survey_stat[surv_key] = SurveyStat(
+                survey_id=survey_id, country_id=country_id, last=answer.created_at, generation=self.generation)
+        if n < 0:
+            self.retract_survey_stat(surv_key, answer, n)
+            self.retract_survey_stat((survey_id, None), answer, n)
+            return
         self.survey_stat[surv_key].total += 1
         if self.survey_stat[surv_key].last:
             self.survey_stat[surv_key].last = max(self.survey_stat[surv_key].last, answer.created_at)
@@ -451,61 +580,121 @@ class AbstractEvaluator(object):
 
         surv_key_all = (survey_id, None)
         if surv_key_all not in self.survey_stat:
-            self.survey_stat[surv_key_all] = SurveyStat(survey_id=survey_id, country_id=None)
+            self.survey_stat[surv_key_all] = SurveyStat(
+                survey_id=survey_id, country_id=None, generation=self.generation)
         self.survey_stat[surv_key_all].total += 1
         if self.survey_stat[surv_key_all].last:
             self.survey_stat[surv_key_all].last = max(self.survey_stat[surv_key_all].last, answer.created_at)
         else:
             self.survey_stat[surv_key_all].last = answer.created_at
 
-    def update_organization_stat(self, org_key):
+    def retract_survey_stat(self, surv_key, answer, n):
+        stat = self.survey_stat[surv_key]
+        stat.total += n
+        if stat.last and stat.last <= answer.created_at:
+            # The retracted answer was the latest one, look up the latest of the others
+            answers = self.survey.answers.filter(pk__lte=self.watermark).exclude(pk=answer.pk)
+            if surv_key[1] is not None:
+                answers = answers.filter(country_id=surv_key[1])
+            stat.last = answers.aggregate(last=Max('created_at'))['last']
+
+    def update_organization_stat(self, org_key, n=1):
         survey_id, country_id, organization_id = org_key
         if org_key not in self.organization_stat:
             self.organization_stat[org_key] = OrganizationStat(
-                survey_id=survey_id, country_id=country_id, organization_id=organization_id)
-        self.organization_stat[org_key].total += 1
+                survey_id=survey_id, country_id=country_id, organization_id=organization_id, generation=self.generation)
+        self.organization_stat[org_key].total += n
 
         org_key_all = (survey_id, None, organization_id)
         if org_key_all not in self.organization_stat:
             self.organization_stat[org_key_all] = OrganizationStat(
-                survey_id=survey_id, country_id=None, organization_id=organization_id)
-        self.organization_stat[org_key_all].total += 1
+                survey_id=survey_id, country_id=None, organization_id=organization_id, generation=self.generation)
+        self.organization_stat[org_key_all].total += n
+
+    def get_trend_stat(self, country_id, period, start):
+        trend_key = (self.survey.pk, country_id, period, start)
+        stat = self.trend_stat.get(trend_key)
+        if stat is None:
+            if self.lookup_stats:
+                stat = self.filter_stat(TrendStat.objects.filter(
+                    country_id=country_id, period=period, start=start)).first()
+            if stat is None:
+                stat = TrendStat(survey_id=self.survey.pk, country_id=country_id, period=period, start=start,
+                                 generation=self.generation, data={})
+            self.trend_stat[trend_key] = stat
+        return stat
+
+    def update_trend_stats(self, answer, n=1):
+        """
+        Count the answer in the buckets of its day and week, and return them for the values of its questions.
+        """
+        trends = []
+        for period, start in TrendStat.get_buckets(answer.created_at):
+            for country_id in (answer.country_id, None):
+                stat = self.get_trend_stat(country_id, period, start)
+                stat.add_answer(answer.organization_id, n)
+                trends.append(stat)
+        return trends
 
     @staticmethod
     def parse_query_string(string):
-        return queryparser.parse(string)
+        return parse_answer_body(string)
 
     def process_dependencies(self, data):
-        if not isinstance(self.dependencies, list):
+        """
+        Set the answers the dependency rules of the survey imply, see ``Question.dependency_answer``.
+        """
+        dependencies = self.plan.dependencies
+        if not dependencies or not isinstance(data, dict):
             return
 
-        if not isinstance(data, dict):
-            return
+        for source_id, rules in dependencies.items():
+            source_data = data.get(source_id)
+            if not isinstance(source_data, dict) or '' not in source_data:
+                continue
+            selected = source_data['']
+            if isinstance(selected, str):
+                selected = [selected]
+            selected = {option.lower() for option in selected}
+            for options, target_id, answer in rules:
+                if not options.isdisjoint(selected):
+                    data[target_id] = answer
 
-        def list_lower(data):
-            return [x.lower() for x in data]
+    @classmethod
+    def get_answer_data(cls, answer):
+        """
+        Answers keyed by question id, read from the structured form when it is stored.
 
-        for dependency in self.dependencies:
-            if dependency['type'] == 'set_radio':
-                if not dependency['source'] in data:
-                    continue
-                if '' not in data[dependency['source']]:
-                    continue
-                options_set = set(list_lower(dependency['additional']['options']))
-                data_set = set(list_lower(data[dependency['source']]['']))
-                if options_set & data_set:
-                    data[dependency['target']] = dependency['additional']['anwser']
+        Older answers without it are parsed from body.
+        """
+        data = answer.get_data()
+        if data is not None:
+            return data
 
-    def process_answer(self, answer):
         if not answer.body:
-            return
+            return None
 
-        results = self.parse_query_string(answer.body)
+        results = cls.parse_query_string(answer.body)
         if 'data' not in results:
             raise KeyError("There is no data in post results. Answer: %s" % answer.pk)
+        return results['data']
+
+    def process_answer(self, answer, n=1):
+        """
+        Count an answer in the stats it belongs to, or take it out of them again with ``n=-1``.
+        """
+        start = perf_counter()
+        data = self.get_answer_data(answer)
+        parsed, queries = perf_counter(), self.profile.get_queries()
+        self.profile.add('parse', parsed - start)
+        if data is None:
+            return
+        try:
+            self.process_data(answer, data, n)
+        finally:
+            self.profile.add('process', perf_counter() - parsed, self.profile.get_queries() - queries)
 
-        data = results['data']
-
+    def process_data(self, answer, data, n=1):
         self.process_dependencies(data)
 
         if type(data) != dict:
@@ -516,61 +705,940 @@ class AbstractEvaluator(object):
         organization_id = answer.organization_id
 
         surv_key = (survey_id, country_id)
-        self.update_survey_stat(surv_key, answer)
+        self.update_survey_stat(surv_key, answer, n)
 
         org_key = (survey_id, country_id, organization_id)
-        self.update_organization_stat(org_key)
+        self.update_organization_stat(org_key, n)
+        trends = self.update_trend_stats(answer, n)
 
         for qid, question_data in data.items():
-            if qid not in self.question_dict:
-                logger.warning("Question %s is not expected" % qid)
-                continue
-            if qid not in self.question_representation_link:
-                logger.warning("Question %s is not connected to any of representations" % qid)
-                continue
-            repr = self.question_representation_link[qid]
-            processor = "%s_processor" % repr.type
-            getattr(self, processor)(qid, question_data, answer)
+            processor = self.processors.get(qid)
+            if processor is None:
+                if qid not in self.question_dict:
+                    logger.warning("Question %s is not expected" % qid)
+                    continue
+                raise ValueError("Representation type %s has no processor. Question: %s"
+                                 % (self.question_representation_link[qid].type, qid))
+            # Processors return the value they counted, None for skipped answers
+            value = processor(qid, question_data, answer, n)
+            if value is not None:
+                representation = self.question_representation_link[qid]
+                for trend in trends:
+                    trend.add_value(representation.pk, n * value, n)
+                if n < 0:
+                    for stat_data, _ in self.get_stat_data(qid, answer):
+                        prune_stat_data(representation.type, stat_data)
+
+    def get_generation(self):
+        """
+        Generation of the stats the evaluator loads and writes, the one reports read.
+        """
+        return self.survey.stat_generation
+
+    def get_watermark(self):
+        """
+        Id of the last answer included in the loaded stats, kept in the Europe survey stat.
+        """
+        stat = self.survey_stat.get((self.survey.pk, None))
+        return stat.watermark if stat is not None else 0
+
+    def get_recent(self):
+        """
+        Ids of the answers above the watermark that are included in the loaded stats.
+        """
+        stat = self.survey_stat.get((self.survey.pk, None))
+        return set(stat.recent) if stat is not None else set()
 
-        answer.is_updated = True
-        answer.save(update_fields=['is_updated'])
+    @staticmethod
+    def get_cutoff(started=None):
+        """
+        Submission time of the answers that were committed, or never will be, when a run started.
+
+        Submissions don't wait for evaluations, so an answer can commit after answers with
+        higher ids were evaluated. Only answers submitted before the cutoff move the
+        watermark, the others are kept in recent and the next evaluation reads the ones
+        that committed late.
+        """
+        return (started or timezone.now()) - timedelta(seconds=settings.REPORTS_SUBMISSION_TIMEOUT)
+
+    def mark_evaluated(self, answer):
+        if answer.created_at < self.cutoff:
+            self.watermark = max(self.watermark, answer.pk)
+        else:
+            self.recent.add(answer.pk)
+
+    def settle(self):
+        """
+        Move the watermark up to the last answer submitted before the cutoff.
+
+        All answers with lower ids were committed when the run started, so they are
+        included in the stats already or were evaluated by this run.
+        """
+        if self.recent:
+            last = (self.survey.answers.filter(pk__gt=self.watermark, pk__lte=max(self.recent),
+                                               created_at__lt=self.cutoff)
+                    .aggregate(last=Max('pk'))['last'])
+            self.watermark = max(self.watermark, last or 0)
+        self.recent = {pk for pk in self.recent if pk > self.watermark}
+
+    def get_option_keys(self):
+        keys = set()
+        for quest_stat in chain(self.question_stat.values(), self.cube_stat.values()):
+            for name in ('top', 'top1', 'top3', 'top5'):
+                keys.update(quest_stat.data.get(name, ()))
+        return keys
 
     def save(self):
-        for surv_stat in self.survey_stat.values():
-            surv_stat.save()
-        for org_stat in self.organization_stat.values():
-            org_stat.save()
-        for quest_stat in self.question_stat.values():
-            quest_stat.update_vars()
-            quest_stat.save()
+        with self.profile.phase('update_vars'):
+            OptionDict.flush()
+            OptionDict.load(self.get_option_keys())
+            for quest_stat in chain(self.question_stat.values(), self.cube_stat.values()):
+                quest_stat.dimensions = self.dimensions
+                quest_stat.update_vars()
+        with self.profile.phase('save'):
+            self.save_stats()
+
+    def save_stats(self):
+        if self.settles:
+            self.settle()
+        stat = self.survey_stat.get((self.survey.pk, None))
+        if stat is not None:
+            stat.watermark = max(stat.watermark, self.watermark)
+            stat.recent = sorted(pk for pk in self.recent if pk > stat.watermark)
+
+        written = list(chain(
+            bulk_save(self.survey_stat.values()),
+            bulk_save(self.organization_stat.values()),
+            bulk_save(self.question_stat.values()),
+            bulk_save(stat for stat in self.cube_stat.values() if stat.data),
+            bulk_save(stat for stat in self.trend_stat.values() if stat.total),
+        ))
+        self.profile.json_bytes += get_json_size(written)
+        # Cells and buckets that retracted answers left empty are dropped, like they were never counted
+        empty_cells = [stat.pk for stat in self.cube_stat.values() if stat.pk is not None and not stat.data]
+        if empty_cells:
+            QuestionStat.objects.filter(pk__in=empty_cells).delete()
+        empty_trends = [stat.pk for stat in self.trend_stat.values() if stat.pk is not None and not stat.total]
+        if empty_trends:
+            TrendStat.objects.filter(pk__in=empty_trends).delete()
+        if self.new_slices:
+            CubeSlice.objects.filter(pk__in=self.new_slices).update(generation=self.generation)
+            invalidate_plan(self.survey.pk)
+        if self.generation != self.survey.stat_generation:
+            self.survey.switch_stat_generation(self.generation)
 
-    @classmethod
-    @transaction.atomic
-    def process_answers(cls, survey):
-        evaluator = cls(survey)
-        evaluator.fill_out()
-        answers = evaluator.get_answers()
+    @staticmethod
+    def lock_survey(survey, nowait=False):
+        """
+        Lock the survey row until the end of the transaction.
+
+        Every evaluation of a survey takes this lock first, so live updates of single
+        answers and batch runs never write the same stats concurrently. Submissions
+        don't wait for it, see ``get_cutoff`` for answers that commit out of order.
+        """
+        survey.lock(nowait=nowait)
+
+    def evaluate(self, answers):
         for answer in answers:
+            # Answers that can't be processed are passed too, they'd fail on every run
+            self.mark_evaluated(answer)
+            self.profile.answers += 1
             try:
-                evaluator.process_answer(answer)
+                self.process_answer(answer)
             except Exception as e:
-                evaluator.messages.append(str(e))
+                self.messages.append(str(e))
                 logger.warning("Answer can't be processed. Exception: %s" % e)
 
+    def retract(self, answers):
+        """
+        Take answers that were evaluated before out of the stats.
+        """
+        for answer in answers:
+            self.profile.answers += 1
+            self.recent.discard(answer.pk)
+            try:
+                self.process_answer(answer, n=-1)
+            except Exception as e:
+                self.messages.append(str(e))
+                logger.warning("Answer can't be retracted. Exception: %s" % e)
+
+    def merge_partial(self, partial):
+        """
+        Add the stats a ShardEvaluator built for a range of answers.
+        """
+        with self.profile.phase('merge'):
+            self.merge_stats(partial)
+        if partial.get('profile'):
+            self.profile.merge(partial['profile'])
+
+    def merge_stats(self, partial):
+        for (survey_id, country_id), (total, last) in partial['survey'].items():
+            surv_key = (survey_id, country_id)
+            if surv_key not in self.survey_stat:
+                self.survey_stat[surv_key] = SurveyStat(survey_id=survey_id, country_id=country_id,
+                                                        generation=self.generation)
+            stat = self.survey_stat[surv_key]
+            stat.total += total
+            stat.last = max(stat.last, last) if stat.last else last
+
+        for org_key, total in partial['organization'].items():
+            if org_key not in self.organization_stat:
+                survey_id, country_id, organization_id = org_key
+                self.organization_stat[org_key] = OrganizationStat(
+                    survey_id=survey_id, country_id=country_id, organization_id=organization_id,
+                    generation=self.generation)
+            self.organization_stat[org_key].total += total
+
+        for q_key, data in partial['question'].items():
+            stat = self.question_stat[q_key]
+            merge_stat_data(stat.type, stat.data, data)
+
+        representations = {r.pk: r for r in self.plan.representation_list}
+        for (_, country_id, representation_id, organization_id, hcp_category_id), data in partial['cube'].items():
+            stat = self.get_cube_stat(country_id, representations[representation_id], organization_id,
+                                      hcp_category_id)
+            merge_stat_data(stat.type, stat.data, data)
+
+        for (survey_id, country_id, period, start), (total, data) in partial['trend'].items():
+            stat = self.get_trend_stat(country_id, period, start)
+            stat.total += total
+            merge_counters(stat.data, data)
+
+        self.messages += partial['messages']
+        self.watermark = max(self.watermark, partial['watermark'])
+        self.recent.update(partial['recent'])
+        for lower, original in partial['options'].items():
+            OptionDict.register(lower, original)
+
+    @classmethod
+    @transaction.atomic
+    def process_answers(cls, survey, dimensions=None):
+        cls.lock_survey(survey)
+        evaluator = cls(survey, dimensions=dimensions)
+        evaluator.fill_out()
+        evaluator.evaluate(evaluator.iter_answers())
         evaluator.save()
         return evaluator
 
+    @classmethod
+    def process_surveys(cls, surveys):
+        """
+        Evaluate several surveys in one pass.
+
+        Every survey is processed in its own transaction, but countries, regions and
+        organizations are looked up once and shared by all of them.
+        """
+        dimensions = Dimensions()
+        return [cls.process_answers(survey, dimensions=dimensions) for survey in surveys]
+
 
 class TotalEvaluator(AbstractEvaluator):
-    def __init__(self, survey):
-        survey.clear_stats()
+    """
+    Evaluator recalculating all answers of a survey into a new generation of stats.
+
+    Reports keep reading the current generation until ``save`` switches them to the new one.
+    """
+    # Number of answers evaluated per committed chunk by process_chunked
+    checkpoint_size = 5000
+    fills_new_slices = True
 
-        super().__init__(survey)
+    def get_generation(self):
+        return self.survey.stat_generation + 1
 
     def get_answers(self):
         return self.survey.answers.all()
 
+    @staticmethod
+    def get_shard_ranges(survey, shards):
+        """
+        Split the answers of the survey into at most ``shards`` pk ranges ``(after, last)`` of equal size.
+        """
+        pks = survey.answers.order_by('pk').values_list('pk', flat=True)
+        total = pks.count()
+        if not total:
+            return []
+        size = -(-total // shards)
+        bounds = [pks[i - 1] if i else 0 for i in range(0, total, size)]
+        bounds.append(pks[total - 1])
+        return list(zip(bounds, bounds[1:]))
+
+    @classmethod
+    def process_sharded(cls, survey, processes=None, dimensions=None):
+        """
+        Recalculate the stats of the survey, evaluating ranges of answers in parallel processes.
+
+        Workers open their own database connections, so this can't run inside a transaction.
+        Answers submitted while the workers run are evaluated when the results are merged.
+        A chunked run that was interrupted is resumed instead, see ``process_chunked``.
+        """
+        started = perf_counter()
+        # The workers and the merge judge the answers and the slices by the start of the run
+        cutoff = cls.get_cutoff()
+        slices_before = timezone.now()
+        processes = processes or os.cpu_count()
+        if processes < 2:
+            return cls.process_answers(survey, dimensions=dimensions)
+        checkpoint = EvaluationCheckpoint.objects.filter(survey=survey).first()
+        if checkpoint is not None and (checkpoint.state or checkpoint.after < checkpoint.last):
+            # The checkpoint of an interrupted chunked run is resumed rather than thrown away
+            logger.info("Survey %s: resuming the chunked recalculation at answer %s", survey.pk, checkpoint.after)
+            return cls.process_chunked(survey, dimensions=dimensions)
+        ranges = cls.get_shard_ranges(survey, processes)
+        if len(ranges) < 2:
+            return cls.process_answers(survey, dimensions=dimensions)
+
+        if connection.in_atomic_block:
+            raise TransactionManagementError("Sharded evaluation can't run inside a transaction")
+        # Answers the workers count and that are edited or deleted meanwhile are recorded by retract_answer
+        EvaluationCheckpoint.objects.update_or_create(survey=survey, defaults={
+            'after': ranges[-1][1], 'last': ranges[-1][1], 'representations': [], 'state': {}, 'retracted': []})
+        # Forked workers must not share the connections of this process
+        connections.close_all()
+        with multiprocessing.get_context('fork').Pool(len(ranges)) as pool:
+            partials = pool.map(_evaluate_shard, [(survey.pk, after, last, cutoff, slices_before)
+                                                  for after, last in ranges])
+
+        with transaction.atomic():
+            cls.lock_survey(survey)
+            checkpoint = EvaluationCheckpoint.objects.select_for_update().filter(survey=survey).first()
+            evaluator = cls(survey, dimensions=dimensions)
+            # The run is timed from the start of the workers, their phases are merged with the results
+            evaluator.profile.started = started
+            evaluator.cutoff = cutoff
+            evaluator.slices_before = slices_before
+            evaluator.fill_out()
+            for partial in partials:
+                evaluator.merge_partial(partial)
+            if checkpoint is not None:
+                evaluator.apply_retracted(checkpoint)
+                checkpoint.delete()
+            evaluator.evaluate(evaluator.iter_answers(after=ranges[-1][1]))
+            evaluator.save()
+        return evaluator
+
+    def apply_retracted(self, checkpoint):
+        """
+        Take the answers edited or deleted during the run out of the merged stats, and count the edited ones again.
+        """
+        originals = checkpoint.get_retracted()
+        if not originals:
+            return
+        self.retract(originals)
+        edited = self.survey.answers.filter(pk__in=[a.pk for a in originals], pk__lte=checkpoint.after)
+        self.evaluate(self.load_bodies(list(edited.only(*self.answer_fields).order_by('pk'))))
+
+    @staticmethod
+    def get_representation_keys(evaluator):
+        """
+        Representations with what shapes their stats, partial stats of other keys can't be merged.
+        """
+        keys = []
+        for r in evaluator.plan.representation_list:
+            spec = evaluator.plan.dist_specs.get(r.question_id)
+            keys.append([r.pk, r.type, None if spec is None else [list(spec[0]), spec[1]]])
+        return sorted(keys)
+
+    @classmethod
+    def process_chunked(cls, survey, checkpoint_size=None, dimensions=None):
+        """
+        Recalculate the stats of the survey in chunks of answers, each committed with a checkpoint.
+
+        The partial stats are kept in the EvaluationCheckpoint of the survey, so a run
+        that was interrupted resumes from the last chunk. The stats themselves are
+        replaced in one last transaction, readers see the previous stats until then.
+        """
+        if connection.in_atomic_block:
+            raise TransactionManagementError("Chunked evaluation can't run inside a transaction")
+        checkpoint_size = checkpoint_size or cls.checkpoint_size
+        dimensions = dimensions or Dimensions()
+        started = perf_counter()
+
+        while True:
+            with transaction.atomic():
+                checkpoint = EvaluationCheckpoint.objects.select_for_update().filter(survey=survey).first()
+                if checkpoint is None:
+                    last = survey.answers.aggregate(last=Max('pk'))['last'] or 0
+                    checkpoint = EvaluationCheckpoint.objects.create(survey=survey, last=last)
+                if checkpoint.after >= checkpoint.last:
+                    break
+
+                pks = list(survey.answers.filter(pk__gt=checkpoint.after, pk__lte=checkpoint.last)
+                           .order_by('pk').values_list('pk', flat=True)[checkpoint_size - 1:checkpoint_size])
+                chunk_last = pks[0] if pks else checkpoint.last
+
+                evaluator = ShardEvaluator(survey, checkpoint.after, chunk_last, dimensions=dimensions)
+                # Every chunk judges the answers and the slices by the start of the run
+                evaluator.cutoff = cls.get_cutoff(checkpoint.started_at)
+                evaluator.slices_before = checkpoint.started_at
+                evaluator.fill_out()
+                representations = cls.get_representation_keys(evaluator)
+                partial = checkpoint.get_partial()
+                if partial is not None and checkpoint.representations != representations:
+                    logger.info("Survey %s: representations changed, recalculation starts anew", survey.pk)
+                    checkpoint.delete()
+                    continue
+                if partial is not None:
+                    evaluator.merge_partial(partial)
+                evaluator.evaluate(evaluator.iter_answers())
+
+                checkpoint.after = chunk_last
+                checkpoint.representations = representations
+                checkpoint.set_partial(evaluator.get_partial())
+                checkpoint.save(update_fields=['after', 'representations', 'state', 'updated_at'])
+                logger.info("Survey %s: checkpoint at answer %s of %s", survey.pk, chunk_last, checkpoint.last)
+
+        with transaction.atomic():
+            cls.lock_survey(survey)
+            checkpoint = EvaluationCheckpoint.objects.select_for_update().get(survey=survey)
+            evaluator = cls(survey, dimensions=dimensions)
+            # The phases of the chunks are merged with the partial stats, the run is timed from the first one
+            evaluator.profile.started = started
+            evaluator.cutoff = cls.get_cutoff(checkpoint.started_at)
+            evaluator.slices_before = checkpoint.started_at
+            evaluator.fill_out()
+            partial = checkpoint.get_partial()
+            if partial is not None and checkpoint.representations == cls.get_representation_keys(evaluator):
+                evaluator.merge_partial(partial)
+                evaluator.apply_retracted(checkpoint)
+                evaluator.evaluate(evaluator.iter_answers(after=checkpoint.after))
+            else:
+                evaluator.evaluate(evaluator.iter_answers())
+            evaluator.save()
+            checkpoint.delete()
+        return evaluator
+
+
+class ShardEvaluator(AbstractEvaluator):
+    """
+    Evaluator of the answers in a pk range, building partial stats for TotalEvaluator.process_sharded.
+
+    It starts from empty stats and writes nothing, the results are returned by ``get_partial``.
+    """
+    fills_new_slices = True
+
+    def __init__(self, survey, after, last, dimensions=None):
+        self.after = after
+        self.last = last
+        super().__init__(survey, dimensions=dimensions)
+        self.lookup_stats = False
+
+    def load_stat(self):
+        pass
+
+    def get_answers(self):
+        return self.survey.answers.filter(pk__gt=self.after, pk__lte=self.last)
+
+    def get_partial(self):
+        return {
+            'survey': {k: (s.total, s.last) for k, s in self.survey_stat.items() if s.total},
+            'organization': {k: s.total for k, s in self.organization_stat.items() if s.total},
+            'question': {k: s.data for k, s in self.question_stat.items() if s.data},
+            'cube': {k: s.data for k, s in self.cube_stat.items() if s.data},
+            'trend': {k: (s.total, s.data) for k, s in self.trend_stat.items()},
+            'messages': self.messages,
+            'watermark': self.watermark,
+            'recent': sorted(self.recent),
+            'profile': self.profile.to_dict(),
+            # Options registered by the worker, inserted by the process merging the results
+            'options': {lower: od.original for lower, od in OptionDict.pending.items()},
+        }
+
+
+def _evaluate_shard(args):
+    survey_id, after, last, cutoff, slices_before = args
+    try:
+        evaluator = ShardEvaluator(Survey.objects.get(pk=survey_id), after, last)
+        evaluator.cutoff = cutoff
+        evaluator.slices_before = slices_before
+        evaluator.fill_out()
+        evaluator.evaluate(evaluator.iter_answers())
+        return evaluator.get_partial()
+    finally:
+        connections.close_all()
+
 
 class LastEvaluator(AbstractEvaluator):
     def get_answers(self):
-        return self.survey.answers.filter(is_updated=False)
+        return self.survey.answers.filter(pk__gt=self.watermark).exclude(pk__in=list(self.recent))
+
+
+class LiveEvaluator(AbstractEvaluator):
+    """
+    Evaluator applying a single submitted, edited or deleted answer to the stats it affects.
+
+    Only the Europe and the answer's country stats are loaded and saved, so the
+    cost does not depend on the size of the survey.
+    """
+    # Fields of an answer the stats depend on, saving an answer without changes to them keeps the stats
+    evaluated_fields = ('survey_id', 'country_id', 'region_id', 'organization_id', 'hcp_category_id',
+                        'created_at', 'body', 'data')
+    # Surveys being deleted, their answers are not retracted one by one as the stats go too
+    deleted_surveys = set()
+    # Answers below the one applied may not be evaluated yet
+    settles = False
+
+    def __init__(self, survey, answer, dimensions=None, original=None):
+        self.answer = answer
+        # Whether all answers below the applied one are included in the stats
+        self.caught_up = False
+        # The stored version of an edited answer, its country may differ
+        self.country_ids = {answer.country_id}
+        if original is not None:
+            self.country_ids.add(original.country_id)
+        super().__init__(survey, dimensions=dimensions)
+
+    def get_answers(self):
+        return self.survey.answers.filter(pk=self.answer.pk)
+
+    def mark_evaluated(self, answer):
+        if self.caught_up:
+            super().mark_evaluated(answer)
+        elif answer.pk > self.watermark:
+            self.recent.add(answer.pk)
+
+    def get_stat_countries(self):
+        countries = [c for c in self.dimensions.get_countries(self.survey) if c.pk in self.country_ids]
+        countries.append(None)
+        return countries
+
+    def filter_stat(self, queryset):
+        return (super().filter_stat(queryset)
+                .filter(Q(country__isnull=True) | Q(country_id__in=self.country_ids)))
+
+    @classmethod
+    def apply_answer(cls, answer):
+        locked = False
+        try:
+            with transaction.atomic():
+                # Runs in the transaction of the submission, which doesn't wait for evaluations
+                cls.lock_survey(answer.survey, nowait=True)
+                locked = True
+                evaluator = cls(answer.survey, answer)
+                earlier = (answer.survey.answers.filter(pk__gt=evaluator.watermark, pk__lt=answer.pk)
+                           .exclude(pk__in=list(evaluator.recent)))
+                if earlier.exists():
+                    # Earlier answers were not applied, catch up with all of them
+                    evaluator = LastEvaluator.process_answers(answer.survey)
+                else:
+                    evaluator.caught_up = True
+                    evaluator.fill_out()
+                    evaluator.evaluate([answer])
+                    evaluator.save()
+                for message in evaluator.messages:
+                    logger.warning(message)
+        except Exception as e:
+            # The watermark stays below the answer, so the next evaluation picks it up
+            if not locked:
+                logger.info("Survey %s is being evaluated, answer %s is left to the next evaluation",
+                            answer.survey_id, answer.pk)
+            else:
+                logger.warning("Answer %s can't be applied to stats. Exception: %s" % (answer.pk, e))
+
+    @classmethod
+    def retract_answer(cls, original, answer=None):
+        """
+        Take a deleted or edited answer out of the stats, and count the edited ``answer`` instead.
+
+        Answers above the watermark that are not in recent are not in the stats yet, the next evaluation
+        reads them as they are.
+        """
+        try:
+            with transaction.atomic():
+                survey = Survey.objects.get(pk=original.survey_id)
+                cls.lock_survey(survey)
+                # A recalculation in progress has evaluated the original already, it is retracted when it finishes
+                checkpoint = (EvaluationCheckpoint.objects.select_for_update()
+                              .filter(survey=survey, after__gte=original.pk).first())
+                if checkpoint is not None:
+                    checkpoint.add_retracted(original)
+                stat = SurveyStat.objects.current(survey).filter(country=None).first()
+                if stat is None or (original.pk > stat.watermark and original.pk not in stat.recent):
+                    return
+                evaluator = cls(survey, answer or original, original=original)
+                evaluator.fill_out()
+                evaluator.retract([original])
+                if answer is not None:
+                    evaluator.evaluate([answer])
+                evaluator.save()
+                for message in evaluator.messages:
+                    logger.warning(message)
+        except Exception as e:
+            logger.warning("Answer %s can't be retracted from stats. Exception: %s" % (original.pk, e))
+
+    @classmethod
+    def on_answer_saving(cls, sender, instance, raw=False, **kwargs):
+        if instance.pk is not None and not raw:
+            # Remember the stored version, post_save retracts it if the answer changed
+            instance._stored_answer = Answer.objects.filter(pk=instance.pk).first()
+
+    @classmethod
+    def on_answer_saved(cls, sender, instance, created, raw=False, **kwargs):
+        if raw:
+            return
+        if created:
+            if settings.REPORTS_LIVE_STATS:
+                cls.apply_answer(instance)
+            return
+        original = getattr(instance, '_stored_answer', None)
+        instance._stored_answer = None
+        if original is None:
+            return
+        if all(getattr(original, name) == getattr(instance, name) for name in cls.evaluated_fields):
+            return
+        AnswerValue.objects.filter(answer=instance).delete()
+        ExpandedAnswer.objects.filter(answer=instance).delete()
+        if original.survey_id == instance.survey_id:
+            cls.retract_answer(original, instance)
+        else:
+            cls.retract_answer(original)
+
+    @classmethod
+    def on_answer_deleted(cls, sender, instance, **kwargs):
+        if instance.survey_id not in cls.deleted_surveys:
+            cls.retract_answer(instance)
+
+    @classmethod
+    def on_survey_deleting(cls, sender, instance, **kwargs):
+        cls.deleted_surveys.add(instance.pk)
+
+    @classmethod
+    def on_survey_deleted(cls, sender, instance, **kwargs):
+        cls.deleted_surveys.discard(instance.pk)
+
+
+def _add_to_sketch(sketch, value, n):
+    if n > 0:
+        sketches.add(sketch, value, n)
+    else:
+        sketches.remove(sketch, value, -n)
+
+
+def _increment(counter, key, n):
+    counter[key] = counter.get(key, 0) + n
+
+
+class AggregateEvaluator(AbstractEvaluator):
+    """
+    Evaluator that computes stats with GROUP BY queries over AnswerValue rows.
+
+    Answers are expanded into AnswerValue rows once, so a full recompute of a survey
+    runs a few aggregate queries instead of processing every answer in Python.
+    The stats are rebuilt in place and have the same layout as the processors produce.
+    Total recalculations use it with REPORTS_AGGREGATE_TOTALS or ``recalculate --aggregate``.
+    """
+    CHOICE_TYPES = (Question.TYPE_YES_NO, Question.TYPE_YES_NO_JUMPING)
+    fills_new_slices = True
+    OPTION_TYPES = (Question.TYPE_MULTISELECT_ORDERED, Question.TYPE_MULTISELECT_WITH_OTHER)
+
+    def get_answers(self):
+        # Answers without any values are recorded as expanded too, they are not parsed again
+        return self.survey.answers.filter(expanded__isnull=True)
+
+    @staticmethod
+    def is_number_question(q):
+        if q.type == Question.TYPE_SIMPLE_INPUT:
+            return q.field in (Question.FIELD_PERCENT, Question.FIELD_NUMBER)
+        return q.type == Question.TYPE_TWO_DEPENDEND_FIELDS
+
+    def expand_answer(self, answer, questions):
+        data = self.get_answer_data(answer)
+        if data is None:
+            return []
+        if answer.data is None:
+            Answer.objects.filter(pk=answer.pk).update(data=normalize_answer_data(data))
+
+        self.process_dependencies(data)
+
+        if not isinstance(data, dict):
+            raise KeyError("Answer data should be dict. Answer: %s" % answer.pk)
+
+        values = []
+
+        def add(question, **kwargs):
+            values.append(AnswerValue(
+                answer_id=answer.pk, survey_id=answer.survey_id, question_id=question.pk,
+                country_id=answer.country_id, region_id=answer.region_id,
+                organization_id=answer.organization_id, **kwargs))
+
+        for qid, question_data in data.items():
+            q = questions.get(qid)
+            if q is None:
+                continue
+
+            if q.type in self.CHOICE_TYPES:
+                result = question_data.strip() if isinstance(question_data, str) else ''
+                if result in ('Yes', 'No'):
+                    add(q, value=1 if result == 'Yes' else 0)
+
+            elif self.is_number_question(q) and isinstance(question_data, dict):
+                main_str = question_data.get('main', '').strip()
+                additional_str = question_data.get('additional', '').strip()
+                try:
+                    if main_str:
+                        add(q, value=float(main_str), option=main_str)
+                    elif additional_str:
+                        add(q, value=float(additional_str) * 10, option=str(int(additional_str) * 10))
+                except ValueError as e:
+                    self.messages.append("Answer %s, Question %s: %s" % (answer.pk, q.pk, e))
+
+            elif q.type in self.OPTION_TYPES and isinstance(question_data, dict):
+                options = question_data.get('') or []
+                if isinstance(options, str):
+                    options = [options]
+                ranked = []
+                for opt in options:
+                    opt = str(opt).strip()
+                    lower = opt.lower()
+                    if lower and lower not in ranked:
+                        OptionDict.register(lower, opt)
+                        ranked.append(lower)
+                for rank, lower in enumerate(ranked):
+                    add(q, option=lower, rank=rank)
+
+        return values
+
+    def expand_answers(self):
+        """Create AnswerValue rows for answers that were not expanded yet"""
+        questions = {q.pk: q for q in self.survey.questions.all()}
+        values = []
+        expanded = []
+        for answer in self.iter_answers():
+            # Timed without fetching, which iter_answers records itself
+            with self.profile.phase('expand'):
+                # Answers that can't be expanded are recorded too, they'd fail on every run
+                expanded.append(ExpandedAnswer(answer_id=answer.pk))
+                try:
+                    values += self.expand_answer(answer, questions)
+                except Exception as e:
+                    self.messages.append(str(e))
+                    logger.warning("Answer can't be expanded. Exception: %s" % e)
+                if len(values) >= self.chunk_size or len(expanded) >= self.chunk_size:
+                    AnswerValue.objects.bulk_create(values)
+                    ExpandedAnswer.objects.bulk_create(expanded)
+                    values = []
+                    expanded = []
+        with self.profile.phase('expand'):
+            AnswerValue.objects.bulk_create(values)
+            ExpandedAnswer.objects.bulk_create(expanded)
+
+    def reset_stats(self):
+        for surv_stat in self.survey_stat.values():
+            surv_stat.total = 0
+            surv_stat.last = None
+        for org_stat in self.organization_stat.values():
+            org_stat.total = 0
+        for quest_stat in self.question_stat.values():
+            quest_stat.data = {}
+        # Cube and trend stats are rebuilt from scratch, there is one per cell and bucket the answers fall into
+        self.filter_stat(QuestionStat.objects.exclude(organization__isnull=True, hcp_category__isnull=True)).delete()
+        self.filter_stat(TrendStat.objects.all()).delete()
+        self.cube_stat = {}
+        self.trend_stat = {}
+        self.lookup_stats = False
+
+    def aggregate_answers(self):
+        survey_id = self.survey.pk
+        # The aggregates include every committed answer, the ones submitted after the cutoff stay recent
+        last_pk = self.survey.answers.filter(created_at__lt=self.cutoff).aggregate(last_pk=Max('pk'))['last_pk']
+        self.watermark = max(self.watermark, last_pk or 0)
+        self.recent.update(self.survey.answers.filter(pk__gt=self.watermark).values_list('pk', flat=True))
+        rows = (self.survey.answers.filter(data__isnull=False)
+                .values('country', 'organization')
+                .annotate(total=Count('id'), last=Max('created_at'))
+                .order_by())
+        for row in rows:
+            self.profile.answers += row['total']
+            for country_id in (row['country'], None):
+                surv_key = (survey_id, country_id)
+                if surv_key not in self.survey_stat:
+                    self.survey_stat[surv_key] = SurveyStat(survey_id=survey_id, country_id=country_id,
+                                                            generation=self.generation)
+                surv_stat = self.survey_stat[surv_key]
+                surv_stat.total += row['total']
+                surv_stat.last = max(surv_stat.last, row['last']) if surv_stat.last else row['last']
+
+                org_key = (survey_id, country_id, row['organization'])
+                if org_key not in self.organization_stat:
+                    self.organization_stat[org_key] = OrganizationStat(
+                        survey_id=survey_id, country_id=country_id, organization_id=row['organization'],
+                        generation=self.generation)
+                self.organization_stat[org_key].total += row['total']
+
+    def get_targets(self, question_id, country_id, region_id, organization_id, hcp_category_id):
+        """QuestionStat data dicts a group of values counts to, with the region key used by each"""
+        r = self.question_representation_link.get(question_id)
+        if r is None:
+            return r, []
+        targets = []
+        regions = []
+        for k, reg_key in [((self.survey.pk, None, r.pk), country_id), ((self.survey.pk, country_id, r.pk), region_id)]:
+            if k in self.question_stat:
+                targets.append((self.question_stat[k].data, str(reg_key)))
+                regions.append((k[1], reg_key))
+        for cell_organization_id, cell_hcp_category_id in self.get_cube_cells(organization_id, hcp_category_id):
+            for cell_country_id, reg_key in regions:
+                stat = self.get_cube_stat(cell_country_id, r, cell_organization_id, cell_hcp_category_id)
+                targets.append((stat.data, str(reg_key)))
+        return r, targets
+
+    def aggregate_scalars(self):
+        rows = (AnswerValue.objects.filter(survey=self.survey, rank__isnull=True)
+                .values('question', 'country', 'region', 'organization', 'answer__hcp_category', 'option')
+                .annotate(cnt=Count('id'), total=Sum('value'))
+                .order_by())
+        for row in rows:
+            r, targets = self.get_targets(row['question'], row['country'], row['region'], row['organization'],
+                                          row['answer__hcp_category'])
+            org_key = str(row['organization'])
+            cnt = row['cnt']
+            for data, reg_key in targets:
+                if r.type == Representation.TYPE_YES_NO and row['option'] is None:
+                    yes = int(row['total'])
+                    if not data:
+                        data.update({'main_yes': 0, 'main_cnt': 0, 'reg_yes': {}, 'reg_cnt': {},
+                                     'org_yes': {}, 'org_cnt': {}})
+                    data['main_yes'] += yes
+                    data['main_cnt'] += cnt
+                    _increment(data['reg_yes'], reg_key, yes)
+                    _increment(data['reg_cnt'], reg_key, cnt)
+                    _increment(data['org_yes'], org_key, yes)
+                    _increment(data['org_cnt'], org_key, cnt)
+
+                elif r.type == Representation.TYPE_AVERAGE_PERCENT and row['option'] is not None:
+                    total = row['total']
+                    spec, keep_dist = self.plan.dist_specs[row['question']]
+                    if not data:
+                        data.update(new_average_data(spec, keep_dist))
+                    data['main_sum'] += total
+                    data['main_cnt'] += cnt
+                    data['bins'][QuestionStat.get_dist_position(row['option'], *spec)] += cnt
+                    if keep_dist:
+                        _increment(data['dist'], row['option'], cnt)
+                    _increment(data['reg_sum'], reg_key, total)
+                    _increment(data['reg_cnt'], reg_key, cnt)
+                    _increment(data['org_sum'], org_key, total)
+                    _increment(data['org_cnt'], org_key, cnt)
+                    value = float(row['option'])
+                    sketches.add(data['sketch'], value, cnt)
+                    sketches.add(data['reg_sketch'].setdefault(reg_key, sketches.new_sketch()), value, cnt)
+                    sketches.add(data['org_sketch'].setdefault(org_key, sketches.new_sketch()), value, cnt)
+
+    def aggregate_options(self):
+        def ranked(limit):
+            return Sum(Case(When(rank__lt=limit, then=1), default=0, output_field=IntegerField()))
+
+        values = AnswerValue.objects.filter(survey=self.survey, rank__isnull=False)
+        tops = {
+            Representation.TYPE_MULTISELECT: ('top',),
+            Representation.TYPE_MULTISELECT_TOP: ('top1', 'top3'),
+            Representation.TYPE_MULTISELECT_TOP5: ('top5',),
+        }
+
+        def init(data, r):
+            if not data:
+                data.update({'cnt': 0, 'org': {}})
+                data.update({name: {} for name in tops[r.type]})
+
+        counts = (values.values('question', 'country', 'organization', 'answer__hcp_category')
+                  .annotate(cnt=Count('answer', distinct=True))
+                  .order_by())
+        for row in counts:
+            r, targets = self.get_targets(row['question'], row['country'], None, row['organization'],
+                                          row['answer__hcp_category'])
+            if r is None or r.type not in tops:
+                continue
+            org_key = str(row['organization'])
+            for data, _ in targets:
+                init(data, r)
+                data['cnt'] += row['cnt']
+                if org_key not in data['org']:
+                    data['org'][org_key] = {'cnt': 0}
+                    data['org'][org_key].update({name: {} for name in tops[r.type]})
+                data['org'][org_key]['cnt'] += row['cnt']
+
+        rows = (values.values('question', 'country', 'organization', 'answer__hcp_category', 'option')
+                .annotate(top=Count('id'), top1=ranked(1), top3=ranked(3), top5=ranked(5))
+                .order_by())
+        for row in rows:
+            r, targets = self.get_targets(row['question'], row['country'], None, row['organization'],
+                                          row['answer__hcp_category'])
+            if r is None or r.type not in tops:
+                continue
+            org_key = str(row['organization'])
+            for data, _ in targets:
+                for name in tops[r.type]:
+                    if row[name]:
+                        _increment(data[name], row['option'], row[name])
+                        _increment(data['org'][org_key][name], row['option'], row[name])
+
+    def get_day_trend_stats(self, country_id, day):
+        trends = []
+        for period, _ in TrendStat.PERIOD_CHOICES:
+            start = TrendStat.get_start(period, day)
+            trends.append(self.get_trend_stat(country_id, period, start))
+            trends.append(self.get_trend_stat(None, period, start))
+        return trends
+
+    def aggregate_trends(self):
+        rows = (self.survey.answers.filter(data__isnull=False)
+                .annotate(day=TruncDate('created_at'))
+                .values('country', 'organization', 'day')
+                .annotate(total=Count('id'))
+                .order_by())
+        for row in rows:
+            for trend in self.get_day_trend_stats(row['country'], row['day']):
+                trend.add_answer(row['organization'], row['total'])
+
+        # Values each processor returns: numbers, 1 for "yes", the number of options counted
+        limits = {
+            Representation.TYPE_MULTISELECT: None,
+            Representation.TYPE_MULTISELECT_TOP: 3,
+            Representation.TYPE_MULTISELECT_TOP5: 5,
+        }
+        values = AnswerValue.objects.filter(survey=self.survey).annotate(day=TruncDate('answer__created_at'))
+        scalars = (values.filter(rank__isnull=True)
+                   .values('question', 'country', 'day', 'option')
+                   .annotate(cnt=Count('id'), total=Sum('value'))
+                   .order_by())
+        for row in scalars:
+            r = self.question_representation_link.get(row['question'])
+            if r is None:
+                continue
+            if r.type == Representation.TYPE_YES_NO and row['option'] is None:
+                total = int(row['total'])
+            elif r.type == Representation.TYPE_AVERAGE_PERCENT and row['option'] is not None:
+                total = float(row['option']) * row['cnt']
+            else:
+                continue
+            for trend in self.get_day_trend_stats(row['country'], row['day']):
+                trend.add_value(r.pk, total, row['cnt'])
+
+        options = (values.filter(rank__isnull=False)
+                   .values('question', 'country', 'day')
+                   .annotate(cnt=Count('answer', distinct=True), top=Count('id'),
+                             top3=Sum(Case(When(rank__lt=3, then=1), default=0, output_field=IntegerField())),
+                             top5=Sum(Case(When(rank__lt=5, then=1), default=0, output_field=IntegerField())))
+                   .order_by())
+        for row in options:
+            r = self.question_representation_link.get(row['question'])
+            if r is None or r.type not in limits:
+                continue
+            total = row['top%s' % (limits[r.type] or '')]
+            for trend in self.get_day_trend_stats(row['country'], row['day']):
+                trend.add_value(r.pk, total, row['cnt'])
+
+    @classmethod
+    @transaction.atomic
+    def process_answers(cls, survey, dimensions=None):
+        cls.lock_survey(survey)
+        evaluator = cls(survey, dimensions=dimensions)
+        evaluator.fill_out()
+        evaluator.expand_answers()
+        with evaluator.profile.phase('aggregate'):
+            evaluator.reset_stats()
+            evaluator.aggregate_answers()
+            evaluator.aggregate_scalars()
+            evaluator.aggregate_options()
+            evaluator.aggregate_trends()
+        evaluator.save()
+        return evaluator
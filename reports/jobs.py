@@ -0,0 +1,94 @@
+import json
+import logging
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+from .dimensions import Dimensions
+from .evaluators import AggregateEvaluator, LastEvaluator, TotalEvaluator
+from .models import EvaluationJob, SurveyStat
+from .profiling import count_queries
+
+logger = logging.getLogger(__name__)
+
+EVALUATORS = {
+    EvaluationJob.MODE_LAST: LastEvaluator,
+    EvaluationJob.MODE_TOTAL: TotalEvaluator,
+}
+
+
+def evaluate(survey, mode, processes=None, dimensions=None, aggregate=None):
+    """
+    Evaluate the survey in the mode and return the evaluator.
+
+    Total recalculations run as GROUP BY queries with ``aggregate``, REPORTS_AGGREGATE_TOTALS
+    by default. Otherwise they are committed in chunks when REPORTS_CHECKPOINT_SIZE is set,
+    unless a number of ``processes`` is given, and run in REPORTS_PROCESSES processes otherwise.
+    The queries of the run are counted in the profile of the evaluator.
+    """
+    evaluator_cls = EVALUATORS[mode]
+    if aggregate is None:
+        aggregate = settings.REPORTS_AGGREGATE_TOTALS
+    with count_queries():
+        if mode == EvaluationJob.MODE_TOTAL and aggregate:
+            return AggregateEvaluator.process_answers(survey, dimensions=dimensions)
+        if mode == EvaluationJob.MODE_TOTAL and processes is None and settings.REPORTS_CHECKPOINT_SIZE:
+            return evaluator_cls.process_chunked(survey, checkpoint_size=settings.REPORTS_CHECKPOINT_SIZE,
+                                                 dimensions=dimensions)
+        if mode == EvaluationJob.MODE_TOTAL:
+            return evaluator_cls.process_sharded(survey, processes=processes or settings.REPORTS_PROCESSES,
+                                                 dimensions=dimensions)
+        return evaluator_cls.process_answers(survey, dimensions=dimensions)
+
+
+def has_new_answers(survey):
+    """
+    Whether the survey has answers newer than the ones its current stats include.
+    """
+    stat = SurveyStat.objects.current(survey).filter(country__isnull=True).first()
+    if stat is None:
+        return survey.answers.exists()
+    return survey.answers.filter(pk__gt=stat.watermark).exclude(pk__in=stat.recent).exists()
+
+
+def run_job(job, dimensions=None):
+    """
+    Run the evaluation of a claimed job and store its outcome on the job.
+    """
+    try:
+        evaluator = evaluate(job.survey, job.mode, dimensions=dimensions)
+    except Exception:
+        logger.exception("Evaluation job %s failed", job.pk)
+        job.status = EvaluationJob.STATUS_FAILED
+        job.error = traceback.format_exc()
+    else:
+        job.status = EvaluationJob.STATUS_DONE
+        job.messages = evaluator.messages
+        job.profile = evaluator.profile.to_dict()
+        logger.info("Evaluation job %s of survey %s: %s", job.pk, job.survey_id, json.dumps(job.profile),
+                    extra={'profile': job.profile})
+    job.finished_at = timezone.now()
+    job.save(update_fields=['status', 'messages', 'profile', 'error', 'finished_at'])
+    return job
+
+
+def run_pending(limit=None):
+    """
+    Run pending jobs one by one until the queue is empty or ``limit`` jobs were run.
+
+    The jobs of one call share the looked up dimensions, the next call looks them up again.
+    Finished jobs older than REPORTS_JOB_RETENTION_DAYS are deleted after jobs were run.
+    """
+    dimensions = Dimensions()
+    done = 0
+    while limit is None or done < limit:
+        job = EvaluationJob.objects.claim()
+        if job is None:
+            break
+        run_job(job, dimensions=dimensions)
+        done += 1
+    if done:
+        EvaluationJob.objects.prune(timezone.now() - timedelta(days=settings.REPORTS_JOB_RETENTION_DAYS))
+    return done
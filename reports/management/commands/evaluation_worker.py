@@ -0,0 +1,22 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from reports.jobs import run_pending
+
+
+class Command(BaseCommand):
+    help = 'Run queued report evaluations'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Exit when the queue is empty')
+        parser.add_argument('--sleep', type=float, default=2, help='Seconds to wait for new jobs')
+
+    def handle(self, *args, **options):
+        while True:
+            done = run_pending()
+            if done:
+                self.stdout.write('Finished %s evaluation jobs' % done)
+            if options['once']:
+                break
+            time.sleep(options['sleep'])
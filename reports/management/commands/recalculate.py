@@ -1,10 +1,20 @@
-from django.core.management.base import BaseCommand
+from reports.management.evaluate import EvaluateSurveysCommand
+from reports.jobs import evaluate
+from reports.models import EvaluationJob
 
-from reports.evaluators import TotalEvaluator
 
-
-class Command(BaseCommand):
+class Command(EvaluateSurveysCommand):
     help = 'Recalculate all data from answers'
+    mode = EvaluationJob.MODE_TOTAL
+
+    def add_arguments(self, parser):
+        super().add_arguments(parser)
+        parser.add_argument('--processes', type=int,
+                            help='Processes evaluating the answers of a survey, REPORTS_PROCESSES by default')
+        parser.add_argument('--aggregate', action='store_true', default=None,
+                            help='Recalculate with GROUP BY queries over the expanded answer values, '
+                                 'REPORTS_AGGREGATE_TOTALS by default')
 
-    def handle(self, *args, **options):
-        TotalEvaluator.process_answers()
+    def evaluate(self, survey, dimensions, **options):
+        return evaluate(survey, self.mode, processes=options['processes'], dimensions=dimensions,
+                        aggregate=options['aggregate'])
@@ -1,13 +1,7 @@
-from django.core.management.base import BaseCommand
+from reports.management.evaluate import EvaluateSurveysCommand
+from reports.models import EvaluationJob
 
-from reports.evaluators import LastEvaluator
 
-
-class Command(BaseCommand):
+class Command(EvaluateSurveysCommand):
     help = 'Update stat vars from stat data'
-
-    def handle(self, *args, **options):
-        LastEvaluator.process_answers()
-        # for q in QuestionStat.objects.all():
-        #     q.update_vars()
-        #     q.save()
+    mode = EvaluationJob.MODE_LAST
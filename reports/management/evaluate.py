@@ -0,0 +1,56 @@
+import logging
+
+from django.core.management.base import BaseCommand, CommandError
+
+from survey.models import Survey
+from ..dimensions import Dimensions
+from ..jobs import evaluate, has_new_answers
+
+logger = logging.getLogger(__name__)
+
+
+class EvaluateSurveysCommand(BaseCommand):
+    """
+    Evaluate all surveys, or the selected ones, in one run sharing the looked up dimensions.
+    """
+    mode = None
+
+    def add_arguments(self, parser):
+        parser.add_argument('--survey', action='append', dest='surveys', metavar='SURVEY',
+                            help='Id or slug of a survey to evaluate, can be repeated. All surveys by default')
+        parser.add_argument('--only-stale', action='store_true', help='Skip surveys without new answers')
+
+    def get_surveys(self, ids):
+        if not ids:
+            return list(Survey.objects.order_by('pk'))
+        surveys = []
+        for survey_id in ids:
+            lookup = {'pk': survey_id} if survey_id.isdigit() else {'slug': survey_id}
+            try:
+                surveys.append(Survey.objects.get(**lookup))
+            except Survey.DoesNotExist:
+                raise CommandError('Survey %s does not exist' % survey_id)
+        return surveys
+
+    def evaluate(self, survey, dimensions, **options):
+        return evaluate(survey, self.mode, dimensions=dimensions)
+
+    def handle(self, *args, **options):
+        dimensions = Dimensions()
+        failed = []
+        for survey in self.get_surveys(options['surveys']):
+            if options['only_stale'] and not has_new_answers(survey):
+                self.stdout.write('Survey %s: no new answers, skipped' % survey.slug)
+                continue
+            try:
+                evaluator = self.evaluate(survey, dimensions, **options)
+            except Exception as e:
+                logger.exception("Evaluation of survey %s failed", survey.pk)
+                self.stderr.write('Survey %s: failed, %s' % (survey.slug, e))
+                failed.append(survey.slug)
+                continue
+            profile = evaluator.profile.to_dict()
+            self.stdout.write('Survey %s: %s answers in %.1f s, %s messages'
+                              % (survey.slug, profile['answers'], profile['elapsed'], len(evaluator.messages)))
+        if failed:
+            raise CommandError('Evaluation failed for surveys %s' % ', '.join(failed))
@@ -0,0 +1,112 @@
+"""
+Merge operations for the ``data`` of question stats built from disjoint sets of answers.
+
+Every processor only adds to sums and counters, so the data built from two sets of
+answers merges into the data of their union by adding the values key by key.
+Distribution ``bins`` are added position by position, both sides are binned by the
+same ``bins_spec`` of the representation, and quantile sketches are merged centroid by centroid.
+
+Retracted answers are subtracted the same way, ``prune_stat_data`` then drops the
+entries that are left without answers.
+"""
+from copy import deepcopy
+
+from . import sketches
+from .models import Representation
+
+# Keys of quantile sketches, and of maps of them by region or organization
+SKETCHES = ('sketch',)
+SKETCH_MAPS = ('reg_sketch', 'org_sketch')
+
+# Keys of the data layout every processor builds, see AbstractEvaluator.type_*_processor
+LAYOUTS = {
+    Representation.TYPE_AVERAGE_PERCENT: ('main_sum', 'main_cnt', 'bins', 'dist', 'reg_sum', 'reg_cnt', 'org_sum',
+                                          'org_cnt', 'sketch', 'reg_sketch', 'org_sketch'),
+    Representation.TYPE_YES_NO: ('main_yes', 'main_cnt', 'reg_yes', 'reg_cnt', 'org_yes', 'org_cnt'),
+    Representation.TYPE_MULTISELECT: ('cnt', 'top', 'org'),
+    Representation.TYPE_MULTISELECT_TOP: ('cnt', 'top1', 'top3', 'org'),
+    Representation.TYPE_MULTISELECT_TOP5: ('cnt', 'top5', 'org'),
+}
+
+# Answer counters by region and organization, with the keys of the values kept next to them
+BREAKDOWNS = {
+    Representation.TYPE_AVERAGE_PERCENT: {'reg_cnt': ('reg_sum', 'reg_sketch'), 'org_cnt': ('org_sum', 'org_sketch')},
+    Representation.TYPE_YES_NO: {'reg_cnt': ('reg_yes',), 'org_cnt': ('org_yes',)},
+}
+# Option counters of the multiselect layouts, overall and in the 'org' map
+OPTION_COUNTERS = ('top', 'top1', 'top3', 'top5')
+
+
+def _drop_zeros(counter):
+    for key in [key for key, value in counter.items() if not value]:
+        del counter[key]
+
+
+def merge_counters(target, source):
+    """
+    Add the numbers of source to target, recursing into nested maps like ``reg_cnt`` or ``org``.
+    """
+    for key, value in source.items():
+        if isinstance(value, dict):
+            merge_counters(target.setdefault(key, {}), value)
+        else:
+            target[key] = target.get(key, 0) + value
+    return target
+
+
+def merge_stat_data(representation_type, target, source):
+    """
+    Merge the data of a question stat into the data of the same stat in place.
+    """
+    if not source:
+        return target
+    if not target:
+        target.update(deepcopy(source))
+        return target
+    for key in LAYOUTS[representation_type]:
+        if key not in source:
+            # Optional keys, like the raw 'dist' of averages that don't keep raw values
+            continue
+        if key in SKETCHES:
+            sketches.merge(target[key], source[key])
+        elif key in SKETCH_MAPS:
+            for sub_key, sketch in source[key].items():
+                sketches.merge(target[key].setdefault(sub_key, sketches.new_sketch()), sketch)
+        elif isinstance(source[key], dict):
+            merge_counters(target[key], source[key])
+        elif isinstance(source[key], list):
+            target[key] = [a + b for a, b in zip(target[key], source[key])]
+        else:
+            target[key] += source[key]
+    return target
+
+
+def prune_stat_data(representation_type, data):
+    """
+    Drop the entries of question stat data that no answer counts to anymore, in place.
+
+    Data without answers is emptied, like the data of a stat no answer was evaluated for.
+    """
+    if not data:
+        return data
+    if not data.get('main_cnt', data.get('cnt')):
+        data.clear()
+        return data
+    for cnt_key, value_keys in BREAKDOWNS.get(representation_type, {}).items():
+        for key in [key for key, cnt in data[cnt_key].items() if not cnt]:
+            del data[cnt_key][key]
+            for value_key in value_keys:
+                data.get(value_key, {}).pop(key, None)
+    if 'dist' in data:
+        _drop_zeros(data['dist'])
+    for name in OPTION_COUNTERS:
+        if name in data:
+            _drop_zeros(data[name])
+    for org_key, org in list(data.get('org', {}).items()):
+        if not org['cnt']:
+            del data['org'][org_key]
+            continue
+        for name in OPTION_COUNTERS:
+            if name in org:
+                _drop_zeros(org[name])
+    return data
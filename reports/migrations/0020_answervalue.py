@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.4 on 2026-10-18 08:16
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0017_auto_20180509_2206'),
+        ('survey', '0042_populate_answer_data'),
+        ('reports', '0019_representation_distribution'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AnswerValue',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('option', models.TextField(blank=True, null=True)),
+                ('rank', models.PositiveIntegerField(blank=True, null=True)),
+                ('value', models.FloatField(blank=True, null=True)),
+                ('answer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='values', to='survey.Answer')),
+                ('country', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='users.Country')),
+                ('organization', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='survey.Organization')),
+                ('question', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='survey.Question')),
+                ('region', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='survey.Region')),
+                ('survey', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='survey.Survey')),
+            ],
+        ),
+        migrations.AlterIndexTogether(
+            name='answervalue',
+            index_together=set([('survey', 'question', 'country'), ('survey', 'question', 'region'), ('survey', 'question', 'organization')]),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.4 on 2026-10-18 08:25
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+from django.db.models import Max
+
+
+def populate_watermark(apps, schema_editor):
+    SurveyStat = apps.get_model('reports', 'SurveyStat')
+    Answer = apps.get_model('survey', 'Answer')
+
+    # Answers below the last updated one that are still not updated failed to process on every run
+    rows = Answer.objects.filter(is_updated=True).values('survey').annotate(last_pk=Max('pk')).order_by()
+    for row in rows:
+        SurveyStat.objects.filter(survey_id=row['survey'], country__isnull=True).update(watermark=row['last_pk'])
+
+
+def dummy(apps, schema_editor):
+    pass
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reports', '0021_evaluationjob'),
+        ('survey', '0042_populate_answer_data'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='surveystat',
+            name='watermark',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(populate_watermark, dummy),
+    ]
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.4 on 2026-10-18 08:34
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reports', '0022_surveystat_watermark'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='representation',
+            name='keep_raw_values',
+            field=models.BooleanField(default=True, help_text='Store every distinct value next to the distribution bins, so they can be re-binned. Turn off for free input questions with many distinct values.', verbose_name='Keep raw values'),
+        ),
+    ]
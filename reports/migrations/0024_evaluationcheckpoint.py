@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.4 on 2026-10-18 08:39
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+import jsonfield.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('survey', '0043_answer_watermark_index'),
+        ('reports', '0023_representation_keep_raw_values'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EvaluationCheckpoint',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('after', models.PositiveIntegerField(default=0)),
+                ('last', models.PositiveIntegerField(default=0)),
+                ('representations', jsonfield.fields.JSONField(default=list)),
+                ('state', jsonfield.fields.JSONField(default=dict)),
+                ('started_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('survey', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='evaluation_checkpoint', to='survey.Survey')),
+            ],
+        ),
+    ]
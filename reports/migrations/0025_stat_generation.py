@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.4 on 2026-10-18 08:42
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reports', '0024_evaluationcheckpoint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='organizationstat',
+            name='generation',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='questionstat',
+            name='generation',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='surveystat',
+            name='generation',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.4 on 2026-10-18 08:46
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+import jsonfield.fields
+import reports.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0017_auto_20180509_2206'),
+        ('survey', '0044_survey_stat_generation'),
+        ('reports', '0025_stat_generation'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TrendStat',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('total', models.PositiveIntegerField(default=0)),
+                ('generation', models.PositiveIntegerField(default=0)),
+                ('period', models.CharField(choices=[('day', 'Day'), ('week', 'Week')], default='day', max_length=10)),
+                ('start', models.DateField()),
+                ('data', jsonfield.fields.JSONField(default=dict)),
+                ('country', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='users.Country')),
+                ('survey', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, to='survey.Survey')),
+            ],
+            options={
+                'ordering': ['start'],
+            },
+            bases=(reports.models.TrackChangesMixin, models.Model),
+        ),
+    ]
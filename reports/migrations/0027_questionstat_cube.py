@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.4 on 2026-10-18 08:53
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('survey', '0044_survey_stat_generation'),
+        ('reports', '0026_trendstat'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='questionstat',
+            name='hcp_category',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='survey.HCPCategory'),
+        ),
+        migrations.AddField(
+            model_name='questionstat',
+            name='organization',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='survey.Organization'),
+        ),
+    ]
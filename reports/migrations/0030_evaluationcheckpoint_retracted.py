@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.4 on 2026-10-18 09:58
+from __future__ import unicode_literals
+
+from django.db import migrations
+import jsonfield.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reports', '0029_surveystat_recent'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='evaluationcheckpoint',
+            name='retracted',
+            field=jsonfield.fields.JSONField(default=list),
+        ),
+    ]
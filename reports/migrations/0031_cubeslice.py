@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.4 on 2026-10-18 10:05
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('survey', '0046_populate_dependency_answer'),
+        ('reports', '0030_evaluationcheckpoint_retracted'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CubeSlice',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('generation', models.PositiveIntegerField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Datetime of creation')),
+                ('hcp_category', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='survey.HCPCategory')),
+                ('organization', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='survey.Organization')),
+                ('survey', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='cube_slices', to='survey.Survey')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='cubeslice',
+            unique_together=set([('survey', 'organization', 'hcp_category')]),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.4 on 2026-10-18 10:26
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('survey', '0046_populate_dependency_answer'),
+        ('reports', '0031_cubeslice'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SurveyVersion',
+            fields=[
+                ('survey', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='version', serialize=False, to='survey.Survey')),
+                ('plan', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+    ]
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.4 on 2026-10-18 10:30
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reports', '0032_surveyversion'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='surveyversion',
+            name='answers',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
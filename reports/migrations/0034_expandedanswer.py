@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.4 on 2026-10-18 10:38
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+# Number of answers recorded per query
+CHUNK_SIZE = 1000
+
+
+def populate_expanded_answers(apps, schema_editor):
+    AnswerValue = apps.get_model('reports', 'AnswerValue')
+    ExpandedAnswer = apps.get_model('reports', 'ExpandedAnswer')
+
+    # Answers with values were expanded, the ones without any are expanded once more by the next run
+    answer_ids = AnswerValue.objects.values_list('answer_id', flat=True).distinct().order_by('answer_id')
+    last_id = 0
+    while True:
+        chunk = list(answer_ids.filter(answer_id__gt=last_id)[:CHUNK_SIZE])
+        if not chunk:
+            break
+        ExpandedAnswer.objects.bulk_create(ExpandedAnswer(answer_id=answer_id) for answer_id in chunk)
+        last_id = chunk[-1]
+
+
+def dummy(apps, schema_editor):
+    pass
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('survey', '0046_populate_dependency_answer'),
+        ('reports', '0033_surveyversion_answers'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExpandedAnswer',
+            fields=[
+                ('answer', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='expanded', serialize=False, to='survey.Answer')),
+            ],
+        ),
+        migrations.RunPython(populate_expanded_answers, dummy),
+    ]
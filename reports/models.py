@@ -1,16 +1,79 @@
+import json
+import logging
+from datetime import timedelta
+from itertools import chain
+
 import jsonfield
 
-from django.db import models
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import IntegrityError, models, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
 
 from insights.users.models import Country
-from survey.models import Survey, Organization, Question, Option, Region
+from survey.models import Survey, Organization, Question, Option, Region, Answer, HCPCategory
+from . import sketches
+from .bulk import bulk_update
 from django.utils.translation import gettext as _
 
+logger = logging.getLogger(__name__)
+
+
+class TrackChangesMixin(object):
+    """
+    Remember field values loaded from the database, so that unchanged rows can be skipped on save.
+    """
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance.mark_clean()
+        return instance
+
+    def _get_state(self):
+        deferred = self.get_deferred_fields()
+        return {f.name: json.dumps(getattr(self, f.attname), sort_keys=True, cls=DjangoJSONEncoder)
+                for f in self._meta.concrete_fields if not f.primary_key and f.attname not in deferred}
+
+    def mark_clean(self):
+        self._clean_state = self._get_state()
+
+    def get_changed_fields(self):
+        """
+        Names of the fields changed since loading, all fields of objects that were not loaded.
+        """
+        clean = getattr(self, '_clean_state', {})
+        return [name for name, value in self._get_state().items() if clean.get(name) != value]
+
+    def is_dirty(self):
+        return self.pk is None or bool(self.get_changed_fields())
 
-class Stat(models.Model):
+
+class StatQuerySet(models.QuerySet):
+    def current(self, survey):
+        """
+        Stats of the survey in the generation reports read, see ``Survey.switch_stat_generation``.
+        """
+        return self.filter(survey=survey, generation=survey.stat_generation)
+
+
+class QuestionStatQuerySet(StatQuerySet):
+    def cell(self, organization_id=None, hcp_category_id=None):
+        """
+        Question stats of one cell of the cube, by default the ones over all organizations and HCP categories.
+        """
+        return self.filter(organization_id=organization_id, hcp_category_id=hcp_category_id)
+
+
+class Stat(TrackChangesMixin, models.Model):
     country = models.ForeignKey(Country, blank=True, null=True)
     survey = models.ForeignKey(Survey, null=True)
     total = models.PositiveIntegerField(default=0)
+    generation = models.PositiveIntegerField(default=0)
+
+    objects = StatQuerySet.as_manager()
 
     class Meta:
         abstract = True
@@ -21,6 +84,10 @@ class Stat(models.Model):
 
 class SurveyStat(Stat):
     last = models.DateTimeField(blank=True, null=True)
+    # Id up to which all answers of the survey are included in the stats, kept in the Europe row
+    watermark = models.PositiveIntegerField(default=0)
+    # Ids of included answers above the watermark, ones submitted before them may still commit
+    recent = jsonfield.JSONField(default=list)
 
 
 class OrganizationStat(Stat):
@@ -31,6 +98,99 @@ class OrganizationStat(Stat):
         ordering = ['ordering', 'id']
 
 
+class TrendStat(Stat):
+    """
+    Answers submitted in a day or a week, with the organizations and the values of questions they counted.
+
+    ``data`` is ``{'org': {organization id: answers}, 'questions': {representation id: {'cnt', 'sum'}}}``,
+    where ``sum`` adds up what the processor of the question counted: the value of
+    average questions, 1 for "yes" and the number of options for multiselects.
+    """
+    PERIOD_DAY = 'day'
+    PERIOD_WEEK = 'week'
+
+    PERIOD_CHOICES = (
+        (PERIOD_DAY, 'Day'),
+        (PERIOD_WEEK, 'Week'),
+    )
+    PERIOD_DAYS = {PERIOD_DAY: 1, PERIOD_WEEK: 7}
+
+    period = models.CharField(max_length=10, choices=PERIOD_CHOICES, default=PERIOD_DAY)
+    start = models.DateField()
+    data = jsonfield.JSONField(default=dict)
+
+    class Meta:
+        ordering = ['start']
+
+    @classmethod
+    def get_start(cls, period, day):
+        """
+        First day of the bucket of ``period`` a day falls into, weeks start on Monday.
+        """
+        if period == cls.PERIOD_WEEK:
+            return day - timedelta(days=day.weekday())
+        return day
+
+    @classmethod
+    def get_buckets(cls, created_at):
+        day = timezone.localtime(created_at).date()
+        return [(period, cls.get_start(period, day)) for period, _ in cls.PERIOD_CHOICES]
+
+    def add_answer(self, organization_id, n=1):
+        self.total += n
+        org = self.data.setdefault('org', {})
+        org_key = str(organization_id)
+        org[org_key] = org.get(org_key, 0) + n
+        if not org[org_key]:
+            # Retracted answers leave no trace
+            del org[org_key]
+
+    def add_value(self, representation_id, value, n=1):
+        questions = self.data.setdefault('questions', {})
+        question = questions.setdefault(str(representation_id), {'cnt': 0, 'sum': 0})
+        question['cnt'] += n
+        question['sum'] += value
+        if not question['cnt']:
+            del questions[str(representation_id)]
+
+    @classmethod
+    def get_series(cls, stats, period):
+        """
+        Series for trend charts from the stats of one country and period, empty buckets included.
+        """
+        stats = list(stats)
+        series = {'period': period, 'labels': [], 'total': [], 'organizations': {}, 'questions': {}}
+        if not stats:
+            return series
+        by_start = {stat.start: stat for stat in stats}
+        step = timedelta(days=cls.PERIOD_DAYS[period])
+        start, end = stats[0].start, stats[-1].start
+        buckets = []
+        while start <= end:
+            buckets.append((start, by_start.get(start)))
+            start += step
+
+        org_keys = sorted({key for stat in stats for key in stat.data.get('org', {})}, key=int)
+        question_keys = sorted({key for stat in stats for key in stat.data.get('questions', {})}, key=int)
+        for key in org_keys:
+            series['organizations'][key] = []
+        for key in question_keys:
+            series['questions'][key] = {'cnt': [], 'mean': []}
+
+        for start, stat in buckets:
+            data = stat.data if stat is not None else {}
+            series['labels'].append(start.isoformat())
+            series['total'].append(stat.total if stat is not None else 0)
+            for key in org_keys:
+                series['organizations'][key].append(data.get('org', {}).get(key, 0))
+            for key in question_keys:
+                question = data.get('questions', {}).get(key)
+                cnt = question['cnt'] if question else 0
+                series['questions'][key]['cnt'].append(cnt)
+                series['questions'][key]['mean'].append(round(question['sum'] / cnt, 2) if cnt else None)
+        return series
+
+
 class RepresentationTypeMixin(models.Model):
     TYPE_AVERAGE_PERCENT = 'type_average_percent'
     TYPE_YES_NO = 'type_yes_no'
@@ -70,6 +230,10 @@ class Representation(RepresentationTypeMixin, models.Model):
     lowest = models.PositiveIntegerField(_('Lowest'), blank=True, null=True)
     highest = models.PositiveIntegerField(_('Highest'), blank=True, null=True)
     distribution = models.PositiveIntegerField(_('Distribution'), blank=True, null=True)
+    keep_raw_values = models.BooleanField(
+        _('Keep raw values'), default=True,
+        help_text=_('Store every distinct value next to the distribution bins, so they can be re-binned. '
+                    'Turn off for free input questions with many distinct values.'))
 
     def natural_key(self):
         return self.question.natural_key()
@@ -82,43 +246,69 @@ class Representation(RepresentationTypeMixin, models.Model):
         ordering = ['ordering', 'id']
 
 
-class QuestionStat(RepresentationTypeMixin, models.Model):
+class QuestionStat(TrackChangesMixin, RepresentationTypeMixin, models.Model):
     survey = models.ForeignKey(Survey, null=True)
     country = models.ForeignKey(Country, blank=True, null=True)
     representation = models.ForeignKey(Representation)
+    # Cube cells of the stats are limited to an organization and/or an HCP category,
+    # the stats of all answers of a country have neither
+    organization = models.ForeignKey(Organization, blank=True, null=True)
+    hcp_category = models.ForeignKey(HCPCategory, blank=True, null=True)
     data = jsonfield.JSONField()
     vars = jsonfield.JSONField()
     ordering = models.PositiveIntegerField('Ordering in reports', default=1, blank=True, db_index=True)
+    generation = models.PositiveIntegerField(default=0)
+
+    objects = QuestionStatQuerySet.as_manager()
 
     report_type = 'advanced'
     regions_cache = {}
     organizations_cache = []
+    dimensions = None
 
     class Meta:
         ordering = ['ordering', 'id']
 
     def get_regions(self, country_id):
+        if self.dimensions is not None:
+            return self.dimensions.get_regions(self.survey, country_id)
         if country_id is None:
             return list(self.survey.countries.all())
         else:
             return list(Region.objects.filter(country_id=country_id))
 
     def get_organizations(self):
+        if self.dimensions is not None:
+            return self.dimensions.get_organizations(self.survey)
         return list(self.survey.organizations.all())
 
     @staticmethod
-    def extract_dist_data(dist, unit=None, lowest=None, highest=None, distribution=None):
-        num = 10 if distribution is None else distribution
-        dist_labels = []
-        dist_values = [0] * num
+    def get_dist_spec(representation):
+        """
+        Bins of the distribution of a representation: ``[lowest, highest, number of bins]``.
+        """
+        lowest = 0 if representation.lowest is None else representation.lowest
+        highest = 100.0 if representation.highest is None else representation.highest
+        num = 10 if representation.distribution is None else representation.distribution
+        return [lowest, highest, num]
+
+    @staticmethod
+    def get_dist_position(val_str, lowest, highest, num):
+        piece = (highest - lowest) / num
+        val = int(float(val_str))
+        position = int(val/piece)
+        if val and position * int(piece) == val:
+            position -= 1
+        if position > num - 1:
+            position = num - 1
+        return position
+
+    @staticmethod
+    def get_dist_labels(unit, lowest, highest, num):
         if unit is None:
             unit = '%'
-        if lowest is None:
-            lowest = 0
-        if highest is None:
-            highest = 100.0
         piece = (highest - lowest) / num
-
+        dist_labels = []
         for i in range(num):
             if i:
                 i_min = int(i * piece + 1)
@@ -126,25 +316,74 @@ class QuestionStat(RepresentationTypeMixin, models.Model):
                 i_min = lowest
             i_max = int((i + 1) * piece)
             dist_labels.append('{}-{}{}'.format(i_min, i_max, unit))
+        return dist_labels
+
+    @staticmethod
+    def get_dist_series_meta(dist_values):
+        total = sum(dist_values)
+        return [{'value': x, 'meta': int(round(100.0 * x / total))} for x in dist_values]
 
-        total = sum(dist.values())
+    @classmethod
+    def bin_dist(cls, dist, lowest, highest, num):
+        dist_values = [0] * num
         for val_str, n in dist.items():
-            val = int(float(val_str))
-            position = int(val/piece)
-            if val and position * int(piece) == val:
-                position -= 1
-            if position > num - 1:
-                position = num - 1
-            dist_values[position] += n
+            dist_values[cls.get_dist_position(val_str, lowest, highest, num)] += n
+        return dist_values
 
-        dist_series_meta = [{'value': x, 'meta': int(round(100.0 * x / total))} for x in dist_values]
-        return dist_labels, dist_series_meta
+    @classmethod
+    def extract_dist_data(cls, dist, unit=None, lowest=None, highest=None, distribution=None):
+        num = 10 if distribution is None else distribution
+        if lowest is None:
+            lowest = 0
+        if highest is None:
+            highest = 100.0
+        dist_labels = cls.get_dist_labels(unit, lowest, highest, num)
+        return dist_labels, cls.get_dist_series_meta(cls.bin_dist(dist, lowest, highest, num))
+
+    @classmethod
+    def prepare_bins(cls, data, spec, keep_dist=True):
+        """
+        Make the ``bins`` of average data count values by spec, re-binning the raw ``dist`` when it is kept.
+
+        Bins of another spec are restarted when there are no raw values to re-bin them from.
+        """
+        if data.get('bins_spec') != spec:
+            if 'dist' in data:
+                data['bins'] = cls.bin_dist(data['dist'], *spec)
+            else:
+                if 'bins' in data:
+                    logger.warning("Distribution bins changed to %s, recalculate the stats to refill them" % spec)
+                data['bins'] = [0] * spec[2]
+            data['bins_spec'] = spec
+        if not keep_dist:
+            data.pop('dist', None)
+
+    @staticmethod
+    def get_quartiles(sketch, cnt):
+        """
+        First quartile, median and third quartile of a sketch, None unless it holds all ``cnt`` values.
+        """
+        if not sketch or sketches.count(sketch) != cnt:
+            return None
+        return [round(sketches.quantile(sketch, q), 1) for q in (0.25, 0.5, 0.75)]
+
+    def get_dist_data(self):
+        """
+        Labels and values of the distribution chart, from the bins when they match the representation.
+        """
+        spec = self.get_dist_spec(self.representation)
+        unit = self.representation.question.unit
+        if 'bins' in self.data and (self.data.get('bins_spec') == spec or 'dist' not in self.data):
+            spec = self.data['bins_spec']
+            return self.get_dist_labels(unit, *spec), self.get_dist_series_meta(self.data['bins'])
+        return self.extract_dist_data(self.data['dist'], unit, *spec)
 
     def update_type_average_percent(self):
         regions = self.get_regions(self.country_id)
         self.vars['bar_labels'] = []
         self.vars['bar_series'] = []
         self.vars['bar_series_meta'] = []
+        self.vars['bar_quartiles'] = []
 
         data = self.data
 
@@ -159,10 +398,12 @@ class QuestionStat(RepresentationTypeMixin, models.Model):
             self.vars['bar_labels'].append(reg.name.upper())
             self.vars['bar_series'].append(val)
             self.vars['bar_series_meta'].append({'meta': reg_cnt, 'value': val})
+            self.vars['bar_quartiles'].append(self.get_quartiles(data.get('reg_sketch', {}).get(reg_key), reg_cnt))
 
         orgs = self.get_organizations()
         self.vars['org_labels'] = []
         self.vars['org_series_meta'] = []
+        self.vars['org_quartiles'] = []
         for org in orgs:
             org_key = str(org.pk)
             if org_key in data['org_cnt']:
@@ -174,17 +415,16 @@ class QuestionStat(RepresentationTypeMixin, models.Model):
 
             self.vars['org_labels'].append(org.name_plural_short.upper())
             self.vars['org_series_meta'].append({'meta': org_cnt, 'value': val})
+            self.vars['org_quartiles'].append(self.get_quartiles(data.get('org_sketch', {}).get(org_key), org_cnt))
 
-        dist_labels, dist_series_meta = self.extract_dist_data(
-            data['dist'],
-            self.representation.question.unit, self.representation.lowest, self.representation.highest,
-            self.representation.distribution)
+        dist_labels, dist_series_meta = self.get_dist_data()
 
         self.vars['pie_labels'] = [self.representation.label2, self.representation.label3]
         pers = int(round(self.data['main_sum'] / self.data['main_cnt']))
         self.vars['pie_data'] = [pers, 100 - pers]
         self.vars['label1'] = self.representation.label1
         self.vars['main_cnt'] = self.data['main_cnt']
+        self.vars['quartiles'] = self.get_quartiles(self.data.get('sketch'), self.data['main_cnt'])
         self.vars['dist_labels'] = dist_labels
         self.vars['dist_series_meta'] = dist_series_meta
 
@@ -356,38 +596,200 @@ class QuestionStat(RepresentationTypeMixin, models.Model):
         cls.regions_cache = {}
 
 
+class AnswerValue(models.Model):
+    """
+    One value of an answer to a question, the normalized form AggregateEvaluator runs GROUP BY queries on.
+
+    Choices store 1 or 0 in value, numbers store the number in value and its submitted string in option,
+    option lists store one row per distinct lowered option with its position in rank.
+    """
+    answer = models.ForeignKey(Answer, on_delete=models.CASCADE, related_name='values')
+    survey = models.ForeignKey(Survey, on_delete=models.CASCADE)
+    question = models.ForeignKey(Question, on_delete=models.CASCADE)
+    country = models.ForeignKey(Country, on_delete=models.CASCADE)
+    region = models.ForeignKey(Region, on_delete=models.CASCADE, null=True, blank=True)
+    organization = models.ForeignKey(Organization, on_delete=models.CASCADE)
+    option = models.TextField(null=True, blank=True)
+    rank = models.PositiveIntegerField(null=True, blank=True)
+    value = models.FloatField(null=True, blank=True)
+
+    class Meta:
+        index_together = [
+            ('survey', 'question', 'country'),
+            ('survey', 'question', 'region'),
+            ('survey', 'question', 'organization'),
+        ]
+
+
+class ExpandedAnswer(models.Model):
+    """
+    Answer AggregateEvaluator expanded into AnswerValue rows, recorded for answers without any values too.
+    """
+    answer = models.OneToOneField(Answer, on_delete=models.CASCADE, primary_key=True, related_name='expanded')
+
+    def __str__(self):
+        return str(self.answer_id)
+
+
 class OptionDict(models.Model):
+    """
+    Original spelling of options, stats count options by their lowered form.
+
+    Entries are loaded for the options of the evaluated survey and for the names that are
+    looked up. New entries are kept in ``pending`` until ``flush`` inserts them in bulk.
+
+    The entries of every survey are shared between processes through the Django cache.
+    Writes bump a version stamp there and log the names they changed, so every process
+    drops only those names from its own copy.
+    """
     lower = models.CharField(max_length=200, unique=True)
     original = models.CharField(max_length=200)
 
     data = {}
-    is_loaded = False
+    missing = set()
+    pending = {}
+    changed = {}
+    loaded_surveys = set()
+    version = None
+
+    # Rows fetched per query by load
+    batch_size = 500
+    # Seconds the survey entries and the change log stay in the cache
+    cache_timeout = 60 * 60 * 24
+    VERSION_KEY = 'reports:optiondict:version'
 
     @classmethod
     def clear(cls):
         cls.data = {}
-        cls.is_loaded = False
+        cls.missing = set()
+        cls.pending = {}
+        cls.changed = {}
+        cls.loaded_surveys = set()
+        cls.version = None
+
+    @staticmethod
+    def _changes_key(version):
+        return 'reports:optiondict:changes:%s' % version
+
+    @staticmethod
+    def _survey_key(survey_id):
+        return 'reports:optiondict:survey:%s' % survey_id
 
     @classmethod
-    def _load(cls):
-        for od in cls.objects.all():
-            cls.data[od.lower] = od
-        cls.is_loaded = True
+    def bump(cls, lowers):
+        """
+        Announce changed names to all processes.
+        """
+        cache.add(cls.VERSION_KEY, 0)
+        try:
+            version = cache.incr(cls.VERSION_KEY)
+        except ValueError:
+            # The cache doesn't keep values, there is nothing to invalidate
+            return
+        cache.set(cls._changes_key(version), list(lowers), cls.cache_timeout)
+
+    @classmethod
+    def get_changes(cls, since, version):
+        """
+        Names changed after the ``since`` version up to ``version``, None if the log doesn't cover them.
+        """
+        if since is None or version is None or since > version:
+            return None
+        keys = [cls._changes_key(v) for v in range(since + 1, version + 1)]
+        logs = cache.get_many(keys)
+        if len(logs) != len(keys):
+            return None
+        return set(chain.from_iterable(logs.values()))
+
+    @classmethod
+    def sync(cls):
+        """
+        Drop the loaded entries other processes changed since the last sync.
+        """
+        version = cache.get(cls.VERSION_KEY)
+        if version is None:
+            cache.add(cls.VERSION_KEY, 0)
+            version = cache.get(cls.VERSION_KEY)
+        if version == cls.version:
+            return
+
+        changes = cls.get_changes(cls.version, version)
+        if changes is None:
+            cls.data = dict(cls.pending)
+            cls.missing = set()
+        else:
+            for lower in changes:
+                if lower not in cls.pending:
+                    cls.data.pop(lower, None)
+                cls.missing.discard(lower)
+        # Survey entries are checked against option values again on the next load
+        cls.loaded_surveys = set()
+        cls.version = version
 
-        for opt in Option.objects.all():
-            lower = opt.value.lower()
+    @classmethod
+    def _load_cached_survey(cls, survey_id):
+        cached = cache.get(cls._survey_key(survey_id))
+        if cached is None:
+            return False
+        version, entries = cached
+        changes = cls.get_changes(version, cls.version)
+        if changes is None or changes & set(entries):
+            return False
+        for lower, (pk, original) in entries.items():
+            if lower not in cls.data:
+                cls.data[lower] = cls(pk=pk, lower=lower, original=original)
+        return True
+
+    @classmethod
+    def load(cls, names):
+        """
+        Fetch the entries of names that were not looked up yet.
+        """
+        names = [name for name in set(names) if name not in cls.data and name not in cls.missing]
+        for start in range(0, len(names), cls.batch_size):
+            batch = names[start:start + cls.batch_size]
+            for od in cls.objects.filter(lower__in=batch):
+                cls.data[od.lower] = od
+            cls.missing.update(name for name in batch if name not in cls.data)
+
+    @classmethod
+    def load_survey(cls, survey_id):
+        """
+        Load the entries of the options of a survey and sync them with the option values.
+
+        Entries another process loaded are taken from the cache when none of them changed since.
+        """
+        cls.sync()
+        if survey_id in cls.loaded_surveys:
+            return
+        if cls._load_cached_survey(survey_id):
+            cls.loaded_surveys.add(survey_id)
+            return
+
+        values = {}
+        for value in Option.objects.filter(question__survey_id=survey_id).values_list('value', flat=True):
+            values[value.lower()] = value
+        cls.load(values)
+        in_sync = True
+        for lower, value in values.items():
             if lower not in cls.data:
-                new_dict = cls(lower=lower, original=opt.value)
-                new_dict.save()
-                cls.data[lower] = new_dict
-            elif opt.value != cls.data[lower].original:
-                cls.data[lower].original = opt.value
-                cls.data[lower].save()
+                cls.register(lower, value)
+                in_sync = False
+            elif cls.data[lower].original != value:
+                cls.data[lower].original = value
+                in_sync = False
+                if cls.data[lower].pk is not None:
+                    cls.changed[lower] = cls.data[lower]
+        cls.loaded_surveys.add(survey_id)
+
+        if in_sync:
+            # Entries written by this evaluation are cached by the next load after it commits
+            entries = {lower: (cls.data[lower].pk, cls.data[lower].original) for lower in values}
+            cache.set(cls._survey_key(survey_id), (cls.version, entries), cls.cache_timeout)
 
     @classmethod
     def get(cls, name):
-        if not cls.is_loaded:
-            cls._load()
+        cls.load([name])
         if name in cls.data:
             return cls.data[name].original
         else:
@@ -395,10 +797,324 @@ class OptionDict(models.Model):
 
     @classmethod
     def register(cls, lower, original):
-        if not cls.is_loaded:
-            cls._load()
+        if lower in cls.data:
+            return
+        new_dict = cls(lower=lower, original=original)
+        cls.data[lower] = cls.pending[lower] = new_dict
+        cls.missing.discard(lower)
+
+    @classmethod
+    def flush(cls):
+        """
+        Write the registered and changed entries, one bulk INSERT and one bulk UPDATE.
+        """
+        written = set(cls.changed) | set(cls.pending)
+        if written:
+            transaction.on_commit(lambda: cls.bump(written))
+        if cls.changed:
+            bulk_update(list(cls.changed.values()))
+            cls.changed = {}
+        if not cls.pending:
+            return
+        pending, cls.pending = cls.pending, {}
+
+        # Entries registered without a lookup may exist already, the stored spelling is kept
+        lowers = list(pending)
+        for start in range(0, len(lowers), cls.batch_size):
+            for od in cls.objects.filter(lower__in=lowers[start:start + cls.batch_size]):
+                cls.data[od.lower] = od
+                del pending[od.lower]
+        try:
+            with transaction.atomic():
+                cls.objects.bulk_create(pending.values(), batch_size=cls.batch_size)
+        except IntegrityError:
+            # Another evaluation inserted some of them meanwhile
+            for lower, od in pending.items():
+                cls.data[lower], created = cls.objects.get_or_create(lower=lower, defaults={'original': od.original})
+
+    @classmethod
+    def on_option_changed(cls, sender, instance, **kwargs):
+        lower = instance.value.lower()
+        transaction.on_commit(lambda: cls.bump([lower]))
 
-        if lower not in cls.data:
-            new_dict = cls(lower=lower, original=original)
-            new_dict.save()
-            cls.data[lower] = new_dict
+
+class SurveyVersion(models.Model):
+    """
+    Versions of what processes cache about a survey, bumped in the transaction that changes it.
+
+    ``plan`` counts the changes of the questions, representations, countries and evaluated
+    cube slices evaluation plans are compiled from, ``answers`` the edits and deletions of
+    answers, which answer columns can't append. Keeping the versions in the database lets
+    every process see them, whatever cache backend is configured.
+    """
+    survey = models.OneToOneField(Survey, on_delete=models.CASCADE, primary_key=True, related_name='version')
+    plan = models.PositiveIntegerField(default=0)
+    answers = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return "%s: plan %s, answers %s" % (self.survey_id, self.plan, self.answers)
+
+    @classmethod
+    def get(cls, survey_id, name):
+        """
+        Current version ``name`` of the survey, the row is created when it is read first.
+        """
+        versions = list(cls.objects.filter(survey_id=survey_id).values_list(name, flat=True))
+        if versions:
+            return versions[0]
+        version, created = cls.objects.get_or_create(survey_id=survey_id)
+        return getattr(version, name)
+
+    @classmethod
+    def bump(cls, survey_ids, name):
+        """
+        Count a change of ``name`` of the surveys, the ones whose version was never read don't need it.
+        """
+        cls.objects.filter(survey_id__in=survey_ids).update(**{name: models.F(name) + 1})
+
+
+class CubeSliceQuerySet(models.QuerySet):
+    def registered(self, survey, before=None):
+        """
+        Slices of the survey reports asked for, the ones asked for up to ``before`` if it is given.
+        """
+        slices = self.filter(survey=survey)
+        if before is not None:
+            slices = slices.filter(created_at__lte=before)
+        return slices
+
+    def evaluated(self, survey):
+        """
+        Slices of the survey whose cells are kept up to date by every evaluation.
+        """
+        return self.filter(survey=survey, generation__isnull=False)
+
+    def register(self, survey, organization=None, hcp_category=None):
+        """
+        Slice of the survey and whether it was created, a slice is registered once.
+
+        ``unique_together`` doesn't apply to rows with NULLs, so registrations of a survey
+        are serialized by locking its ``SurveyVersion`` row.
+        """
+        with transaction.atomic():
+            SurveyVersion.get(survey.pk, 'plan')
+            list(SurveyVersion.objects.select_for_update().filter(survey=survey).values_list('pk', flat=True))
+            return self.get_or_create(survey=survey, organization=organization, hcp_category=hcp_category)
+
+
+class CubeSlice(models.Model):
+    """
+    A slice of the reports by organization, HCP category or both that was asked for.
+
+    Question stats only have cube cells for the slices of their survey. A new slice is
+    filled by the next total recalculation, which sets ``generation``, and from then
+    on every evaluation counts the answers into its cells.
+    """
+    survey = models.ForeignKey(Survey, on_delete=models.CASCADE, related_name='cube_slices')
+    organization = models.ForeignKey(Organization, on_delete=models.CASCADE, blank=True, null=True)
+    hcp_category = models.ForeignKey(HCPCategory, on_delete=models.CASCADE, blank=True, null=True)
+    # Generation of the stats the slice was first evaluated in, None until a total recalculation filled it
+    generation = models.PositiveIntegerField(blank=True, null=True)
+    created_at = models.DateTimeField('Datetime of creation', auto_now_add=True)
+
+    objects = CubeSliceQuerySet.as_manager()
+
+    class Meta:
+        unique_together = ('survey', 'organization', 'hcp_category')
+
+    def __str__(self):
+        return "%s: %s, %s" % (self.survey_id, self.organization_id, self.hcp_category_id)
+
+    def validate_unique(self, exclude=None):
+        super().validate_unique(exclude)
+        # unique_together skips NULLs, which stand for all organizations or HCP categories
+        duplicates = (CubeSlice.objects.filter(survey_id=self.survey_id, organization_id=self.organization_id,
+                                               hcp_category_id=self.hcp_category_id).exclude(pk=self.pk))
+        if duplicates.exists():
+            raise ValidationError(_('This slice of the survey is registered already.'))
+
+    @property
+    def cell(self):
+        return self.organization_id, self.hcp_category_id
+
+
+class EvaluationJobManager(models.Manager):
+    def enqueue(self, survey, mode):
+        """
+        Queue an evaluation of the survey, reusing the pending job of the survey if there is one.
+
+        A pending total recalculation covers an update, and a pending update is upgraded
+        when a total recalculation is requested.
+        """
+        job = self.filter(survey=survey, status=EvaluationJob.STATUS_PENDING).order_by('pk').first()
+        if job is None:
+            return self.create(survey=survey, mode=mode)
+        if mode == EvaluationJob.MODE_TOTAL and job.mode != mode:
+            job.mode = mode
+            job.save(update_fields=['mode'])
+        return job
+
+    def last_finished(self, survey, mode):
+        """
+        The last job of the survey in the mode that ran to the end, or None.
+        """
+        return (self.filter(survey=survey, mode=mode, status=EvaluationJob.STATUS_DONE)
+                .order_by('-finished_at', '-pk').first())
+
+    def prune(self, before):
+        """
+        Delete the jobs that finished before ``before``, but the last done job of every survey and mode.
+        """
+        last = (self.filter(status=EvaluationJob.STATUS_DONE).order_by()
+                .values('survey', 'mode').annotate(last=models.Max('pk')).values_list('last', flat=True))
+        finished = self.filter(status__in=[EvaluationJob.STATUS_DONE, EvaluationJob.STATUS_FAILED],
+                               finished_at__lt=before)
+        return finished.exclude(pk__in=list(last)).delete()[0]
+
+    def claim(self):
+        """
+        Take the oldest pending job and mark it as running, or return None when the queue is empty.
+        """
+        while True:
+            job = self.filter(status=EvaluationJob.STATUS_PENDING).order_by('pk').first()
+            if job is None:
+                return None
+            # Only one worker wins the update when several of them picked the same job
+            if self.filter(pk=job.pk, status=EvaluationJob.STATUS_PENDING).update(
+                    status=EvaluationJob.STATUS_RUNNING, started_at=timezone.now()):
+                return self.get(pk=job.pk)
+
+
+class EvaluationJob(models.Model):
+    MODE_LAST = 'last'
+    MODE_TOTAL = 'total'
+
+    MODE_CHOICES = (
+        (MODE_LAST, 'Process new answers'),
+        (MODE_TOTAL, 'Recalculate all answers'),
+    )
+
+    STATUS_PENDING = 'pending'
+    STATUS_RUNNING = 'running'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+
+    STATUS_CHOICES = (
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_RUNNING, 'Running'),
+        (STATUS_DONE, 'Done'),
+        (STATUS_FAILED, 'Failed'),
+    )
+
+    objects = EvaluationJobManager()
+
+    survey = models.ForeignKey(Survey, on_delete=models.CASCADE, related_name='evaluation_jobs')
+    mode = models.CharField(max_length=10, choices=MODE_CHOICES, default=MODE_LAST)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_PENDING, db_index=True)
+    messages = jsonfield.JSONField(default=list, blank=True)
+    # Timings and counters of the evaluation phases, see reports.profiling
+    profile = jsonfield.JSONField(default=dict, blank=True)
+    error = models.TextField(default='', blank=True)
+    created_at = models.DateTimeField('Datetime of creation', auto_now_add=True)
+    started_at = models.DateTimeField(blank=True, null=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        ordering = ['-id']
+
+    def __str__(self):
+        return "%s %s: %s" % (self.survey_id, self.mode, self.status)
+
+    def to_dict(self):
+        return {
+            'id': self.pk,
+            'survey': self.survey_id,
+            'mode': self.mode,
+            'status': self.status,
+            'messages': self.messages,
+            'profile': self.profile,
+            'error': self.error,
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+        }
+
+
+class EvaluationCheckpoint(models.Model):
+    """
+    Progress of a total recalculation committed in chunks, see ``TotalEvaluator.process_chunked``.
+
+    ``state`` holds the partial stats of the answers up to ``after``, the recalculation
+    covers the answers up to ``last`` and catches up with newer ones when it finishes.
+    Answers up to ``after`` that are edited or deleted meanwhile are kept in ``retracted``
+    as they were counted, the recalculation takes them out of its results when it finishes.
+    """
+    # Fields of answers kept in retracted
+    RETRACTED_FIELDS = ('id', 'survey_id', 'country_id', 'region_id', 'organization_id', 'hcp_category_id',
+                        'created_at', 'body', 'data')
+
+    survey = models.OneToOneField(Survey, on_delete=models.CASCADE, related_name='evaluation_checkpoint')
+    after = models.PositiveIntegerField(default=0)
+    last = models.PositiveIntegerField(default=0)
+    # Representations the partial stats were built for, a run over other ones starts anew
+    representations = jsonfield.JSONField(default=list)
+    state = jsonfield.JSONField(default=dict)
+    retracted = jsonfield.JSONField(default=list)
+    started_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return "%s: %s of %s" % (self.survey_id, self.after, self.last)
+
+    def add_retracted(self, answer):
+        """
+        Keep the counted version of an edited or deleted answer, later versions were not counted.
+        """
+        if any(fields['id'] == answer.pk for fields in self.retracted):
+            return
+        fields = {name: getattr(answer, name) for name in self.RETRACTED_FIELDS}
+        fields['created_at'] = answer.created_at.isoformat()
+        self.retracted.append(fields)
+        self.save(update_fields=['retracted'])
+
+    def get_retracted(self):
+        return [Answer(**dict(fields, created_at=parse_datetime(fields['created_at']))) for fields in self.retracted]
+
+    def get_partial(self):
+        """
+        The stored state in the form of ``ShardEvaluator.get_partial``.
+        """
+        state = self.state
+        if not state:
+            return None
+        return {
+            'survey': {(survey_id, country_id): (total, parse_datetime(last))
+                       for survey_id, country_id, total, last in state['survey']},
+            'organization': {(survey_id, country_id, organization_id): total
+                             for survey_id, country_id, organization_id, total in state['organization']},
+            'question': {(survey_id, country_id, representation_id): data
+                         for survey_id, country_id, representation_id, data in state['question']},
+            'cube': {tuple(key): data for key, data in state.get('cube', [])},
+            'trend': {(survey_id, country_id, period, parse_date(start)): (total, data)
+                      for survey_id, country_id, period, start, total, data in state.get('trend', [])},
+            'messages': state['messages'],
+            'watermark': state['watermark'],
+            'recent': state.get('recent', []),
+            'options': state['options'],
+            'profile': state.get('profile'),
+        }
+
+    def set_partial(self, partial):
+        self.state = {
+            'survey': [list(key) + [total, last.isoformat()] for key, (total, last) in partial['survey'].items()],
+            'organization': [list(key) + [total] for key, total in partial['organization'].items()],
+            'question': [list(key) + [data] for key, data in partial['question'].items()],
+            'cube': [[list(key), data] for key, data in partial['cube'].items()],
+            'trend': [[survey_id, country_id, period, start.isoformat(), total, data]
+                      for (survey_id, country_id, period, start), (total, data) in partial['trend'].items()],
+            'messages': partial['messages'],
+            'watermark': partial['watermark'],
+            'recent': partial['recent'],
+            'options': partial['options'],
+            'profile': partial.get('profile'),
+        }
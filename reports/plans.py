@@ -0,0 +1,141 @@
+"""
+Evaluation plans: what evaluating answers of a survey needs to know about its questions, compiled once.
+
+Plans are cached per process and dropped by ``invalidate_plan`` when the questions,
+representations, countries or evaluated cube slices of a survey change, see ``ReportsConfig.ready``.
+Other processes learn about the change from the plan version of the survey in
+``SurveyVersion``, which is bumped in the transaction of the change.
+"""
+from survey.models import Question, Survey
+from .models import CubeSlice, QuestionStat, Representation, SurveyVersion
+
+# Survey id to the version the plan was compiled at and the plan
+_plans = {}
+
+
+class EvaluationPlan(object):
+    # Submitted options whose normalized forms are remembered, free text options would fill the memory otherwise
+    max_options = 10000
+
+    def __init__(self, survey_id, representations, country_ids, dependencies=(), cube_cells=()):
+        self.survey_id = survey_id
+        self.representation_list = representations
+        # (organization id, HCP category id) cells of the cube of the evaluated slices, see CubeSlice
+        self.cube_cells = set(cube_cells)
+        # Question id to the question, its representation and the name of the processor for it
+        self.questions = {}
+        self.representations = {}
+        self.processors = {}
+        # (question id, country id) to the keys of the Europe and the country question stats
+        self.stat_keys = {}
+        # Submitted option to its stripped form and the lowered form stats are counted by, up to max_options
+        self.options = {}
+        # Question id to the distribution bins of averages and whether raw values are kept next to them
+        self.dist_specs = {}
+        # Question id to the (lowered options, question id, answer) rules its answers trigger,
+        # see Question.dependency_answer
+        self.dependencies = {}
+        for source_id, options, target_id, answer in dependencies:
+            self.dependencies.setdefault(source_id, []).append((options, target_id, answer))
+
+        processor_names = {name for name, _ in Representation.TYPE_CHOICES}
+        for representation in representations:
+            question = representation.question
+            self.questions[question.pk] = question
+            self.representations[question.pk] = representation
+            if representation.type in processor_names:
+                self.processors[question.pk] = '%s_processor' % representation.type
+            if representation.type == Representation.TYPE_AVERAGE_PERCENT:
+                self.dist_specs[question.pk] = (QuestionStat.get_dist_spec(representation),
+                                                representation.keep_raw_values)
+            for country_id in country_ids:
+                self.stat_keys[(question.pk, country_id)] = (
+                    (survey_id, None, representation.pk), (survey_id, country_id, representation.pk))
+
+    @classmethod
+    def compile(cls, survey, dimensions):
+        representations = list(Representation.objects.filter(question__survey_id=survey.pk).
+                               select_related('question').filter(active=True))
+        country_ids = [country.pk for country in dimensions.get_countries(survey)]
+        dependencies = [(q.depends_on_id, q.get_available_if_options(), q.pk, q.dependency_answer)
+                        for q in Question.objects.filter(survey_id=survey.pk, depends_on__isnull=False)
+                        .exclude(dependency_answer='')]
+        cube_cells = CubeSlice.objects.evaluated(survey).values_list('organization_id', 'hcp_category_id')
+        return cls(survey.pk, representations, country_ids, dependencies, cube_cells)
+
+    def get_stat_keys(self, question_id, country_id):
+        try:
+            return self.stat_keys[(question_id, country_id)]
+        except KeyError:
+            # The country is not in the survey, its stat is missing too
+            r = self.representations[question_id]
+            return (self.survey_id, None, r.pk), (self.survey_id, country_id, r.pk)
+
+    def normalize_option(self, option):
+        """
+        Stripped and lowered forms of a submitted option, None for blank options.
+        """
+        try:
+            return self.options[option]
+        except KeyError:
+            stripped = option.strip()
+            normalized = (stripped, stripped.lower()) if stripped else None
+            if len(self.options) >= self.max_options:
+                self.options.clear()
+            self.options[option] = normalized
+            return normalized
+
+
+def get_plan(survey, dimensions):
+    version = SurveyVersion.get(survey.pk, 'plan')
+    cached = _plans.get(survey.pk)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+    plan = EvaluationPlan.compile(survey, dimensions)
+    _plans[survey.pk] = (version, plan)
+    return plan
+
+
+def invalidate_plan(*survey_ids):
+    """
+    Drop the plans of the surveys, in other processes once the change is committed.
+    """
+    for survey_id in survey_ids:
+        _plans.pop(survey_id, None)
+    SurveyVersion.bump(survey_ids, 'plan')
+
+
+def clear_plans():
+    """
+    Drop the plans this process compiled.
+    """
+    _plans.clear()
+
+
+def on_survey_changed(sender, instance, **kwargs):
+    invalidate_plan(instance.pk)
+
+
+def on_question_changed(sender, instance, **kwargs):
+    invalidate_plan(instance.survey_id)
+
+
+def on_cube_slice_changed(sender, instance, **kwargs):
+    invalidate_plan(instance.survey_id)
+
+
+def on_representation_changed(sender, instance, **kwargs):
+    # The question of a deleted representation may be gone already, deleting it invalidated the plan
+    invalidate_plan(*Question.objects.filter(pk=instance.question_id).values_list('survey_id', flat=True))
+
+
+def on_survey_countries_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if not action.startswith('post_'):
+        return
+    if not reverse:
+        invalidate_plan(instance.pk)
+    elif pk_set is not None:
+        invalidate_plan(*pk_set)
+    else:
+        # The surveys of a cleared country are unknown by now, changes are rare enough to drop all plans
+        invalidate_plan(*Survey.objects.values_list('pk', flat=True))
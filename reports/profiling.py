@@ -0,0 +1,163 @@
+"""
+Timings and counters of the phases of an evaluator run.
+
+Every evaluator keeps a ``Profile``: how long loading the stats, building the plan,
+fetching, parsing and processing answers, merging partial results, updating the vars
+and saving took, and how many queries each phase issued. The run totals add the
+number of evaluated answers, the bytes of JSON written with the stats and the peak
+memory of the process since it started, which includes whatever ran in it before the
+evaluation. ``to_dict`` is what evaluation jobs store and log.
+
+Queries are counted by a cursor wrapper installed on the database connection for the
+duration of ``count_queries``, as Django only records queries when ``DEBUG`` is on.
+Outside of it, e.g. for live evaluations in web requests, the connection is left
+alone and the profile counts no queries.
+"""
+import resource
+import sys
+from contextlib import contextmanager
+from time import perf_counter
+
+from django.db import DEFAULT_DB_ALIAS, connection, connections
+from django.db.backends.utils import CursorWrapper, CursorDebugWrapper
+from jsonfield import JSONField
+
+# Phases in the order a run goes through them, others are listed after these
+PHASES = ('load_stat', 'fill_out', 'fetch', 'parse', 'process', 'expand', 'aggregate', 'merge',
+          'update_vars', 'save')
+
+
+class QueryCountMixin(object):
+    def execute(self, sql, params=None):
+        self.db.query_count += 1
+        return super().execute(sql, params)
+
+    def executemany(self, sql, param_list):
+        self.db.query_count += 1
+        return super().executemany(sql, param_list)
+
+
+class CountingCursorWrapper(QueryCountMixin, CursorWrapper):
+    pass
+
+
+class CountingCursorDebugWrapper(QueryCountMixin, CursorDebugWrapper):
+    pass
+
+
+@contextmanager
+def count_queries(conn=None):
+    """
+    Count the queries run through the connection in its ``query_count`` attribute.
+
+    The cursor factories of the connection, the default one unless given, are replaced
+    while the context is active and restored when the outermost context exits.
+    ``query_count`` only grows.
+    """
+    if conn is None:
+        conn = connections[DEFAULT_DB_ALIAS]
+    depth = getattr(conn, 'query_count_depth', 0)
+    if not depth:
+        originals = {name: conn.__dict__[name] for name in ('make_cursor', 'make_debug_cursor')
+                     if name in conn.__dict__}
+        conn.query_count = getattr(conn, 'query_count', 0)
+        conn.make_cursor = lambda cursor: CountingCursorWrapper(cursor, conn)
+        conn.make_debug_cursor = lambda cursor: CountingCursorDebugWrapper(cursor, conn)
+    conn.query_count_depth = depth + 1
+    try:
+        yield conn
+    finally:
+        conn.query_count_depth = depth
+        if not depth:
+            for name in ('make_cursor', 'make_debug_cursor'):
+                if name in originals:
+                    setattr(conn, name, originals[name])
+                else:
+                    delattr(conn, name)
+
+
+def get_query_count(conn=connection):
+    """
+    Queries counted on the connection so far, see ``count_queries``.
+    """
+    return getattr(conn, 'query_count', 0)
+
+
+def get_peak_memory():
+    """
+    Peak resident memory of the process since it started, in kilobytes.
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+
+def get_json_size(objs):
+    """
+    Bytes of the JSON fields of the objects as they are written to the database.
+    """
+    size = 0
+    for obj in objs:
+        for field in obj._meta.concrete_fields:
+            if isinstance(field, JSONField):
+                size += len(field.get_prep_value(getattr(obj, field.attname)) or '')
+    return size
+
+
+class Profile(object):
+    def __init__(self):
+        self.started = perf_counter()
+        self.query_start = get_query_count()
+        # Phase name to [seconds, queries]
+        self.phases = {}
+        self.answers = 0
+        self.json_bytes = 0
+        # Counters of runs in other processes, see merge
+        self.merged_queries = 0
+        self.merged_peak_memory = 0
+
+    def add(self, name, seconds, queries=0):
+        totals = self.phases.get(name)
+        if totals is None:
+            totals = self.phases[name] = [0.0, 0]
+        totals[0] += seconds
+        totals[1] += queries
+
+    def get_queries(self):
+        return get_query_count() - self.query_start
+
+    @contextmanager
+    def phase(self, name):
+        start, queries = perf_counter(), get_query_count()
+        try:
+            yield
+        finally:
+            self.add(name, perf_counter() - start, get_query_count() - queries)
+
+    def merge(self, profile):
+        """
+        Add the phases and counters of a run in another process, given by its ``to_dict``.
+
+        Phase times of parallel runs add up, so they can exceed the elapsed time.
+        """
+        for phase in profile['phases']:
+            self.add(phase['name'], phase['seconds'], phase['queries'])
+        self.answers += profile['answers']
+        self.json_bytes += profile['json_bytes']
+        self.merged_queries += profile['queries']
+        self.merged_peak_memory = max(self.merged_peak_memory, profile.get('process_peak_memory_kb', 0))
+
+    def to_dict(self):
+        elapsed = perf_counter() - self.started
+        names = [name for name in PHASES if name in self.phases]
+        names += sorted(name for name in self.phases if name not in PHASES)
+        return {
+            'elapsed': elapsed,
+            'answers': self.answers,
+            'answers_per_second': self.answers / elapsed if elapsed else None,
+            'queries': self.get_queries() + self.merged_queries,
+            'json_bytes': self.json_bytes,
+            'process_peak_memory_kb': max(get_peak_memory(), self.merged_peak_memory),
+            'phases': [{'name': name, 'seconds': self.phases[name][0], 'queries': self.phases[name][1]}
+                       for name in names],
+        }
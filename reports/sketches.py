@@ -0,0 +1,123 @@
+"""
+Mergeable quantile sketches for numeric answers, kept in the ``data`` of question stats.
+
+A sketch is a t-digest: sorted centroids ``{'mean': [...], 'weight': [...]}`` that stay
+JSON serializable. Equal values share a centroid, so as long as a question has at most
+``2 * COMPRESSION`` distinct values the sketch holds them exactly and does not depend on
+the order values were added or sketches merged in. Above that the centroids are merged
+with the k1 scale function, which keeps them small near the tails and bounds the
+relative error of quantiles.
+"""
+import math
+from bisect import bisect_left
+
+COMPRESSION = 100
+
+
+def new_sketch():
+    return {'mean': [], 'weight': []}
+
+
+def add(sketch, value, weight=1):
+    """
+    Add ``weight`` occurrences of ``value`` to the sketch in place.
+    """
+    means = sketch['mean']
+    i = bisect_left(means, value)
+    if i < len(means) and means[i] == value:
+        sketch['weight'][i] += weight
+        return sketch
+    means.insert(i, value)
+    sketch['weight'].insert(i, weight)
+    if len(means) > 2 * COMPRESSION:
+        compress(sketch)
+    return sketch
+
+
+def remove(sketch, value, weight=1):
+    """
+    Take ``weight`` occurrences of ``value`` out of the sketch in place.
+
+    Exact sketches lose the value itself, compressed ones take it from the nearest centroid.
+    """
+    means = sketch['mean']
+    if not means:
+        return sketch
+    i = bisect_left(means, value)
+    if i == len(means) or (i and value - means[i - 1] < means[i] - value):
+        i -= 1
+    sketch['weight'][i] -= min(weight, sketch['weight'][i])
+    if not sketch['weight'][i]:
+        del means[i]
+        del sketch['weight'][i]
+    return sketch
+
+
+def merge(target, source):
+    """
+    Add all centroids of ``source`` to ``target`` in place.
+    """
+    for value, weight in zip(source['mean'], source['weight']):
+        add(target, value, weight)
+    return target
+
+
+def count(sketch):
+    return sum(sketch['weight'])
+
+
+def _k(q, compression):
+    return compression / (2 * math.pi) * math.asin(2 * q - 1)
+
+
+def _k_inverse(k, compression):
+    return (math.sin(k * 2 * math.pi / compression) + 1) / 2
+
+
+def compress(sketch, compression=COMPRESSION):
+    """
+    Merge neighbouring centroids in place, so that about ``compression`` of them remain.
+    """
+    total = count(sketch)
+    if not total:
+        return sketch
+    means, weights = [], []
+    cur_mean, cur_weight = sketch['mean'][0], sketch['weight'][0]
+    q0 = 0.0
+    q_limit = _k_inverse(_k(q0, compression) + 1, compression)
+    for mean, weight in zip(sketch['mean'][1:], sketch['weight'][1:]):
+        if q0 + (cur_weight + weight) / total <= q_limit:
+            cur_weight += weight
+            cur_mean += (mean - cur_mean) * weight / cur_weight
+        else:
+            means.append(cur_mean)
+            weights.append(cur_weight)
+            q0 += cur_weight / total
+            q_limit = _k_inverse(min(_k(q0, compression) + 1, compression / 4), compression)
+            cur_mean, cur_weight = mean, weight
+    means.append(cur_mean)
+    weights.append(cur_weight)
+    sketch['mean'], sketch['weight'] = means, weights
+    return sketch
+
+
+def quantile(sketch, q):
+    """
+    Estimate the ``q`` quantile, between 0 and 1, of the values in the sketch. None for empty sketches.
+
+    Values are ranked like sorted answers, each centroid covering as many ranks as its
+    weight, and ranks between two centroids are interpolated linearly. For exact sketches
+    this is the usual linear interpolation, e.g. the median of an even number of values.
+    """
+    means, weights = sketch['mean'], sketch['weight']
+    if not means:
+        return None
+    rank = q * (count(sketch) - 1)
+    end = -1
+    for i, (mean, weight) in enumerate(zip(means, weights)):
+        start, end = end + 1, end + weight
+        if rank <= end:
+            if rank >= start or not i:
+                return mean
+            return means[i - 1] + (mean - means[i - 1]) * (rank - start + 1)
+    return means[-1]
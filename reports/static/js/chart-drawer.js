@@ -28,9 +28,48 @@ $(function() {
     drawDistributionChart: function(chartContainerId, chartId, labelsId, data) {
       var drawFn = drawDistributionChart.bind(this, chartId, labelsId, data);
       drawOnScroll(chartContainerId, drawFn);
+    },
+    drawTrendChart: function(chartId, url) {
+      var drawFn = drawTrendChart.bind(this, chartId, url);
+      drawOnScroll(chartId, drawFn);
     }
   };
 
+  function drawTrendChart(chartId, url) {
+    $.getJSON(url, function(trend) {
+      var chartOptions = {
+        type: 'line',
+        data: {
+          labels: trend.labels,
+          datasets: [{
+            label: 'Entries',
+            data: trend.total,
+            borderColor: '#c8102e',
+            backgroundColor: 'rgba(200, 16, 46, 0.1)',
+            lineTension: 0
+          }]
+        },
+        options: {
+          legend: false,
+          responsive: true,
+          scales: {
+            yAxes: [{ticks: {beginAtZero: true, precision: 0}}]
+          }
+        }
+      };
+      if (window.prepareCharts) {
+        chartOptions.options.animation = {
+          duration: 0,
+          onComplete: function() {
+            chartCount -= 1;
+          }
+        };
+        chartOptions.options.maintainAspectRatio = false;
+      }
+      new Chart($(chartId).get(0).getContext('2d'), chartOptions);
+    });
+  }
+
   function drawPie(pieData, pieId, legendId) {
     _drawPie(pieData, pieId, legendId, _pieLabelCallback)
   }
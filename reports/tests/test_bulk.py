@@ -0,0 +1,75 @@
+from datetime import datetime
+from mixer.backend.django import mixer
+import pytest
+
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from survey.models import Survey
+from insights.users.models import Country
+
+from ..bulk import bulk_save, bulk_update
+from ..models import SurveyStat, QuestionStat, Representation
+
+pytestmark = pytest.mark.django_db
+
+
+class TestBulk(TestCase):
+    def setUp(self):
+        self.survey = mixer.blend(Survey)
+        self.c1 = mixer.blend(Country)
+        self.c2 = mixer.blend(Country)
+
+    def test_bulk_update(self):
+        r = mixer.blend(Representation)
+        q1 = mixer.blend(QuestionStat, survey=self.survey, country=None, representation=r, data={})
+        q2 = mixer.blend(QuestionStat, survey=self.survey, country=self.c1, representation=r, data={})
+        q1.data = {'cnt': 1, 'top': {'x': 1}}
+        q2.data = {'cnt': 2}
+        q2.ordering = 5
+        bulk_update([q1, q2], batch_size=1)
+
+        q1.refresh_from_db()
+        q2.refresh_from_db()
+        assert q1.data == {'cnt': 1, 'top': {'x': 1}}
+        assert q2.data == {'cnt': 2}
+        assert q2.ordering == 5
+        assert q2.country_id == self.c1.pk
+
+    def test_bulk_save(self):
+        d1 = timezone.make_aware(datetime(2017, 1, 1))
+        mixer.blend(SurveyStat, survey=self.survey, country=None, total=1)
+        mixer.blend(SurveyStat, survey=self.survey, country=self.c1, total=1)
+        s1, s2 = SurveyStat.objects.order_by('pk')
+        assert not s1.is_dirty()
+
+        s1.last = d1
+        assert s1.is_dirty()
+        s3 = SurveyStat(survey=self.survey, country=self.c2, total=3)
+
+        with self.assertNumQueries(2):
+            bulk_save([s1, s2, s3])
+        assert not s1.is_dirty()
+
+        assert SurveyStat.objects.get(pk=s1.pk).last == d1
+        assert SurveyStat.objects.get(country=self.c2).total == 3
+
+    def test_bulk_save_changed_fields(self):
+        r = mixer.blend(Representation)
+        mixer.cycle(3).blend(QuestionStat, survey=self.survey, country=None, representation=r, data={}, vars={})
+        q1, q2, q3 = QuestionStat.objects.order_by('pk')
+        q1.data = {'cnt': 1}
+        q2.data = {'cnt': 2}
+        q3.ordering = 7
+        assert q1.get_changed_fields() == ['data']
+
+        with CaptureQueriesContext(connection) as queries:
+            assert bulk_save([q1, q2, q3]) == [q1, q2, q3]
+        updates = [query['sql'] for query in queries]
+        assert len(updates) == 2, 'One update of the objects with the same changed fields'
+        assert all('"vars"' not in sql for sql in updates), 'Unchanged fields are not written'
+        assert not any(q.is_dirty() for q in (q1, q2, q3))
+        assert [QuestionStat.objects.get(pk=q.pk).data for q in (q1, q2, q3)] == [{'cnt': 1}, {'cnt': 2}, {}]
+        assert QuestionStat.objects.get(pk=q3.pk).ordering == 7
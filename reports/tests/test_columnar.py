@@ -0,0 +1,151 @@
+from datetime import date, timedelta
+from mixer.backend.django import mixer
+import pytest
+
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from survey.models import Answer, Question
+
+from ..columnar import GrowingArray, get_columns, get_dist_positions, clear_columns
+from ..evaluators import TotalEvaluator
+from ..models import QuestionStat, Representation, SurveyVersion, TrendStat
+from ..plans import clear_plans
+from .test_evaluators import GeneratedAnswersMixin
+
+pytestmark = pytest.mark.django_db
+
+
+def test_growing_array():
+    array = GrowingArray('int16')
+    for chunk in ([1, 2], [], [3], list(range(4, 40))):
+        array.extend(chunk)
+    assert array.data.tolist() == list(range(1, 40))
+    assert len(array.buffer) < 2 * 39, 'Capacity doubles'
+
+
+def test_get_dist_positions():
+    values = [0, 5, 10, 10.5, 19.9, 20, 55, 100, 120]
+    spec = [0, 100.0, 10]
+    assert get_dist_positions(values, *spec).tolist() == [
+        QuestionStat.get_dist_position(str(v), *spec) for v in values]
+
+
+class TestAnswerColumns(GeneratedAnswersMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        clear_plans()
+        clear_columns()
+
+    def summaries(self, columns, **filters):
+        return {s['representation']: s for s in columns.summarize(columns.get_mask(**filters))['representations']}
+
+    def assert_matches(self, summaries, stats):
+        for stat in stats:
+            summary, data = summaries[stat.representation_id], stat.data
+            if stat.type == Representation.TYPE_YES_NO:
+                assert (summary['cnt'], summary['yes']) == (data['main_cnt'], data['main_yes'])
+            elif stat.type == Representation.TYPE_AVERAGE_PERCENT:
+                assert summary['cnt'] == data['main_cnt']
+                assert summary['mean'] == pytest.approx(data['main_sum'] / data['main_cnt'])
+                assert summary['bins'] == data['bins']
+            else:
+                assert summary['cnt'] == data['cnt']
+                for name, counts in summary.items():
+                    if name.startswith('top'):
+                        assert {label.lower(): n for label, n in counts} == data[name]
+
+    def test_matches_stats(self):
+        TotalEvaluator.process_answers(self.survey)
+        columns = get_columns(self.survey)
+        assert columns.size == 60
+        assert columns.messages == []
+
+        stats = QuestionStat.objects.current(self.survey)
+        self.assert_matches(self.summaries(columns), stats.cell().filter(country=None))
+        country = self.countries[0]
+        self.assert_matches(self.summaries(columns, countries=[country.pk]), stats.cell().filter(country=country))
+        org, hcp = self.orgs[1], self.hcp_categories[0]
+        self.assert_matches(self.summaries(columns, organizations=[org.pk], hcp_categories=[hcp.pk]),
+                            stats.cell(org.pk, hcp.pk).filter(country=None))
+
+    def test_filters(self):
+        columns = get_columns(self.survey)
+        answers = self.survey.answers.all()
+        assert columns.get_mask(regions=[self.regions[0].pk, self.regions[3].pk]).sum() == \
+            answers.filter(region__in=[self.regions[0], self.regions[3]]).count()
+        assert columns.get_mask(hcp_categories=[None]).sum() == answers.filter(hcp_category=None).count()
+
+        first = answers.order_by('pk').first()
+        Answer.objects.filter(pk=first.pk).update(created_at=timezone.now() - timedelta(days=10))
+        clear_columns()
+        columns = get_columns(self.survey)
+        today = date.today()
+        assert columns.get_mask(end=today - timedelta(days=1)).sum() == 1
+        assert columns.get_mask(start=today - timedelta(days=10), end=today - timedelta(days=10)).sum() == 1
+        assert columns.get_mask(start=today).sum() == 59
+
+    def test_refresh(self):
+        columns = get_columns(self.survey)
+        q = Question.objects.get(survey=self.survey, type=Question.TYPE_MULTISELECT_WITH_OTHER)
+        answer = self.survey.answers.first()
+        mixer.blend(Answer, survey=self.survey, country=answer.country, organization=answer.organization,
+                    data={str(q.pk): {'': ['A brand new option']}})
+
+        with self.assertNumQueries(3):
+            refreshed = get_columns(self.survey)
+        assert refreshed is columns, 'New answers are appended'
+        assert columns.size == 61
+        options = columns.options[q.pk]
+        assert options.lowers[-1] == 'a brand new option'
+        assert options.rows.data[-1] == 60, 'Only the selected options are kept'
+        assert options.options.data[-1] == len(options.lowers) - 1
+        assert options.ranks.data[-1] == 0
+
+        clear_plans()
+        assert get_columns(self.survey) is not columns, 'Columns are built anew for a new plan'
+
+    def test_edited_in_other_process(self):
+        columns = get_columns(self.survey)
+        # Another process edited an answer and bumped the version of the answers
+        SurveyVersion.bump([self.survey.pk], 'answers')
+        assert get_columns(self.survey) is not columns
+
+    def test_edited(self):
+        columns = get_columns(self.survey)
+        answer = self.survey.answers.first()
+        answer.save()
+        assert SurveyVersion.objects.get(survey=self.survey).answers == 1
+        assert get_columns(self.survey) is not columns
+
+    @override_settings(REPORTS_SUBMISSION_TIMEOUT=300)
+    def test_late_commit(self):
+        last = self.survey.answers.order_by('pk').last()
+        answer = self.survey.answers.first()
+        mixer.blend(Answer, pk=last.pk + 5, survey=self.survey, country=answer.country,
+                    organization=answer.organization)
+        columns = get_columns(self.survey)
+        assert columns.size == 61
+        assert len(columns.recent) == 61, 'Answers submitted within the timeout stay recent'
+
+        # An answer submitted earlier commits after the one with the higher id was loaded
+        mixer.blend(Answer, pk=last.pk + 2, survey=self.survey, country=answer.country,
+                    organization=answer.organization)
+        assert get_columns(self.survey) is columns
+        assert columns.size == 62
+
+        with self.settings(REPORTS_SUBMISSION_TIMEOUT=0):
+            columns.refresh()
+        assert (columns.watermark, columns.recent) == (last.pk + 5, {})
+        assert columns.size == 62
+
+    @override_settings(TIME_ZONE='Asia/Tokyo')
+    def test_local_days(self):
+        # 20:00 UTC is the next day in Tokyo
+        created_at = timezone.now().replace(hour=20, minute=0, second=0, microsecond=0) - timedelta(days=3)
+        Answer.objects.filter(pk=self.survey.answers.order_by('pk').first().pk).update(created_at=created_at)
+        clear_columns()
+        day = dict(TrendStat.get_buckets(created_at))[TrendStat.PERIOD_DAY]
+        assert day == created_at.date() + timedelta(days=1)
+        assert get_columns(self.survey).get_mask(start=day, end=day).sum() == 1, 'Days agree with the trends'
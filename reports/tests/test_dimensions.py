@@ -0,0 +1,55 @@
+from mixer.backend.django import mixer
+import pytest
+
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from insights.users.models import Country
+from survey.models import Survey, Organization, Region
+
+from ..dimensions import Dimensions
+
+pytestmark = pytest.mark.django_db
+
+
+class TestDimensions(TestCase):
+    def setUp(self):
+        self.countries = [mixer.blend(Country, ordering=2), mixer.blend(Country, ordering=1)]
+        self.orgs = mixer.cycle(3).blend(Organization, name=mixer.sequence("org_{0}"))
+        self.surveys = [
+            mixer.blend(Survey, countries=self.countries, organizations=self.orgs[:2]),
+            mixer.blend(Survey, countries=self.countries[:1], organizations=self.orgs[2:]),
+            mixer.blend(Survey),
+        ]
+        self.surveys[2].countries.clear()
+        self.regions = [mixer.blend(Region, country=c) for c in self.countries]
+
+    def test_lookups(self):
+        dimensions = Dimensions()
+        s1, s2, s3 = self.surveys
+        assert dimensions.get_countries(s1) == list(s1.countries.all()) == self.countries[::-1], 'In report order'
+        assert dimensions.get_countries(s2) == self.countries[:1]
+        assert dimensions.get_countries(s3) == []
+        assert dimensions.get_organizations(s1) == list(s1.organizations.all())
+        assert dimensions.get_organizations(s2) == self.orgs[2:]
+        assert dimensions.get_country(s1, self.countries[1].pk) == self.countries[1]
+        with pytest.raises(KeyError):
+            dimensions.get_country(s2, self.countries[1].pk)
+        assert dimensions.get_regions(s1, self.countries[0].pk) == [self.regions[0]]
+        assert dimensions.get_regions(s1, None) == self.countries[::-1]
+
+    def test_shared_by_surveys(self):
+        dimensions = Dimensions()
+        with CaptureQueriesContext(connection) as first:
+            for survey in self.surveys[:1]:
+                dimensions.get_countries(survey)
+                dimensions.get_organizations(survey)
+                dimensions.get_regions(survey, self.countries[0].pk)
+        with CaptureQueriesContext(connection) as others:
+            for survey in self.surveys[1:]:
+                dimensions.get_countries(survey)
+                dimensions.get_organizations(survey)
+                dimensions.get_regions(survey, self.countries[0].pk)
+        assert len(first) == 5
+        assert len(others) == 0, 'Every table is queried once for all surveys'
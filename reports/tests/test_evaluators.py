@@ -1,17 +1,24 @@
-from datetime import datetime
+from datetime import datetime, timedelta
+import random
 from mixer.backend.django import mixer
 import pytest
 from querystring_parser.parser import MalformedQueryStringError
-from unittest.mock import patch, MagicMock
+from unittest.mock import patch
 
-from django.test import TestCase
+from django.db import DatabaseError, connection, transaction
+from django.db.transaction import TransactionManagementError
+from django.core.cache import cache
+from django.test import TestCase, TransactionTestCase, override_settings
 from django.utils import timezone
 
-from survey.models import Answer, Survey, Organization, Question, Region, Option
+from survey.models import Answer, Survey, Organization, Question, Region, Option, HCPCategory
+from survey.factories import make_answer_body
 from insights.users.models import User, Country
 
-from ..models import SurveyStat, OrganizationStat, QuestionStat, Representation, OptionDict
-from ..evaluators import TotalEvaluator, LastEvaluator
+from ..models import (SurveyStat, OrganizationStat, QuestionStat, Representation, OptionDict, AnswerValue,
+                      EvaluationCheckpoint, TrendStat, CubeSlice, ExpandedAnswer)
+from ..evaluators import TotalEvaluator, LastEvaluator, AggregateEvaluator, LiveEvaluator, ShardEvaluator
+from ..jobs import has_new_answers
 
 pytestmark = pytest.mark.django_db
 
@@ -26,15 +33,43 @@ class TestTotalEvaluator(TestCase):
 
     def test_get_answers(self):
         (o1, o2) = mixer.cycle(2).blend(Organization, name=mixer.sequence("org_{0}"))
-        mixer.blend(Answer, survey=self.survey, organization=o1, is_updated=True)
-        mixer.blend(Answer, survey=self.survey, organization=o2, is_updated=False)
+        mixer.blend(Answer, survey=self.survey, organization=o1)
+        mixer.blend(Answer, survey=self.survey, organization=o2)
         answers = self.evaluator.get_answers()
         assert len(answers) == 2, 'Should return all records'
 
-    def test_clear(self):
-        assert SurveyStat.objects.all().count() == 0, 'Cleared'
-        assert OrganizationStat.objects.all().count() == 0, 'Cleared'
-        assert QuestionStat.objects.all().count() == 0, 'Cleared'
+    def test_iter_answers(self):
+        (o1, o2) = mixer.cycle(2).blend(Organization, name=mixer.sequence("org_{0}"))
+        answers = mixer.cycle(5).blend(Answer, survey=self.survey, organization=(o for o in [o1, o2] * 3))
+        mixer.blend(Answer, organization=o1)
+        self.evaluator.chunk_size = 2
+
+        streamed = list(self.evaluator.iter_answers())
+        assert [a.pk for a in streamed] == [a.pk for a in answers], 'All answers of the survey in pk order'
+        assert streamed[0].organization_id == o1.pk
+        assert streamed[0].get_deferred_fields() == {'user_id'}, 'Unused columns are not fetched'
+        with self.assertNumQueries(0):
+            assert streamed[0].body == answers[0].body, 'Answers without data are parsed without a query per answer'
+
+        Answer.objects.filter(pk__in=[a.pk for a in answers[:3]]).update(data={})
+        with self.assertNumQueries(7):
+            # Count and chunks, and one query per chunk with answers without data
+            streamed = list(self.evaluator.iter_answers())
+        assert streamed[0].get_deferred_fields() == {'user_id', 'body'}, 'Bodies of answers with data are not fetched'
+        assert streamed[3].body == answers[3].body
+
+    def test_generation(self):
+        current = mixer.blend(SurveyStat, survey=self.survey, country=None, total=5)
+        evaluator = self.evaluator_cls(self.survey)
+        assert evaluator.generation == self.survey.stat_generation + 1
+        assert evaluator.survey_stat == {}, 'The new generation starts empty'
+        assert list(SurveyStat.objects.current(self.survey)) == [current], 'Reports read the current one meanwhile'
+
+        evaluator.fill_out()
+        evaluator.save()
+        assert Survey.objects.get(pk=self.survey.pk).stat_generation == evaluator.generation
+        assert [s.total for s in SurveyStat.objects.current(self.survey)] == [0]
+        assert not SurveyStat.objects.filter(pk=current.pk).exists(), 'The previous generation is deleted'
 
     def test_load_stat(self):
         c1 = mixer.blend(Country, use_in_reports=True)
@@ -45,24 +80,26 @@ class TestTotalEvaluator(TestCase):
 
         evaluator = self.evaluator_cls(s1)
 
-        mixer.blend(SurveyStat, survey=s1, country=None)
-        mixer.blend(SurveyStat, survey=s1, country=c1)
-        mixer.blend(SurveyStat, survey=s2, country=c1)
-        mixer.blend(OrganizationStat, survey=s1, country_id=None, organization=o1)
-        mixer.blend(OrganizationStat, survey=s1, country=c1, organization=o1)
-        mixer.blend(OrganizationStat, survey=s2, country=c1, organization=o1)
-        mixer.blend(OrganizationStat, survey=s2, country=c1, organization=o2)
+        generation = evaluator.generation
+        mixer.blend(SurveyStat, survey=s1, country=None, generation=generation)
+        mixer.blend(SurveyStat, survey=s1, country=c1, generation=generation)
+        mixer.blend(SurveyStat, survey=s1, country=c2, generation=generation + 1)
+        mixer.blend(SurveyStat, survey=s2, country=c1, generation=generation)
+        mixer.blend(OrganizationStat, survey=s1, country_id=None, organization=o1, generation=generation)
+        mixer.blend(OrganizationStat, survey=s1, country=c1, organization=o1, generation=generation)
+        mixer.blend(OrganizationStat, survey=s2, country=c1, organization=o1, generation=generation)
+        mixer.blend(OrganizationStat, survey=s2, country=c1, organization=o2, generation=generation)
 
         r1 = mixer.blend(Representation, active=True)
         r2 = mixer.blend(Representation, active=True)
 
-        mixer.blend(QuestionStat, survey=s1, country=None, representation=r1)
-        mixer.blend(QuestionStat, survey=s1, country=c1, representation=r1)
-        mixer.blend(QuestionStat, survey=s1, country=c1, representation=r2)
+        mixer.blend(QuestionStat, survey=s1, country=None, representation=r1, generation=generation)
+        mixer.blend(QuestionStat, survey=s1, country=c1, representation=r1, generation=generation)
+        mixer.blend(QuestionStat, survey=s1, country=c1, representation=r2, generation=generation)
 
         evaluator.load_stat()
-        assert len(evaluator.survey_stat) == 3
-        assert len(evaluator.organization_stat) == 4
+        assert len(evaluator.survey_stat) == 2, 'Only stats of the evaluated survey and generation are loaded'
+        assert len(evaluator.organization_stat) == 2
         assert len(evaluator.question_stat) == 3
 
     def test_fill_out(self):
@@ -78,12 +115,13 @@ class TestTotalEvaluator(TestCase):
 
         evaluator = self.evaluator_cls(s1)
 
-        mixer.blend(SurveyStat, survey=s1, country=None)
-        mixer.blend(SurveyStat, survey=s1, country=c1)
-        mixer.blend(OrganizationStat, survey=s1, country_id=None, organization=o1)
-        mixer.blend(OrganizationStat, survey=s1, country=c1, organization=o1)
-        mixer.blend(QuestionStat, survey=s1, country=None, representation=r1, type=r1.type)
-        mixer.blend(QuestionStat, survey=s1, country=c1, representation=r1, type=r1.type)
+        generation = evaluator.generation
+        mixer.blend(SurveyStat, survey=s1, country=None, generation=generation)
+        mixer.blend(SurveyStat, survey=s1, country=c1, generation=generation)
+        mixer.blend(OrganizationStat, survey=s1, country_id=None, organization=o1, generation=generation)
+        mixer.blend(OrganizationStat, survey=s1, country=c1, organization=o1, generation=generation)
+        mixer.blend(QuestionStat, survey=s1, country=None, representation=r1, type=r1.type, generation=generation)
+        mixer.blend(QuestionStat, survey=s1, country=c1, representation=r1, type=r1.type, generation=generation)
         evaluator.load_stat()
 
         assert len(evaluator.survey_stat) == 2
@@ -124,8 +162,8 @@ class TestTotalEvaluator(TestCase):
         mixer.blend(OrganizationStat, survey=s1, country=c1, organization=o1)
         mixer.blend(OrganizationStat, survey=s2, country=c1, organization=o1)
         mixer.blend(OrganizationStat, survey=s2, country=c1, organization=o2)
-        mixer.blend(Answer, survey=s1, organization=o1, is_updated=False)
-        mixer.blend(Answer, survey=s2, organization=o2, is_updated=False)
+        mixer.blend(Answer, survey=s1, organization=o1)
+        mixer.blend(Answer, survey=s2, organization=o2)
         self.evaluator_cls.process_answers(s1)
         self.evaluator_cls.process_answers(s2)
         assert process_answer.call_count == 2
@@ -133,10 +171,22 @@ class TestTotalEvaluator(TestCase):
         assert load_stat.call_count == 2
         assert save.call_count == 2
 
+    @patch('reports.evaluators.AbstractEvaluator.process_answers')
+    def test_process_surveys(self, process_answers):
+        s1 = mixer.blend(Survey)
+        s2 = mixer.blend(Survey)
+        evaluators = self.evaluator_cls.process_surveys([s1, s2])
+        assert len(evaluators) == 2
+        assert process_answers.call_count == 2
+        (args1, kwargs1), (args2, kwargs2) = process_answers.call_args_list
+        assert args1 == (s1,)
+        assert args2 == (s2,)
+        assert kwargs1['dimensions'] is kwargs2['dimensions'], 'Dimension lookup is shared'
+
     @patch('reports.evaluators.AbstractEvaluator.update_survey_stat')
     @patch('reports.evaluators.AbstractEvaluator.update_organization_stat')
     def test_process_answer_with_empty_data(self, organization_stat, survey_stat):
-
+        self.evaluator.fill_out()
         (o1, o2) = mixer.cycle(2).blend(Organization, name=mixer.sequence("org_{0}"))
         country = mixer.blend(Country, id=1)
         answer = mixer.blend(Answer, body='', survey=self.survey, organization=o1)
@@ -159,8 +209,20 @@ class TestTotalEvaluator(TestCase):
                              organization=o1)
         self.evaluator.process_answer(answer)
 
-        survey_stat.assert_called_once_with((answer.survey_id, country.pk), answer)
-        organization_stat.assert_called_once_with((answer.survey_id, country.pk, answer.organization_id))
+        survey_stat.assert_called_once_with((answer.survey_id, country.pk), answer, 1)
+        organization_stat.assert_called_once_with((answer.survey_id, country.pk, answer.organization_id), 1)
+
+    @patch('reports.evaluators.AbstractEvaluator.parse_query_string')
+    @patch('reports.evaluators.AbstractEvaluator.update_organization_stat')
+    def test_process_answer_structured_data(self, organization_stat, parse_query_string):
+        self.evaluator.fill_out()
+        o1 = mixer.blend(Organization)
+        answer = mixer.blend(Answer, body='data[111]=Yes', data={'111': 'Yes'}, survey=self.survey,
+                             organization=o1)
+        assert self.evaluator.get_answer_data(answer) == {111: 'Yes'}
+        self.evaluator.process_answer(answer)
+        assert parse_query_string.call_count == 0, 'Stored structured data is not parsed again'
+        organization_stat.assert_called_once_with((answer.survey_id, answer.country_id, answer.organization_id), 1)
 
     def test_process_answer(self):
         d1 = timezone.make_aware(datetime(2017, 1, 1))
@@ -174,58 +236,42 @@ class TestTotalEvaluator(TestCase):
         self.evaluator.load_stat()
 
     def test_process_dependencies(self):
-        self.evaluator.dependencies = [
-            {
-                'source': 3,
-                'target': 5,
-                'type': 'set_radio',
-                'additional': {
-                    'options': ['Aripiprazole-oral', 'Aripiprazole-LAI'],
-                    'anwser': 'Yes'
-                }
-            },
-            {
-                'source': 11,
-                'target': 13,
-                'type': 'set_radio',
-                'additional': {
-                    'options': ['Aripiprazole-oral', 'Aripiprazole-LAI'],
-                    'anwser': 'Yes'
-                }
-            }
-        ]
+        source = mixer.blend(Question, survey=self.survey, type=Question.TYPE_MULTISELECT_WITH_OTHER)
+        target = mixer.blend(Question, survey=self.survey, type=Question.TYPE_YES_NO, depends_on=source,
+                             available_if='Aripiprazole-oral|Aripiprazole-LAI', dependency_answer='Yes')
+        mixer.blend(Question, survey=self.survey, type=Question.TYPE_YES_NO, depends_on=source,
+                    available_if='Aripiprazole-oral', dependency_type=Question.DEPENDENCY_CONTEXTUAL)
+        self.evaluator.fill_out()
+        assert list(self.evaluator.plan.dependencies) == [source.pk], 'Display dependencies imply no answers'
 
         d1 = {
             1: {'main': '10', 'additional': ''},
-            2: 'Yes',
-            3: {'': ['Ari-oral', 'Resperidol-oral', 'Ari-LAI', ''], 'other': ''},
-            4: {'': ['Age', 'Preference of the patients', 'Efficacy profile', ''], 'other': ''},
-            6: {'': ['Age', 'Mechanism of Action', 'Preference of the patients', ''], 'other': ''},
-            7: 'No',
-            9: {'main': '', 'additional': ''},
-            11: {'': '', 'other': ''},
+            source.pk: {'': ['Ari-oral', 'Resperidol-oral', 'Ari-LAI'], 'other': ''},
             12: {'': '', 'other': ''},
-            14: {'': '', 'other': ''},
             16: 'xxx'
         }
         self.evaluator.process_dependencies(d1)
-        assert 5 not in d1
+        assert target.pk not in d1
 
         d2 = {
             1: {'main': '10', 'additional': ''},
-            2: 'Yes',
-            3: {'': ['Aripiprazole-oral', 'Resperidol-oral', 'Ari-LAI', ''], 'other': ''},
-            4: {'': ['Age', 'Preference of the patients', 'Efficacy profile', ''], 'other': ''},
-            6: {'': ['Age', 'Mechanism of Action', 'Preference of the patients', ''], 'other': ''},
-            7: 'No',
-            9: {'main': '', 'additional': ''},
-            11: {'': '', 'other': ''},
-            12: {'': '', 'other': ''},
-            14: {'': '', 'other': ''},
+            source.pk: {'': ['Resperidol-oral', 'aripiprazole-LAI'], 'other': ''},
+            target.pk: 'No',
             16: 'xxx'
         }
         self.evaluator.process_dependencies(d2)
-        assert d2[5] == 'Yes'
+        assert d2[target.pk] == 'Yes'
+
+        d3 = {source.pk: {'': 'Aripiprazole-oral'}}
+        self.evaluator.process_dependencies(d3)
+        assert d3[target.pk] == 'Yes'
+
+    def test_process_dependencies_without_rules(self):
+        self.evaluator.fill_out()
+        assert self.evaluator.plan.dependencies == {}
+        data = {3: {'': ['Aripiprazole-oral']}}
+        self.evaluator.process_dependencies(data)
+        assert data == {3: {'': ['Aripiprazole-oral']}}
 
     def test_update_survey_stat(self):
         d1 = timezone.make_aware(datetime(2017, 1, 1))
@@ -250,35 +296,95 @@ class TestTotalEvaluator(TestCase):
         assert self.evaluator.organization_stat[(1, 2, 3)].total == 2
 
     def test_save(self):
-        ss1 = MagicMock()
-        ss2 = MagicMock()
-        self.evaluator.survey_stat = {
-            (1, 1): ss1,
-            (1, 2): ss2,
-        }
+        c1 = mixer.blend(Country, use_in_reports=True)
+        c2 = mixer.blend(Country, use_in_reports=True)
+        o1 = mixer.blend(Organization)
+        generation = self.evaluator.generation
+        mixer.blend(SurveyStat, survey=self.survey, country=None, total=1, generation=generation)
+        mixer.blend(SurveyStat, survey=self.survey, country=c1, total=1, generation=generation)
+        mixer.blend(OrganizationStat, survey=self.survey, country=None, organization=o1, total=1,
+                    generation=generation)
+        self.evaluator.load_stat()
 
-        os1 = MagicMock()
-        os2 = MagicMock()
-        self.evaluator.organization_stat = {
-            (1, 2, 3): os1,
-            (1, 3, 3): os2,
-        }
+        self.evaluator.survey_stat[(self.survey.pk, None)].total = 2
+        self.evaluator.survey_stat[(self.survey.pk, c2.pk)] = SurveyStat(
+            survey=self.survey, country=c2, total=1, generation=generation)
 
-        qs1 = MagicMock()
-        qs2 = MagicMock()
-        self.evaluator.question_stat = {
-            (1, 2, 3): qs1,
-            (1, 3, 3): qs2,
-        }
+        with self.assertNumQueries(7):
+            # One INSERT for the new stat and one UPDATE for the changed one, unchanged stats are skipped.
+            # The rest switches reports to the new generation and deletes the previous one.
+            self.evaluator.save()
 
-        self.evaluator.save()
+        totals = {s.country_id: s.total for s in SurveyStat.objects.filter(survey=self.survey)}
+        assert totals == {None: 2, c1.pk: 1, c2.pk: 1}
+        assert OrganizationStat.objects.get(survey=self.survey).total == 1
+
+    def test_watermark(self):
+        o1 = mixer.blend(Organization)
+        answers = mixer.cycle(3).blend(Answer, survey=self.survey, organization=o1, body='')
+        self.evaluator = TotalEvaluator(self.survey)
+        assert self.evaluator.watermark == 0
 
-        os1.save.assert_called_once_with()
-        ss1.save.assert_called_once_with()
-        qs1.save.assert_called_once_with()
-        os2.save.assert_called_once_with()
-        ss2.save.assert_called_once_with()
-        qs2.save.assert_called_once_with()
+        self.evaluator.fill_out()
+        self.evaluator.evaluate(answers[:2])
+        assert self.evaluator.watermark == answers[1].pk
+        self.evaluator.save()
+        assert SurveyStat.objects.get(survey=self.survey, country=None).watermark == answers[1].pk
+
+        evaluator = LastEvaluator(self.survey)
+        assert evaluator.watermark == answers[1].pk
+        assert list(evaluator.get_answers()) == [answers[2]], 'Only answers above the watermark'
+
+    @override_settings(REPORTS_SUBMISSION_TIMEOUT=60)
+    def test_late_commit(self):
+        o1 = mixer.blend(Organization)
+        other = mixer.blend(Survey)
+        late, answer = mixer.cycle(2).blend(Answer, survey=self.survey, organization=o1, body='data[111]=Yes')
+        # The first answer is not committed yet when the second one is evaluated
+        Answer.objects.filter(pk=late.pk).update(survey=other)
+        LastEvaluator.process_answers(self.survey)
+        stat = SurveyStat.objects.get(survey=self.survey, country=None)
+        assert (stat.total, stat.watermark, stat.recent) == (1, 0, [answer.pk])
+
+        Answer.objects.filter(pk=late.pk).update(survey=self.survey)
+        assert has_new_answers(self.survey)
+        LastEvaluator.process_answers(self.survey)
+        stat = SurveyStat.objects.get(survey=self.survey, country=None)
+        assert (stat.total, stat.watermark, stat.recent) == (2, 0, [late.pk, answer.pk]), \
+            'Answers that commit late are evaluated'
+        assert not has_new_answers(self.survey)
+
+        self.survey.answers.update(created_at=timezone.now() - timedelta(minutes=2))
+        LastEvaluator.process_answers(self.survey)
+        stat = SurveyStat.objects.get(survey=self.survey, country=None)
+        assert (stat.total, stat.watermark, stat.recent) == (2, answer.pk, []), \
+            'The watermark moves up once no earlier answers can commit'
+
+    def test_trends(self):
+        c1 = mixer.blend(Country, use_in_reports=True)
+        o1 = mixer.blend(Organization)
+        self.survey.countries.add(c1)
+        q = mixer.blend(Question, survey=self.survey, type=Question.TYPE_YES_NO)
+        r = mixer.blend(Representation, question=q, type=Representation.TYPE_YES_NO, active=True)
+        created = [datetime(2017, 1, 2, 10, tzinfo=timezone.utc), datetime(2017, 1, 4, 10, tzinfo=timezone.utc),
+                   datetime(2017, 1, 4, 12, tzinfo=timezone.utc)]
+        for created_at, result in zip(created, ['Yes', 'No', 'Yes']):
+            answer = mixer.blend(Answer, survey=self.survey, country=c1, organization=o1,
+                                 body='data[%s]=%s' % (q.pk, result), data=None)
+            Answer.objects.filter(pk=answer.pk).update(created_at=created_at)
+            # Every run evaluates one answer, updating the trend stats saved by the previous one
+            LastEvaluator.process_answers(self.survey)
+
+        stats = TrendStat.objects.filter(survey=self.survey)
+        trends = {(s.country_id, s.period, s.start.day): s for s in stats}
+        assert len(stats) == len(trends) == 6, 'One stat per bucket and country'
+        assert set(trends) == {
+            (country_id, period, day) for country_id in (c1.pk, None) for period, day in
+            [(TrendStat.PERIOD_DAY, 2), (TrendStat.PERIOD_DAY, 4), (TrendStat.PERIOD_WEEK, 2)]}
+        week = trends[(None, TrendStat.PERIOD_WEEK, 2)]
+        assert week.total == 3
+        assert week.data == {'org': {str(o1.pk): 3}, 'questions': {str(r.pk): {'cnt': 3, 'sum': 2}}}
+        assert trends[(c1.pk, TrendStat.PERIOD_DAY, 4)].data['questions'] == {str(r.pk): {'cnt': 2, 'sum': 1}}
 
     def test_parse_query_string(self):
         results = self.evaluator.parse_query_string('data%5B12%5D%5B%5D=&data%5B4%5D%5B%5D=Age&data%5B4%5D%5B%5D=Preference+of+the+patients&data%5B4%5D%5B%5D=Efficacy+profile&data%5B4%5D%5B%5D=&csrfmiddlewaretoken=C7UlUxD6GI60dwB3PnGtA9en518LhHhRfqQwzXRb6pMVAs9jgaMIgWK0mq2AH8a6&data%5B14%5D%5B%5D=&data%5B3%5D%5Bother%5D=&data%5B7%5D=No&data%5B9%5D%5Badditional%5D=&data%5B2%5D=Yes&data%5B3%5D%5B%5D=Ari-oral&data%5B3%5D%5B%5D=Resperidol-oral&data%5B3%5D%5B%5D=Ari-LAI&data%5B3%5D%5B%5D=&data%5B11%5D%5Bother%5D=&data%5B9%5D%5Bmain%5D=&data%5B6%5D%5B%5D=Age&data%5B6%5D%5B%5D=Mechanism+of+Action&data%5B6%5D%5B%5D=Preference+of+the+patients&data%5B6%5D%5B%5D=&data%5B16%5D=xxx&data%5B11%5D%5B%5D=&data%5B14%5D%5Bother%5D=&data%5B1%5D%5Bmain%5D=10&data%5B4%5D%5Bother%5D=&data%5B12%5D%5Bother%5D=&data%5B6%5D%5Bother%5D=&data%5B1%5D%5Badditional%5D=')  # noqa
@@ -304,8 +410,9 @@ class TestLastEvaluator(object):
     def test_get_answers(self):
         s = mixer.blend(Survey)
         (o1, o2) = mixer.cycle(2).blend(Organization, name=mixer.sequence("org_{0}"))
-        mixer.blend(Answer, survey=s, organization=o1, is_updated=True)
-        mixer.blend(Answer, survey=s, organization=o2, is_updated=False)
+        a1 = mixer.blend(Answer, survey=s, organization=o1)
+        mixer.blend(Answer, survey=s, organization=o2)
+        mixer.blend(SurveyStat, survey=s, country=None, watermark=a1.pk)
 
         evaluator = self.evaluator_cls(s)
         answers = evaluator.get_answers()
@@ -316,6 +423,7 @@ class TestTypeProcessor(TestCase):
 
     def setUp(self):
         OptionDict.clear()
+        cache.clear()
 
     def test_types(self):
         s1 = mixer.blend(Survey, active=True)
@@ -402,8 +510,6 @@ class TestTypeProcessor(TestCase):
             kwargs['country'] = self.c1
         if 'org' not in kwargs:
             kwargs['organization'] = self.org
-        if 'is_updated' not in kwargs:
-            kwargs['is_update'] = False
         return mixer.blend(Answer, **kwargs)
 
     def test_type_average_percent_processor(self):
@@ -429,6 +535,10 @@ class TestTypeProcessor(TestCase):
             '30': 1,
             '40': 1
         }
+        assert data['bins'] == [0, 1, 1, 1, 0, 0, 0, 0, 0, 0]
+        assert data['bins_spec'] == [0, 100.0, 10]
+        assert data['sketch'] == {'mean': [20.0, 30.0, 40.0], 'weight': [1, 1, 1]}
+        assert data['org_sketch'] == {str(self.org.pk): data['sketch']}
 
         reg_key = str(self.c1.pk)
         assert data['reg_cnt'][reg_key] == 2
@@ -458,6 +568,25 @@ class TestTypeProcessor(TestCase):
         assert data['org_cnt'][str(self.org.pk)] == 2
         self.assertAlmostEqual(data['org_sum'][str(self.org.pk)],  60.0)
 
+    def test_type_average_percent_processor_bins(self):
+        self.init_models(Question.TYPE_SIMPLE_INPUT, Representation.TYPE_AVERAGE_PERCENT)
+        Question.objects.filter(pk=self.q.pk).update(field=Question.FIELD_PERCENT)
+        self.r.distribution = 5
+        self.r.keep_raw_values = False
+        self.r.save()
+        self.evaluator = TotalEvaluator(self.surv)
+        self.evaluator.fill_out()
+        qid = self.q.pk
+        a1 = self.create_answer(body='data[%s][main]=40' % qid, country=self.c1, region=self.reg11)
+
+        for value in ('40', '15', '100'):
+            self.evaluator.type_average_percent_processor(qid, {'main': value}, a1)
+
+        data = self.evaluator.question_stat[(self.surv.pk, None, self.r.pk)].data
+        assert 'dist' not in data
+        assert data['bins'] == [1, 1, 0, 0, 1]
+        assert data['bins_spec'] == [0, 100.0, 5]
+
     def test_type_yes_no_processor(self):
         self.init_models(Question.TYPE_YES_NO, Representation.TYPE_YES_NO)
         qid = self.q.pk
@@ -651,3 +780,472 @@ class TestTypeProcessor(TestCase):
             'data': (2, 1, 1, 1),
             'hide_last_legend_item': 'true',
         }
+
+
+def rounded(value):
+    if isinstance(value, dict):
+        return {k: rounded(v) for k, v in value.items()}
+    if isinstance(value, float):
+        return round(value, 6)
+    return value
+
+
+class GeneratedAnswersMixin(object):
+    """
+    A survey with a question of every representation type and random answers in two countries.
+    """
+
+    def setUp(self):
+        OptionDict.clear()
+        cache.clear()
+        rnd = random.Random(7)
+        self.countries = mixer.cycle(2).blend(Country, use_in_reports=True)
+        self.regions = [mixer.blend(Region, country=c) for c in self.countries for _ in range(2)]
+        self.orgs = mixer.cycle(2).blend(Organization, name=mixer.sequence("org_{0}"))
+        self.hcp_categories = mixer.cycle(2).blend(HCPCategory)
+        self.survey = mixer.blend(Survey, countries=self.countries, organizations=self.orgs, active=True)
+
+        representations = [
+            (Question.TYPE_YES_NO, None, Representation.TYPE_YES_NO),
+            (Question.TYPE_YES_NO_JUMPING, None, Representation.TYPE_YES_NO),
+            (Question.TYPE_TWO_DEPENDEND_FIELDS, None, Representation.TYPE_AVERAGE_PERCENT),
+            (Question.TYPE_SIMPLE_INPUT, Question.FIELD_PERCENT, Representation.TYPE_AVERAGE_PERCENT),
+            (Question.TYPE_MULTISELECT_ORDERED, None, Representation.TYPE_MULTISELECT_TOP),
+            (Question.TYPE_MULTISELECT_ORDERED, None, Representation.TYPE_MULTISELECT_TOP5),
+            (Question.TYPE_MULTISELECT_WITH_OTHER, None, Representation.TYPE_MULTISELECT),
+        ]
+        questions = []
+        for question_type, field, representation_type in representations:
+            q = mixer.blend(Question, survey=self.survey, type=question_type, field=field)
+            mixer.blend(Representation, question=q, type=representation_type, active=True)
+            questions.append((q.pk, question_type))
+
+        for _ in range(60):
+            region = rnd.choice(self.regions)
+            body = make_answer_body(questions, rnd)
+            mixer.blend(Answer, survey=self.survey, country=region.country, region=region,
+                        organization=rnd.choice(self.orgs), hcp_category=rnd.choice(self.hcp_categories + [None]),
+                        body=body, data=Answer(body=body).parse_body())
+        # Reports asked for every cell of the cube
+        for org in self.orgs + [None]:
+            for hcp_category in self.hcp_categories + [None]:
+                if org or hcp_category:
+                    mixer.blend(CubeSlice, survey=self.survey, organization=org, hcp_category=hcp_category,
+                                generation=0)
+
+    def collect(self):
+        return {
+            'survey': {(s.country_id, s.total, s.last) for s in SurveyStat.objects.filter(survey=self.survey)},
+            'organization': {(s.country_id, s.organization_id, s.total)
+                             for s in OrganizationStat.objects.filter(survey=self.survey)},
+            'question': {(s.country_id, s.representation_id, s.organization_id, s.hcp_category_id): rounded(s.data)
+                         for s in QuestionStat.objects.filter(survey=self.survey)},
+            'trend': {(s.country_id, s.period, s.start): (s.total, rounded(s.data))
+                      for s in TrendStat.objects.filter(survey=self.survey)},
+        }
+
+    def edit_answers(self):
+        """
+        Delete the 11th answer and give the 12th the answers of the 13th, return the pk of the last one.
+        """
+        deleted, edited, other = self.survey.answers.order_by('pk')[10:13]
+        deleted.delete()
+        edited.organization, edited.hcp_category, edited.data = other.organization, other.hcp_category, other.data
+        edited.save()
+        return other.pk
+
+
+class TestAggregateEvaluator(GeneratedAnswersMixin, TestCase):
+
+    def test_matches_processors(self):
+        TotalEvaluator.process_answers(self.survey)
+        expected = self.collect()
+        assert any(expected['question'].values())
+
+        evaluator = AggregateEvaluator.process_answers(self.survey)
+        assert evaluator.messages == []
+        assert evaluator.profile.answers == 60
+        assert AnswerValue.objects.filter(survey=self.survey).exists()
+        assert self.collect() == expected
+
+        AggregateEvaluator.process_answers(self.survey)
+        assert self.collect() == expected, 'Answers are expanded once, recomputes only aggregate'
+
+    def test_expanded_once(self):
+        answer = self.survey.answers.first()
+        mixer.blend(Answer, survey=self.survey, country=answer.country, organization=answer.organization, data={})
+        AggregateEvaluator.process_answers(self.survey)
+        assert ExpandedAnswer.objects.filter(answer__survey=self.survey).count() == 61
+
+        with patch.object(AggregateEvaluator, 'expand_answer') as expand_answer:
+            AggregateEvaluator.process_answers(self.survey)
+        assert not expand_answer.called, 'Answers without values are not expanded again'
+
+        answer.data = {}
+        answer.save()
+        assert not AnswerValue.objects.filter(answer=answer).exists()
+        assert not ExpandedAnswer.objects.filter(answer=answer).exists(), 'Edited answers are expanded again'
+
+
+class TestStatsCube(GeneratedAnswersMixin, TestCase):
+
+    def cells(self, representation, country_id=None):
+        stats = QuestionStat.objects.current(self.survey).filter(representation=representation, country_id=country_id)
+        return {(s.organization_id, s.hcp_category_id): s.data for s in stats}
+
+    def test_rollups(self):
+        TotalEvaluator.process_answers(self.survey)
+        r = Representation.objects.get(question__survey=self.survey, type=Representation.TYPE_YES_NO,
+                                       question__type=Question.TYPE_YES_NO)
+        for country_id in [None, self.countries[0].pk]:
+            cells = self.cells(r, country_id)
+            total = cells[(None, None)]
+            for org in self.orgs:
+                assert cells[(org.pk, None)]['main_cnt'] == total['org_cnt'][str(org.pk)]
+                assert cells[(org.pk, None)]['org_cnt'] == {str(org.pk): total['org_cnt'][str(org.pk)]}
+            for hcp in self.hcp_categories:
+                assert cells[(None, hcp.pk)]['main_cnt'] == sum(
+                    cells[(org.pk, hcp.pk)]['main_cnt'] for org in self.orgs if (org.pk, hcp.pk) in cells)
+            assert sum(cells[(None, hcp.pk)]['main_cnt'] for hcp in self.hcp_categories) < total['main_cnt'], \
+                'Answers without an HCP category are only in the organization cells'
+            assert cells[(None, None)]['reg_cnt'].keys() >= cells[(self.orgs[0].pk, None)]['reg_cnt'].keys()
+
+    def test_incremental(self):
+        TotalEvaluator.process_answers(self.survey)
+        expected = self.collect()
+
+        other = mixer.blend(Survey)
+        pks = list(self.survey.answers.order_by('pk').values_list('pk', flat=True))
+        Answer.objects.filter(pk__gt=pks[29]).update(survey=other)
+        TotalEvaluator.process_answers(self.survey)
+        Answer.objects.filter(pk__gt=pks[29]).update(survey=self.survey)
+        LastEvaluator.process_answers(self.survey)
+        assert self.collect() == expected, 'Cube cells are loaded and added to like the totals'
+
+    def test_requested_slices(self):
+        CubeSlice.objects.filter(survey=self.survey).delete()
+        r = Representation.objects.filter(question__survey=self.survey).first()
+        TotalEvaluator.process_answers(self.survey)
+        assert list(self.cells(r)) == [(None, None)], 'No cells without slices'
+
+        org = self.orgs[0]
+        cube_slice = CubeSlice.objects.create(survey=self.survey, organization=org)
+        LastEvaluator.process_answers(self.survey)
+        assert list(self.cells(r)) == [(None, None)], 'New slices are filled by total recalculations'
+
+        TotalEvaluator.process_answers(self.survey)
+        self.survey.refresh_from_db()
+        cube_slice.refresh_from_db()
+        assert cube_slice.generation == self.survey.stat_generation
+        assert set(self.cells(r)) == {(None, None), (org.pk, None)}
+        expected = self.cells(r)[(org.pk, None)]
+
+        answer = self.survey.answers.filter(organization=org).first()
+        answer.pk = None
+        answer.save()
+        LastEvaluator.process_answers(self.survey)
+        cell = self.cells(r)[(org.pk, None)]
+        assert cell != expected, 'Evaluated slices are kept up to date'
+        assert set(self.cells(r)) == {(None, None), (org.pk, None)}
+
+
+class TestRetraction(GeneratedAnswersMixin, TestCase):
+
+    def recalculated(self):
+        TotalEvaluator.process_answers(self.survey)
+        return self.collect()
+
+    def test_delete(self):
+        TotalEvaluator.process_answers(self.survey)
+        answers = list(self.survey.answers.order_by('pk')[10:60:10])
+        for answer in answers:
+            answer.delete()
+        retracted = self.collect()
+        assert retracted == self.recalculated(), 'Stats as if the answers were never evaluated'
+
+    def test_edit(self):
+        TotalEvaluator.process_answers(self.survey)
+        answer, other = self.survey.answers.order_by('pk')[3:5]
+        answer.country, answer.region = other.country, other.region
+        answer.organization, answer.hcp_category = other.organization, other.hcp_category
+        answer.data = other.data
+        answer.save()
+        edited = self.collect()
+        assert edited == self.recalculated()
+
+    def test_unchanged_or_not_evaluated(self):
+        TotalEvaluator.process_answers(self.survey)
+        expected = self.collect()
+        answer = self.survey.answers.first()
+        with patch.object(LiveEvaluator, 'retract_answer') as retract_answer:
+            answer.save()
+        assert retract_answer.call_count == 0, 'Saving an answer without changes keeps the stats'
+
+        stat = SurveyStat.objects.current(self.survey).get(country=None)
+        SurveyStat.objects.filter(pk=stat.pk).update(watermark=answer.pk - 1)
+        answer.delete()
+        assert self.collect() == expected, 'Answers above the watermark are not in the stats'
+
+    def test_survey_clear(self):
+        TotalEvaluator.process_answers(self.survey)
+        with patch.object(LiveEvaluator, '__init__') as init:
+            self.survey.clear()
+        assert init.call_count == 0
+        assert not self.survey.answers.exists()
+        assert not QuestionStat.objects.filter(survey=self.survey).exists()
+
+
+class TestLiveEvaluator(TestCase):
+
+    def setUp(self):
+        OptionDict.clear()
+        cache.clear()
+        self.rnd = random.Random(11)
+        self.countries = mixer.cycle(2).blend(Country, use_in_reports=True)
+        self.orgs = mixer.cycle(2).blend(Organization, name=mixer.sequence("org_{0}"))
+        self.survey = mixer.blend(Survey, countries=self.countries, organizations=self.orgs, active=True)
+
+        self.questions = []
+        for question_type, representation_type in [
+                (Question.TYPE_YES_NO, Representation.TYPE_YES_NO),
+                (Question.TYPE_TWO_DEPENDEND_FIELDS, Representation.TYPE_AVERAGE_PERCENT),
+                (Question.TYPE_MULTISELECT_ORDERED, Representation.TYPE_MULTISELECT_TOP)]:
+            q = mixer.blend(Question, survey=self.survey, type=question_type)
+            mixer.blend(Representation, question=q, type=representation_type, active=True)
+            self.questions.append((q.pk, question_type))
+
+    def submit(self, country):
+        body = make_answer_body(self.questions, self.rnd)
+        return mixer.blend(Answer, survey=self.survey, country=country, organization=self.rnd.choice(self.orgs),
+                           body=body, data=Answer(body=body).parse_body())
+        # Reports asked for every cell of the cube
+        for org in self.orgs + [None]:
+            for hcp_category in self.hcp_categories + [None]:
+                if org or hcp_category:
+                    mixer.blend(CubeSlice, survey=self.survey, organization=org, hcp_category=hcp_category,
+                                generation=0)
+
+    def collect(self):
+        return {
+            'survey': {(s.country_id, s.total) for s in SurveyStat.objects.filter(survey=self.survey)},
+            'organization': {(s.country_id, s.organization_id, s.total)
+                             for s in OrganizationStat.objects.filter(survey=self.survey)},
+            'question': {(s.country_id, s.representation_id, s.organization_id, s.hcp_category_id): rounded(s.data)
+                         for s in QuestionStat.objects.filter(survey=self.survey)},
+            'trend': {(s.country_id, s.period, s.start): (s.total, rounded(s.data))
+                      for s in TrendStat.objects.filter(survey=self.survey)},
+        }
+
+    def test_disabled_by_default(self):
+        self.submit(self.countries[0])
+        assert not SurveyStat.objects.exists()
+
+    @override_settings(REPORTS_LIVE_STATS=True)
+    def test_updates_answer_country_only(self):
+        answer = self.submit(self.countries[0])
+
+        assert SurveyStat.objects.get(country=None).watermark == answer.pk
+        assert {s.country_id for s in SurveyStat.objects.all()} == {None, self.countries[0].pk}
+        assert {s.country_id for s in QuestionStat.objects.all()} == {None, self.countries[0].pk}
+        assert SurveyStat.objects.get(country=None).total == 1
+
+    @override_settings(REPORTS_LIVE_STATS=True)
+    def test_matches_total_evaluator(self):
+        for _ in range(20):
+            self.submit(self.rnd.choice(self.countries))
+        live = self.collect()
+        assert not LastEvaluator(self.survey).get_answers().exists()
+
+        TotalEvaluator.process_answers(self.survey)
+        assert live == self.collect()
+
+    @override_settings(REPORTS_LIVE_STATS=True)
+    @patch.object(LiveEvaluator, 'save', side_effect=RuntimeError)
+    def test_failure_keeps_answer(self, save):
+        answer = self.submit(self.countries[0])
+
+        assert save.called
+        assert list(LastEvaluator(self.survey).get_answers()) == [answer], 'Left for the next evaluation'
+
+    @override_settings(REPORTS_LIVE_STATS=True)
+    @patch.object(LiveEvaluator, 'lock_survey', side_effect=DatabaseError('could not obtain lock'))
+    def test_survey_busy(self, lock_survey):
+        answer = self.submit(self.countries[0])
+
+        lock_survey.assert_called_once_with(self.survey, nowait=True)
+        assert Answer.objects.filter(pk=answer.pk).exists(), 'Submissions don\'t wait for evaluations'
+        assert list(LastEvaluator(self.survey).get_answers()) == [answer], 'Left for the next evaluation'
+
+    @override_settings(REPORTS_LIVE_STATS=True)
+    def test_catches_up(self):
+        with override_settings(REPORTS_LIVE_STATS=False):
+            self.submit(self.countries[0])
+        answer = self.submit(self.countries[1])
+
+        assert SurveyStat.objects.get(country=None).watermark == answer.pk
+        assert SurveyStat.objects.get(country=None).total == 2, 'Earlier answer is applied too'
+
+
+class TestShardedEvaluator(GeneratedAnswersMixin, TransactionTestCase):
+
+    def tearDown(self):
+        # Committed inserts advance the sqlite autoincrement counters, other tests expect fresh pks
+        if connection.vendor == 'sqlite':
+            with connection.cursor() as cursor:
+                cursor.execute('DELETE FROM sqlite_sequence')
+
+    def test_get_shard_ranges(self):
+        pks = list(self.survey.answers.order_by('pk').values_list('pk', flat=True))
+        ranges = TotalEvaluator.get_shard_ranges(self.survey, 4)
+        assert len(ranges) == 4
+        assert ranges[0][0] == 0 and ranges[-1][1] == pks[-1]
+        assert [len([pk for pk in pks if after < pk <= last]) for after, last in ranges] == [15] * 4
+
+    def test_matches_single_process(self):
+        TotalEvaluator.process_answers(self.survey)
+        expected = self.collect()
+
+        evaluator = TotalEvaluator.process_sharded(self.survey, processes=3)
+        assert evaluator.messages == []
+        assert self.collect() == expected
+        profile = evaluator.profile.to_dict()
+        assert profile['answers'] == 60, 'Answers of the workers are counted'
+        assert {'fetch', 'process', 'merge', 'save'} <= {phase['name'] for phase in profile['phases']}
+        assert evaluator.watermark == self.survey.answers.last().pk
+
+    def test_retracted_during_run(self):
+        TotalEvaluator.process_answers(self.survey)
+        lock_survey = TotalEvaluator.lock_survey
+        edits = []
+
+        def edit_before_merge(survey):
+            # The workers are done, answers they counted are edited before their results are merged
+            if not edits:
+                edits.append(survey)
+                self.edit_answers()
+            lock_survey(survey)
+
+        with patch.object(TotalEvaluator, 'lock_survey', staticmethod(edit_before_merge)):
+            TotalEvaluator.process_sharded(self.survey, processes=3)
+        assert edits
+        assert not EvaluationCheckpoint.objects.exists()
+        sharded = self.collect()
+
+        TotalEvaluator.process_answers(self.survey)
+        assert sharded == self.collect(), 'The edited answers are counted as they are now'
+
+    def test_inside_transaction(self):
+        with transaction.atomic():
+            with pytest.raises(TransactionManagementError):
+                TotalEvaluator.process_sharded(self.survey, processes=2)
+
+    def test_single_process(self):
+        with patch.object(TotalEvaluator, 'get_shard_ranges') as get_shard_ranges:
+            TotalEvaluator.process_sharded(self.survey, processes=1)
+        assert not get_shard_ranges.called, 'Ranges are not queried for a single process'
+
+    def test_resumes_chunked_run(self):
+        EvaluationCheckpoint.objects.create(survey=self.survey, after=20, last=60, state={'survey': []})
+        with patch.object(TotalEvaluator, 'process_chunked') as process_chunked:
+            TotalEvaluator.process_sharded(self.survey, processes=3)
+        process_chunked.assert_called_once_with(self.survey, dimensions=None)
+        assert EvaluationCheckpoint.objects.get().after == 20, 'The checkpoint of the chunked run is kept'
+
+
+class TestChunkedEvaluator(GeneratedAnswersMixin, TransactionTestCase):
+
+    def tearDown(self):
+        if connection.vendor == 'sqlite':
+            with connection.cursor() as cursor:
+                cursor.execute('DELETE FROM sqlite_sequence')
+
+    def test_matches_single_process(self):
+        TotalEvaluator.process_answers(self.survey)
+        expected = self.collect()
+
+        evaluator = TotalEvaluator.process_chunked(self.survey, checkpoint_size=7)
+        assert evaluator.messages == []
+        assert self.collect() == expected
+        assert evaluator.profile.answers == 60, 'Answers of all chunks are counted'
+        assert evaluator.watermark == self.survey.answers.last().pk
+        assert not EvaluationCheckpoint.objects.exists()
+
+    def test_resume(self):
+        TotalEvaluator.process_answers(self.survey)
+        previous = self.collect()
+        answer = self.survey.answers.first()
+        mixer.blend(Answer, survey=self.survey, country=answer.country, region=answer.region,
+                    organization=answer.organization, body=answer.body, data=answer.data)
+
+        evaluate = ShardEvaluator.evaluate
+        chunks = []
+
+        def interrupted(evaluator, answers):
+            chunks.append(evaluator.after)
+            if len(chunks) == 3:
+                raise RuntimeError('Interrupted')
+            evaluate(evaluator, answers)
+
+        with patch.object(ShardEvaluator, 'evaluate', interrupted):
+            with pytest.raises(RuntimeError):
+                TotalEvaluator.process_chunked(self.survey, checkpoint_size=20)
+        checkpoint = EvaluationCheckpoint.objects.get(survey=self.survey)
+        assert checkpoint.after == chunks[2]
+        assert self.collect() == previous, 'Readers see the previous stats'
+
+        chunks.clear()
+        with patch.object(ShardEvaluator, 'evaluate', interrupted):
+            TotalEvaluator.process_chunked(self.survey, checkpoint_size=20)
+        assert chunks[0] == checkpoint.after, "The run resumes from the checkpoint"
+        assert not EvaluationCheckpoint.objects.exists()
+        resumed = self.collect()
+
+        TotalEvaluator.process_answers(self.survey)
+        assert resumed == self.collect() != previous
+
+    def test_retracted_during_run(self):
+        TotalEvaluator.process_answers(self.survey)
+        evaluate = ShardEvaluator.evaluate
+        edits = []
+
+        def edit_between_chunks(evaluator, answers):
+            # The first chunk counted the answers, they are edited before the second one
+            if evaluator.after and not edits:
+                edits.append(self.edit_answers())
+            evaluate(evaluator, answers)
+
+        with patch.object(ShardEvaluator, 'evaluate', edit_between_chunks):
+            TotalEvaluator.process_chunked(self.survey, checkpoint_size=20)
+        assert edits
+        chunked = self.collect()
+
+        TotalEvaluator.process_answers(self.survey)
+        assert chunked == self.collect(), 'The edited answers are counted as they are now'
+
+    def test_inside_transaction(self):
+        with transaction.atomic():
+            with pytest.raises(TransactionManagementError):
+                TotalEvaluator.process_chunked(self.survey)
+
+    def test_bins_changed(self):
+        evaluate = ShardEvaluator.evaluate
+
+        def interrupted(evaluator, answers):
+            if evaluator.after:
+                raise RuntimeError('Interrupted')
+            evaluate(evaluator, answers)
+
+        with patch.object(ShardEvaluator, 'evaluate', interrupted):
+            with pytest.raises(RuntimeError):
+                TotalEvaluator.process_chunked(self.survey, checkpoint_size=20)
+        assert EvaluationCheckpoint.objects.get(survey=self.survey).after
+
+        representation = Representation.objects.get(question__survey=self.survey,
+                                                    question__field=Question.FIELD_PERCENT)
+        representation.distribution = 4
+        representation.save()
+        TotalEvaluator.process_chunked(self.survey, checkpoint_size=20)
+        resumed = self.collect()
+
+        TotalEvaluator.process_answers(self.survey)
+        assert resumed == self.collect(), 'The partial stats with other bins are dropped'
@@ -0,0 +1,193 @@
+from datetime import timedelta
+from mixer.backend.django import mixer
+import pytest
+from unittest.mock import patch, MagicMock
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from insights.users.models import Country
+from survey.models import Answer, Organization, Survey
+
+from ..dimensions import Dimensions
+from ..evaluators import AggregateEvaluator
+from ..jobs import evaluate, run_job, run_pending, has_new_answers
+from ..models import EvaluationJob, SurveyStat
+
+pytestmark = pytest.mark.django_db
+
+
+class TestEvaluationJob(TestCase):
+    def setUp(self):
+        self.survey = mixer.blend(Survey)
+
+    def test_enqueue_coalesces(self):
+        job = EvaluationJob.objects.enqueue(self.survey, EvaluationJob.MODE_LAST)
+        assert EvaluationJob.objects.enqueue(self.survey, EvaluationJob.MODE_LAST) == job
+
+        upgraded = EvaluationJob.objects.enqueue(self.survey, EvaluationJob.MODE_TOTAL)
+        assert upgraded == job
+        assert EvaluationJob.objects.get(pk=job.pk).mode == EvaluationJob.MODE_TOTAL, 'Upgraded to total'
+
+        assert EvaluationJob.objects.enqueue(self.survey, EvaluationJob.MODE_LAST).mode == EvaluationJob.MODE_TOTAL
+        assert EvaluationJob.objects.count() == 1
+
+    def test_enqueue_after_claim(self):
+        job = EvaluationJob.objects.enqueue(self.survey, EvaluationJob.MODE_LAST)
+        assert EvaluationJob.objects.claim() == job
+        assert EvaluationJob.objects.enqueue(self.survey, EvaluationJob.MODE_LAST) != job, 'Running jobs are not reused'
+
+    def test_claim(self):
+        first = EvaluationJob.objects.enqueue(self.survey, EvaluationJob.MODE_LAST)
+        second = EvaluationJob.objects.enqueue(mixer.blend(Survey), EvaluationJob.MODE_LAST)
+
+        claimed = EvaluationJob.objects.claim()
+        assert claimed == first, 'Oldest first'
+        assert claimed.status == EvaluationJob.STATUS_RUNNING
+        assert claimed.started_at is not None
+        assert EvaluationJob.objects.claim() == second
+        assert EvaluationJob.objects.claim() is None
+
+    def test_run_job(self):
+        EvaluationJob.objects.enqueue(self.survey, EvaluationJob.MODE_TOTAL)
+        job = run_job(EvaluationJob.objects.claim())
+        job.refresh_from_db()
+        assert job.status == EvaluationJob.STATUS_DONE
+        assert job.messages == []
+        assert job.finished_at is not None
+        assert job.profile['answers'] == 0
+        assert 'save' in [phase['name'] for phase in job.profile['phases']]
+        assert EvaluationJob.objects.last_finished(self.survey, EvaluationJob.MODE_TOTAL) == job
+        assert EvaluationJob.objects.last_finished(self.survey, EvaluationJob.MODE_LAST) is None
+
+    @override_settings(REPORTS_CHECKPOINT_SIZE=100)
+    @patch('reports.jobs.TotalEvaluator.process_chunked')
+    def test_run_job_chunked(self, process_chunked):
+        process_chunked.return_value.messages = []
+        process_chunked.return_value.profile.to_dict.return_value = {}
+        EvaluationJob.objects.enqueue(self.survey, EvaluationJob.MODE_TOTAL)
+        run_job(EvaluationJob.objects.claim())
+        process_chunked.assert_called_once_with(self.survey, checkpoint_size=100, dimensions=None)
+
+    @patch('reports.jobs.LastEvaluator.process_answers', side_effect=ValueError('broken'))
+    def test_run_job_failed(self, process_answers):
+        EvaluationJob.objects.enqueue(self.survey, EvaluationJob.MODE_LAST)
+        job = run_job(EvaluationJob.objects.claim())
+        job.refresh_from_db()
+        assert job.status == EvaluationJob.STATUS_FAILED
+        assert 'broken' in job.error
+
+    def test_prune(self):
+        old = timezone.now() - timedelta(days=40)
+        done = mixer.cycle(2).blend(EvaluationJob, survey=self.survey, mode=EvaluationJob.MODE_LAST,
+                                    status=EvaluationJob.STATUS_DONE, finished_at=old)
+        failed = mixer.blend(EvaluationJob, survey=self.survey, status=EvaluationJob.STATUS_FAILED, finished_at=old)
+        recent = mixer.blend(EvaluationJob, survey=self.survey, mode=EvaluationJob.MODE_TOTAL,
+                             status=EvaluationJob.STATUS_DONE, finished_at=timezone.now())
+        pending = EvaluationJob.objects.enqueue(self.survey, EvaluationJob.MODE_LAST)
+
+        assert EvaluationJob.objects.prune(timezone.now() - timedelta(days=30)) == 2
+        assert set(EvaluationJob.objects.all()) == {done[1], recent, pending}, 'The last done job of a mode is kept'
+        assert failed.pk not in EvaluationJob.objects.values_list('pk', flat=True)
+
+    def test_run_pending(self):
+        for survey in mixer.cycle(3).blend(Survey):
+            EvaluationJob.objects.enqueue(survey, EvaluationJob.MODE_LAST)
+        assert run_pending(limit=2) == 2
+        assert run_pending() == 1
+        assert not EvaluationJob.objects.exclude(status=EvaluationJob.STATUS_DONE).exists()
+
+    @override_settings(REPORTS_JOB_RETENTION_DAYS=30)
+    def test_run_pending_prunes(self):
+        old = mixer.blend(EvaluationJob, survey=self.survey, status=EvaluationJob.STATUS_FAILED,
+                          finished_at=timezone.now() - timedelta(days=31))
+        assert run_pending() == 0
+        assert EvaluationJob.objects.filter(pk=old.pk).exists(), 'Only pruned after jobs were run'
+
+        EvaluationJob.objects.enqueue(self.survey, EvaluationJob.MODE_LAST)
+        assert run_pending() == 1
+        assert not EvaluationJob.objects.filter(pk=old.pk).exists()
+
+    def test_worker_command(self):
+        EvaluationJob.objects.enqueue(self.survey, EvaluationJob.MODE_LAST)
+        call_command('evaluation_worker', once=True)
+        assert EvaluationJob.objects.get().status == EvaluationJob.STATUS_DONE
+
+
+class TestEvaluationCommands(TestCase):
+    def setUp(self):
+        self.surveys = mixer.cycle(2).blend(Survey)
+        self.organization = mixer.blend(Organization)
+        self.country = mixer.blend(Country)
+
+    def add_answer(self, survey):
+        return mixer.blend(Answer, survey=survey, country=self.country, organization=self.organization,
+                           body='', data={})
+
+    def test_recalculate(self):
+        self.add_answer(self.surveys[0])
+        call_command('recalculate')
+        for survey in self.surveys:
+            survey.refresh_from_db()
+            assert survey.stat_generation == 1, 'Every survey is recalculated'
+        stat = SurveyStat.objects.current(self.surveys[0]).get(country__isnull=True)
+        assert stat.watermark == self.surveys[0].answers.get().pk
+
+    def test_recalculate_aggregate(self):
+        self.add_answer(self.surveys[0])
+        with patch.object(AggregateEvaluator, 'process_answers', wraps=AggregateEvaluator.process_answers) as process:
+            call_command('recalculate', surveys=[self.surveys[0].slug], aggregate=True)
+        assert process.call_count == 1
+        stat = SurveyStat.objects.current(self.surveys[0]).get(country__isnull=True)
+        assert (stat.total, stat.watermark) == (1, self.surveys[0].answers.get().pk)
+
+    @override_settings(REPORTS_AGGREGATE_TOTALS=True)
+    def test_aggregate_setting(self):
+        evaluator = evaluate(self.surveys[0], EvaluationJob.MODE_TOTAL)
+        assert isinstance(evaluator, AggregateEvaluator)
+        assert not isinstance(evaluate(self.surveys[0], EvaluationJob.MODE_TOTAL, aggregate=False),
+                              AggregateEvaluator)
+        assert not isinstance(evaluate(self.surveys[0], EvaluationJob.MODE_LAST), AggregateEvaluator)
+
+    def test_selected_surveys(self):
+        call_command('recalculate', surveys=[self.surveys[1].slug])
+        assert [Survey.objects.get(pk=s.pk).stat_generation for s in self.surveys] == [0, 1]
+
+        with pytest.raises(CommandError):
+            call_command('recalculate', surveys=['missing'])
+
+    def test_only_stale(self):
+        survey = self.surveys[0]
+        self.add_answer(survey)
+        assert has_new_answers(survey)
+        call_command('update_vars', surveys=[str(survey.pk)])
+        assert not has_new_answers(survey), 'The answer is included in the stats'
+
+        call_command('recalculate', only_stale=True)
+        assert [Survey.objects.get(pk=s.pk).stat_generation for s in self.surveys] == [0, 0]
+
+        self.add_answer(survey)
+        call_command('recalculate', only_stale=True)
+        assert [Survey.objects.get(pk=s.pk).stat_generation for s in self.surveys] == [1, 0]
+
+    @patch('reports.management.commands.recalculate.evaluate')
+    def test_processes(self, evaluate):
+        evaluate.return_value.profile.to_dict.return_value = {'answers': 0, 'elapsed': 0}
+        evaluate.return_value.messages = []
+        call_command('recalculate', processes=3)
+        assert [call[0][0] for call in evaluate.call_args_list] == self.surveys
+        dimensions = evaluate.call_args_list[0][1]['dimensions']
+        assert isinstance(dimensions, Dimensions)
+        for call in evaluate.call_args_list:
+            assert call[1] == {'processes': 3, 'dimensions': dimensions, 'aggregate': None}, 'Dimensions are shared'
+
+    @patch('reports.management.evaluate.evaluate')
+    def test_failed_survey(self, evaluate):
+        evaluator = MagicMock(messages=[])
+        evaluator.profile.to_dict.return_value = {'answers': 0, 'elapsed': 0}
+        evaluate.side_effect = [ValueError('broken'), evaluator]
+        with pytest.raises(CommandError):
+            call_command('update_vars')
+        assert evaluate.call_count == 2, 'Other surveys are evaluated'
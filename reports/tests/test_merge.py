@@ -0,0 +1,68 @@
+import pytest
+
+from ..merge import merge_counters, merge_stat_data, prune_stat_data
+from ..models import Representation
+
+
+def test_merge_counters():
+    target = {'a': 1, 'org': {'1': {'cnt': 2, 'top': {'x': 1}}}}
+    merge_counters(target, {'a': 2, 'b': 1.5, 'org': {'1': {'cnt': 1, 'top': {'y': 1}}, '2': {'cnt': 1}}})
+    assert target == {'a': 3, 'b': 1.5, 'org': {'1': {'cnt': 3, 'top': {'x': 1, 'y': 1}}, '2': {'cnt': 1}}}
+
+
+def test_merge_stat_data_average():
+    target = {'main_sum': 10.0, 'main_cnt': 1, 'dist': {'10': 1}, 'reg_sum': {'1': 10.0}, 'reg_cnt': {'1': 1},
+              'org_sum': {'5': 10.0}, 'org_cnt': {'5': 1}}
+    source = {'main_sum': 30.0, 'main_cnt': 2, 'dist': {'10': 1, '20': 1}, 'reg_sum': {'2': 30.0},
+              'reg_cnt': {'2': 2}, 'org_sum': {'5': 30.0}, 'org_cnt': {'5': 2}}
+    merge_stat_data(Representation.TYPE_AVERAGE_PERCENT, target, source)
+    assert target == {'main_sum': 40.0, 'main_cnt': 3, 'dist': {'10': 2, '20': 1},
+                      'reg_sum': {'1': 10.0, '2': 30.0}, 'reg_cnt': {'1': 1, '2': 2},
+                      'org_sum': {'5': 40.0}, 'org_cnt': {'5': 3}}
+
+
+def test_merge_stat_data_average_bins():
+    target = {'main_sum': 10.0, 'main_cnt': 1, 'bins': [1, 0, 0], 'bins_spec': [0, 90, 3],
+              'reg_sum': {}, 'reg_cnt': {}, 'org_sum': {}, 'org_cnt': {}}
+    source = {'main_sum': 80.0, 'main_cnt': 2, 'bins': [0, 1, 1], 'bins_spec': [0, 90, 3],
+              'reg_sum': {}, 'reg_cnt': {}, 'org_sum': {}, 'org_cnt': {}}
+    merge_stat_data(Representation.TYPE_AVERAGE_PERCENT, target, source)
+    assert target['bins'] == [1, 1, 1]
+    assert target['bins_spec'] == [0, 90, 3]
+    assert 'dist' not in target
+
+
+@pytest.mark.parametrize('target', [{}, {'cnt': 0, 'top5': {}, 'org': {}}])
+def test_merge_stat_data_into_empty(target):
+    source = {'cnt': 1, 'top5': {'a': 1}, 'org': {'1': {'cnt': 1, 'top5': {'a': 1}}}}
+    merge_stat_data(Representation.TYPE_MULTISELECT_TOP5, target, source)
+    assert target == source
+    target['org']['1']['cnt'] += 1
+    assert source['org']['1']['cnt'] == 1, 'Source is not shared'
+
+
+def test_merge_stat_data_empty_source():
+    target = {'main_yes': 1, 'main_cnt': 1}
+    assert merge_stat_data(Representation.TYPE_YES_NO, target, {}) == {'main_yes': 1, 'main_cnt': 1}
+
+
+def test_prune_stat_data_average():
+    data = {'main_sum': 10.0, 'main_cnt': 1, 'bins': [0, 1], 'dist': {'5': 0, '10': 1},
+            'reg_sum': {'1': 0.0, '2': 10.0}, 'reg_cnt': {'1': 0, '2': 1}, 'org_sum': {'5': 10.0},
+            'org_cnt': {'5': 1}, 'sketch': {'mean': [10.0], 'weight': [1]},
+            'reg_sketch': {'1': {'mean': [], 'weight': []}, '2': {'mean': [10.0], 'weight': [1]}}, 'org_sketch': {}}
+    prune_stat_data(Representation.TYPE_AVERAGE_PERCENT, data)
+    assert data['dist'] == {'10': 1}
+    assert (data['reg_sum'], data['reg_cnt']) == ({'2': 10.0}, {'2': 1})
+    assert list(data['reg_sketch']) == ['2']
+
+    data['main_cnt'] = 0
+    assert prune_stat_data(Representation.TYPE_AVERAGE_PERCENT, data) == {}, 'Data without answers is emptied'
+
+
+def test_prune_stat_data_options():
+    data = {'cnt': 1, 'top1': {'a': 1, 'b': 0}, 'top3': {'a': 1, 'b': 0},
+            'org': {'1': {'cnt': 0, 'top1': {}, 'top3': {}}, '2': {'cnt': 1, 'top1': {'a': 1, 'b': 0}, 'top3': {}}}}
+    prune_stat_data(Representation.TYPE_MULTISELECT_TOP, data)
+    assert data == {'cnt': 1, 'top1': {'a': 1}, 'top3': {'a': 1},
+                    'org': {'2': {'cnt': 1, 'top1': {'a': 1}, 'top3': {}}}}
@@ -1,11 +1,14 @@
+from datetime import date, datetime
 from mixer.backend.django import mixer
 import pytest
 
+from django.core.cache import cache
 from django.test import TestCase
+from django.utils import timezone
 
 from survey.models import Option, Region, Organization, Question, Survey
 from insights.users.models import User, Country
-from ..models import OptionDict, QuestionStat, Representation
+from ..models import OptionDict, QuestionStat, Representation, TrendStat
 
 pytestmark = pytest.mark.django_db
 
@@ -14,28 +17,124 @@ class TestOptionDict(TestCase):
 
     def setUp(self):
         OptionDict.clear()
+        cache.clear()
 
-    def test_load(self):
-        mixer.blend(Option, value='Qq')
-        mixer.blend(Option, value='Ww')
-        mixer.blend(Option, value='Ee')
+    def test_load_survey(self):
+        survey = mixer.blend(Survey)
+        q = mixer.blend(Question, survey=survey)
+        mixer.blend(Option, question=q, value='Qq')
+        mixer.blend(Option, question=q, value='Ww')
+        mixer.blend(Option, question=q, value='Ee')
+        mixer.blend(Option, value='Rr')
 
         od1 = mixer.blend(OptionDict, lower='qq', original='Qq')
         od2 = mixer.blend(OptionDict, lower='ww', original='W')
 
-        assert OptionDict.get('qq') == 'Qq'
-        assert OptionDict.get('mm') == 'mm'
+        with self.assertNumQueries(2):
+            OptionDict.load_survey(survey.pk)
+            OptionDict.load_survey(survey.pk)
 
         assert OptionDict.data['qq'] == od1
         assert OptionDict.data['ww'] == od2
         assert OptionDict.data['ww'].original == 'Ww'
         assert OptionDict.data['ee'].original == 'Ee'
+        assert 'rr' not in OptionDict.data, 'Options of other surveys are not loaded'
+        assert set(OptionDict.pending) == {'ee'}
+
+        OptionDict.flush()
+        assert OptionDict.objects.get(lower='ww').original == 'Ww'
+        assert OptionDict.objects.get(lower='ee').original == 'Ee'
+
+    def test_get(self):
+        mixer.blend(OptionDict, lower='qq', original='Qq')
+
+        assert OptionDict.get('qq') == 'Qq'
+        assert OptionDict.get('mm') == 'mm'
+        with self.assertNumQueries(0):
+            assert OptionDict.get('mm') == 'mm', 'Missing names are remembered'
+
+    def test_register(self):
+        mixer.blend(OptionDict, lower='qq', original='Qq')
+
+        with self.assertNumQueries(0):
+            for i in range(100):
+                OptionDict.register('other %s' % i, 'Other %s' % i)
+            OptionDict.register('qq', 'QQ')
+        assert OptionDict.get('other 1') == 'Other 1'
+
+        with self.assertNumQueries(4):
+            # One SELECT for entries stored meanwhile and one INSERT in a savepoint
+            OptionDict.flush()
+        assert OptionDict.objects.count() == 101
+        assert OptionDict.get('qq') == 'Qq', 'Stored spelling is kept'
+
+        OptionDict.clear()
+        cache.clear()
+        OptionDict.register('other 1', 'OTHER 1')
+        OptionDict.flush()
+        assert OptionDict.objects.get(lower='other 1').original == 'Other 1'
+
+
+class TestOptionDictCache(TestCase):
+
+    def setUp(self):
+        OptionDict.clear()
+        cache.clear()
+        self.survey = mixer.blend(Survey)
+        q = mixer.blend(Question, survey=self.survey)
+        mixer.blend(Option, question=q, value='Qq')
+        mixer.blend(Option, question=q, value='Ww')
+        mixer.blend(OptionDict, lower='qq', original='Qq')
+        mixer.blend(OptionDict, lower='ww', original='Ww')
+
+    def test_warm_start(self):
+        OptionDict.load_survey(self.survey.pk)
+
+        OptionDict.clear()
+        with self.assertNumQueries(0):
+            # A restarted worker takes the survey entries from the cache
+            OptionDict.load_survey(self.survey.pk)
+            assert OptionDict.get('ww') == 'Ww'
+
+    def test_not_cached_until_in_sync(self):
+        mixer.blend(Option, question=self.survey.questions.get(), value='Ee')
+        OptionDict.load_survey(self.survey.pk)
+        assert cache.get(OptionDict._survey_key(self.survey.pk)) is None, 'New entries are not written yet'
+
+    def test_bump_drops_changed(self):
+        OptionDict.load_survey(self.survey.pk)
+        assert OptionDict.get('qq') == 'Qq'
+
+        # Another worker changes an entry and announces it
+        OptionDict.objects.filter(lower='ww').update(original='WW')
+        OptionDict.bump(['ww'])
+
+        with self.assertNumQueries(2):
+            # Only the survey options and the changed entry are read again
+            OptionDict.load_survey(self.survey.pk)
+            assert OptionDict.get('ww') == 'Ww', 'Synced with the option value'
+            assert OptionDict.get('qq') == 'Qq'
+        assert OptionDict.changed == {'ww': OptionDict.data['ww']}
+
+    def test_missing_names_announced(self):
+        OptionDict.load_survey(self.survey.pk)
+        assert OptionDict.get('other') == 'other'
+
+        mixer.blend(OptionDict, lower='other', original='Other')
+        OptionDict.bump(['other'])
+        OptionDict.sync()
+        assert OptionDict.get('other') == 'Other'
 
-        OptionDict.register('mm', 'Mm')
-        assert OptionDict.get('mm') == 'Mm'
-        assert OptionDict.objects.get(lower='mm')
+    def test_incomplete_log(self):
+        OptionDict.load_survey(self.survey.pk)
+        OptionDict.register('new', 'New')
+        OptionDict.bump(['qq'])
+        OptionDict.bump(['ww'])
+        cache.delete(OptionDict._changes_key(1))
 
-        assert OptionDict.get('xx') == 'xx'
+        OptionDict.sync()
+        assert set(OptionDict.data) == {'new'}, 'Everything but pending entries is dropped'
+        assert OptionDict.version == 2
 
 
 class TestQuestionStat(TestCase):
@@ -65,6 +164,7 @@ class TestQuestionStat(TestCase):
 
         QuestionStat.clear()
         OptionDict.clear()
+        cache.clear()
 
     def test_extract_data(self):
         dist = {'20': 1, '30': 1, '40': 1}
@@ -198,7 +298,11 @@ class TestQuestionStat(TestCase):
             'org_sum': {'1': 90.0},
             'org_cnt': {'1': 3},
 
-            'dist': {'20': 1, '30': 1, '40': 1}
+            'dist': {'20': 1, '30': 1, '40': 1},
+
+            'sketch': {'mean': [20.0, 30.0, 40.0], 'weight': [1, 1, 1]},
+            'reg_sketch': {'1': {'mean': [20.0, 40.0], 'weight': [1, 1]}, '2': {'mean': [30.0], 'weight': [1]}},
+            'org_sketch': {'1': {'mean': [20.0, 30.0, 40.0], 'weight': [1, 1, 1]}},
         }
         qs0 = mixer.blend(QuestionStat,
                           survey=self.s,
@@ -241,6 +345,9 @@ class TestQuestionStat(TestCase):
             'dist_labels': dist_labels,
             'dist_series_meta': dist_series_meta,
             'main_cnt': 3,
+            'quartiles': [25.0, 30.0, 35.0],
+            'bar_quartiles': [[25.0, 30.0, 35.0], [30.0, 30.0, 30.0], None],
+            'org_quartiles': [[25.0, 30.0, 35.0], None, None],
             'unit': None,
             'highest': None,
             'lowest': None,
@@ -269,12 +376,54 @@ class TestQuestionStat(TestCase):
             'dist_labels': dist_labels,
             'dist_series_meta': dist_series_meta,
             'main_cnt': 3,
+            'quartiles': [25.0, 30.0, 35.0],
+            'bar_quartiles': [[25.0, 30.0, 35.0], [30.0, 30.0, 30.0], None],
+            'org_quartiles': [[25.0, 30.0, 35.0], None, None],
             'unit': None,
             'highest': None,
             'lowest': None,
         }
         # TODO generic distribution test
 
+    def test_update_type_average_percent_bins(self):
+        self.r.distribution = 5
+        self.r.save()
+        data = {
+            'main_sum': 90.0, 'main_cnt': 3, 'reg_sum': {}, 'reg_cnt': {}, 'org_sum': {}, 'org_cnt': {},
+            'bins': [0, 2, 1, 0, 0], 'bins_spec': [0, 100.0, 5],
+        }
+        qs0 = mixer.blend(QuestionStat, survey=self.s, representation=self.r, data=data, country=None,
+                          type=QuestionStat.TYPE_AVERAGE_PERCENT)
+        qs0.update_vars()
+        assert qs0.vars['dist_labels'] == ['0-20%', '21-40%', '41-60%', '61-80%', '81-100%']
+        assert qs0.vars['quartiles'] is None, 'The stat has no sketch'
+        assert qs0.vars['dist_series_meta'] == [
+            {'value': 0, 'meta': 0},
+            {'value': 2, 'meta': 67},
+            {'value': 1, 'meta': 33},
+            {'value': 0, 'meta': 0},
+            {'value': 0, 'meta': 0},
+        ]
+
+    def test_update_type_average_percent_rebins_dist(self):
+        data = {
+            'main_sum': 90.0, 'main_cnt': 3, 'reg_sum': {}, 'reg_cnt': {}, 'org_sum': {}, 'org_cnt': {},
+            'bins': [0, 2, 1, 0, 0], 'bins_spec': [0, 100.0, 5], 'dist': {'20': 1, '30': 1, '40': 1},
+        }
+        qs0 = mixer.blend(QuestionStat, survey=self.s, representation=self.r, data=data, country=None,
+                          type=QuestionStat.TYPE_AVERAGE_PERCENT)
+        qs0.update_vars()
+        assert len(qs0.vars['dist_labels']) == 10
+        assert [x['value'] for x in qs0.vars['dist_series_meta']] == [0, 1, 1, 1, 0, 0, 0, 0, 0, 0]
+
+    def test_prepare_bins(self):
+        data = {'bins': [0, 3], 'bins_spec': [0, 100.0, 2], 'dist': {'20': 1, '30': 1, '40': 1}}
+        QuestionStat.prepare_bins(data, [0, 100.0, 10], keep_dist=False)
+        assert data == {'bins': [0, 1, 1, 1, 0, 0, 0, 0, 0, 0], 'bins_spec': [0, 100.0, 10]}
+
+        QuestionStat.prepare_bins(data, [0, 100.0, 5])
+        assert data == {'bins': [0, 0, 0, 0, 0], 'bins_spec': [0, 100.0, 5]}
+
     def test_update_type_yes_no(self):
         data = {
             'main_yes': 2,
@@ -529,3 +678,29 @@ class TestQuestionStat(TestCase):
             'highest': None,
             'lowest': None,
         }
+
+
+class TestTrendStat(TestCase):
+
+    def test_get_buckets(self):
+        created_at = datetime(2017, 1, 5, 23, tzinfo=timezone.utc)
+        assert TrendStat.get_buckets(created_at) == [
+            (TrendStat.PERIOD_DAY, date(2017, 1, 5)),
+            (TrendStat.PERIOD_WEEK, date(2017, 1, 2)),
+        ]
+
+    def test_get_series(self):
+        stats = [
+            TrendStat(period=TrendStat.PERIOD_DAY, start=date(2017, 1, 2), total=2,
+                      data={'org': {'1': 2}, 'questions': {'7': {'cnt': 2, 'sum': 50.0}}}),
+            TrendStat(period=TrendStat.PERIOD_DAY, start=date(2017, 1, 4), total=1,
+                      data={'org': {'2': 1}, 'questions': {}}),
+        ]
+        assert TrendStat.get_series(stats, TrendStat.PERIOD_DAY) == {
+            'period': TrendStat.PERIOD_DAY,
+            'labels': ['2017-01-02', '2017-01-03', '2017-01-04'],
+            'total': [2, 0, 1],
+            'organizations': {'1': [2, 0, 0], '2': [0, 0, 1]},
+            'questions': {'7': {'cnt': [2, 0, 0], 'mean': [25.0, None, None]}},
+        }
+        assert TrendStat.get_series([], TrendStat.PERIOD_WEEK)['labels'] == []
@@ -0,0 +1,96 @@
+from mixer.backend.django import mixer
+import pytest
+
+from django.test import TestCase
+
+from insights.users.models import Country
+from survey.models import Question, Survey
+
+from ..dimensions import Dimensions
+from ..models import Representation, SurveyVersion
+from ..plans import get_plan, clear_plans
+
+pytestmark = pytest.mark.django_db
+
+
+class TestEvaluationPlan(TestCase):
+
+    def setUp(self):
+        clear_plans()
+        self.c1 = mixer.blend(Country, use_in_reports=True)
+        self.survey = mixer.blend(Survey, countries=[self.c1])
+        self.q1 = mixer.blend(Question, survey=self.survey, type=Question.TYPE_YES_NO)
+        self.r1 = mixer.blend(Representation, question=self.q1, type=Representation.TYPE_YES_NO, active=True)
+        self.q2 = mixer.blend(Question, survey=self.survey, type=Question.TYPE_MULTISELECT_ORDERED)
+        self.r2 = mixer.blend(Representation, question=self.q2, type=None, active=True)
+        self.dimensions = Dimensions()
+
+    def test_compile(self):
+        plan = get_plan(self.survey, self.dimensions)
+        assert plan.questions == {self.q1.pk: self.q1, self.q2.pk: self.q2}
+        assert plan.representations == {self.q1.pk: self.r1, self.q2.pk: self.r2}
+        assert plan.processors == {self.q1.pk: 'type_yes_no_processor'}, 'Types without processor are skipped'
+        keys = ((self.survey.pk, None, self.r1.pk), (self.survey.pk, self.c1.pk, self.r1.pk))
+        assert plan.get_stat_keys(self.q1.pk, self.c1.pk) == keys
+        assert plan.get_stat_keys(self.q1.pk, 999) == (keys[0], (self.survey.pk, 999, self.r1.pk))
+
+    def test_dependencies(self):
+        q3 = mixer.blend(Question, survey=self.survey, type=Question.TYPE_YES_NO, depends_on=self.q2,
+                         available_if=' Oral | LAI|', dependency_answer='Yes')
+        plan = get_plan(self.survey, self.dimensions)
+        assert plan.dependencies == {self.q2.pk: [(frozenset(['oral', 'lai']), q3.pk, 'Yes')]}
+
+    def test_normalize_option(self):
+        plan = get_plan(self.survey, self.dimensions)
+        assert plan.normalize_option(' Age ') == ('Age', 'age')
+        assert plan.normalize_option('  ') is None
+        assert plan.options == {' Age ': ('Age', 'age'), '  ': None}
+
+        plan.max_options = 2
+        assert plan.normalize_option('Other') == ('Other', 'other')
+        assert plan.options == {'Other': ('Other', 'other')}, 'Remembered options are dropped when full'
+
+    def test_cached(self):
+        plan = get_plan(self.survey, self.dimensions)
+        with self.assertNumQueries(1):
+            assert get_plan(self.survey, self.dimensions) is plan, 'Only the version is read'
+
+    def test_invalidated_by_other_process(self):
+        plan = get_plan(self.survey, self.dimensions)
+        # Another process committed a change of a question of the survey
+        SurveyVersion.bump([self.survey.pk], 'plan')
+        new_plan = get_plan(self.survey, self.dimensions)
+        assert new_plan is not plan
+        assert get_plan(self.survey, self.dimensions) is new_plan
+
+    def test_version_created(self):
+        assert not SurveyVersion.objects.filter(survey=self.survey).exists()
+        get_plan(self.survey, self.dimensions)
+        assert SurveyVersion.objects.get(survey=self.survey).plan == 0
+        self.q1.save()
+        assert SurveyVersion.objects.get(survey=self.survey).plan == 1
+
+    def test_invalidated_by_question(self):
+        plan = get_plan(self.survey, self.dimensions)
+        self.q1.type = Question.TYPE_YES_NO_JUMPING
+        self.q1.save()
+        assert get_plan(self.survey, self.dimensions) is not plan
+
+    def test_invalidated_by_representation(self):
+        plan = get_plan(self.survey, self.dimensions)
+        self.r2.delete()
+        assert self.q2.pk not in get_plan(self.survey, self.dimensions).questions
+        assert get_plan(self.survey, self.dimensions) is not plan
+
+    def test_invalidated_by_countries(self):
+        plan = get_plan(self.survey, self.dimensions)
+        c2 = mixer.blend(Country, use_in_reports=True)
+        self.survey.countries.add(c2)
+        new_plan = get_plan(self.survey, Dimensions())
+        assert new_plan is not plan
+        assert (self.q1.pk, c2.pk) in new_plan.stat_keys
+
+    def test_invalidated_by_country_clear(self):
+        plan = get_plan(self.survey, self.dimensions)
+        self.c1.surveys.clear()
+        assert get_plan(self.survey, Dimensions()) is not plan
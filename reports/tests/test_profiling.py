@@ -0,0 +1,88 @@
+from mixer.backend.django import mixer
+import pytest
+
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.test import TestCase
+
+from survey.models import Answer, Survey
+
+from ..evaluators import LiveEvaluator, TotalEvaluator
+from ..models import OrganizationStat, QuestionStat
+from ..profiling import Profile, count_queries, get_json_size
+
+pytestmark = pytest.mark.django_db
+
+
+class TestProfile(TestCase):
+
+    def test_phases(self):
+        with count_queries():
+            profile = Profile()
+            with profile.phase('save'):
+                list(Survey.objects.all())
+                list(Survey.objects.all())
+            with profile.phase('load_stat'):
+                list(Survey.objects.all())
+        profile.add('parse', 0.5)
+        profile.add('parse', 0.25)
+        profile.add('custom', 0.1)
+
+        result = profile.to_dict()
+        assert [phase['name'] for phase in result['phases']] == ['load_stat', 'parse', 'save', 'custom']
+        phases = {phase['name']: phase for phase in result['phases']}
+        assert phases['save']['queries'] == 2
+        assert phases['load_stat']['queries'] == 1
+        assert phases['parse'] == {'name': 'parse', 'seconds': 0.75, 'queries': 0}
+        assert result['queries'] == 3
+        assert result['process_peak_memory_kb'] > 0
+
+    def test_merge(self):
+        profile = Profile()
+        profile.answers = 5
+        profile.add('process', 1.0, 2)
+        profile.merge({'answers': 10, 'json_bytes': 100, 'queries': 7, 'process_peak_memory_kb': 10 ** 12,
+                       'phases': [{'name': 'process', 'seconds': 2.0, 'queries': 3}]})
+
+        result = profile.to_dict()
+        assert result['answers'] == 15
+        assert result['json_bytes'] == 100
+        assert result['queries'] == 7
+        assert result['process_peak_memory_kb'] == 10 ** 12, 'The peak of all processes'
+        assert result['phases'] == [{'name': 'process', 'seconds': 3.0, 'queries': 5}]
+
+    def test_count_queries(self):
+        with count_queries() as conn:
+            start = conn.query_count
+            with count_queries():
+                list(Survey.objects.all())
+            list(Survey.objects.all())
+            assert conn.query_count == start + 2, 'Nested contexts count once'
+        assert 'make_cursor' not in vars(conn)
+        assert 'make_debug_cursor' not in vars(conn)
+        list(Survey.objects.all())
+        assert conn.query_count == start + 2, 'Not counted outside of the context'
+
+    def test_not_profiled(self):
+        survey = mixer.blend(Survey)
+        with self.assertNumQueries(0):
+            profile = Profile()
+        LiveEvaluator(survey, Answer(survey=survey))
+        assert 'make_cursor' not in vars(connections[DEFAULT_DB_ALIAS])
+        assert profile.to_dict()['queries'] == 0
+
+    def test_json_size(self):
+        assert get_json_size([OrganizationStat()]) == 0, 'No JSON fields'
+        stat = QuestionStat(data={'cnt': 1}, vars={})
+        assert get_json_size([stat, stat]) == 2 * len('{"cnt": 1}{}')
+
+    def test_evaluator(self):
+        survey = mixer.blend(Survey)
+        with count_queries():
+            evaluator = TotalEvaluator.process_answers(survey)
+        result = evaluator.profile.to_dict()
+        assert result['answers'] == 0
+        assert result['json_bytes'] == len('[]'), 'The recent answers of the survey stat'
+        assert [phase['name'] for phase in result['phases']] == ['load_stat', 'fill_out', 'fetch', 'update_vars',
+                                                                 'save']
+        assert result['queries'] > 0
+        assert result['queries'] >= sum(phase['queries'] for phase in result['phases'])
@@ -0,0 +1,46 @@
+import random
+
+from .. import sketches
+
+
+def make_sketch(values):
+    sketch = sketches.new_sketch()
+    for value in values:
+        sketches.add(sketch, value)
+    return sketch
+
+
+def test_exact_quantiles():
+    sketch = make_sketch([40, 10, 30, 20, 20])
+    assert sketch == {'mean': [10, 20, 30, 40], 'weight': [1, 2, 1, 1]}
+    assert [sketches.quantile(sketch, q) for q in (0, 0.25, 0.5, 0.75, 1)] == [10, 20, 20, 30, 40]
+    assert sketches.quantile(make_sketch([10, 20, 30, 40]), 0.5) == 25.0
+    assert sketches.quantile(sketches.new_sketch(), 0.5) is None
+
+
+def test_merge_does_not_depend_on_order():
+    a = make_sketch([5, 10, 10])
+    b = make_sketch([10, 7])
+    assert sketches.merge(make_sketch([5, 10, 10]), b) == sketches.merge(b, a) == make_sketch([5, 7, 10, 10, 10])
+
+
+def test_compressed_quantiles():
+    rnd = random.Random(1)
+    values = [rnd.uniform(0, 100) for _ in range(20000)]
+    sketch = sketches.merge(make_sketch(values[::2]), make_sketch(values[1::2]))
+    assert len(sketch['mean']) <= 2 * sketches.COMPRESSION
+    assert sketches.count(sketch) == 20000
+    values.sort()
+    for q in (0.1, 0.25, 0.5, 0.75, 0.9):
+        assert abs(sketches.quantile(sketch, q) - values[int(q * 19999)]) < 1.5
+
+
+def test_remove():
+    sketch = make_sketch([10, 20, 20, 30])
+    assert sketches.remove(sketch, 20) == make_sketch([10, 20, 30])
+    assert sketches.remove(sketch, 10) == make_sketch([20, 30])
+    assert sketches.remove(sketches.remove(sketch, 20), 30) == sketches.new_sketch()
+    assert sketches.remove(sketch, 30) == sketches.new_sketch()
+
+    compressed = {'mean': [10.5, 20.5], 'weight': [3, 2]}
+    assert sketches.remove(compressed, 19) == {'mean': [10.5, 20.5], 'weight': [3, 1]}, 'Nearest centroid'
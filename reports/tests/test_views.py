@@ -1,17 +1,22 @@
+import json
+from datetime import date
 from mixer.backend.django import mixer
 import pytest
-from unittest.mock import patch
 
 from django.core.urlresolvers import reverse, resolve
 from django.test import TestCase, RequestFactory
 from django.contrib.auth.models import AnonymousUser
+from django.core.exceptions import ValidationError
+from django.http import Http404
+from django.utils import timezone
 from insights.users.models import User, Country
 
-from survey.models import Survey, Organization
+from survey.models import Answer, Survey, Organization, HCPCategory
 
-from ..models import SurveyStat, OrganizationStat
+from ..models import SurveyStat, OrganizationStat, QuestionStat, TrendStat, EvaluationJob, CubeSlice
 from ..evaluators import TotalEvaluator
-from ..views import update_stat, ReportsView, update_vars, recalculate
+from ..views import update_stat, ReportsView, update_vars, recalculate, job_status, trends, answer_slice, \
+    register_slice
 
 pytestmark = pytest.mark.django_db
 
@@ -23,18 +28,18 @@ class TestUpdateStat(TestCase):
         resp = update_stat(req, 'test')
         assert resp.status_code == 302, 'Should redirect to auth'
 
-    @patch('reports.views.LastEvaluator')
-    def test_user_last(self, last_evaluator):
+    def test_user_last(self):
         survey = mixer.blend(Survey)
+        mixer.blend(Answer, survey=survey)
         req = RequestFactory().get(reverse('reports:update_stat', kwargs={'survey_id': survey.slug}))
 
         req.user = mixer.blend(User)
         resp = update_stat(req, survey.slug)
         assert resp.status_code == 200, 'Allowed'
-        last_evaluator.process_answers.assert_called_once_with()
+        job = EvaluationJob.objects.get()
+        assert (job.survey, job.mode, job.status) == (survey, EvaluationJob.MODE_LAST, EvaluationJob.STATUS_PENDING)
 
-    @patch('reports.views.TotalEvaluator')
-    def test_user_last(self, total_evaluator):
+    def test_user_total(self):
         survey = mixer.blend(Survey)
         req = RequestFactory().get(reverse('reports:update_stat',
                                            kwargs={'survey_id': survey.slug}) + '?total=1')
@@ -42,7 +47,44 @@ class TestUpdateStat(TestCase):
         req.user = mixer.blend(User)
         resp = update_stat(req, survey.slug)
         assert resp.status_code == 200, 'Allowed'
-        total_evaluator.process_answers.assert_called_once_with(survey)
+        assert EvaluationJob.objects.get().mode == EvaluationJob.MODE_TOTAL
+
+    def test_up_to_date(self):
+        survey = mixer.blend(Survey)
+        req = RequestFactory().get(reverse('reports:update_stat', kwargs={'survey_id': survey.slug}))
+        req.user = mixer.blend(User)
+        assert update_stat(req, survey.slug).status_code == 200
+        assert not EvaluationJob.objects.exists(), 'No job without new answers'
+
+    def test_coalesced(self):
+        survey = mixer.blend(Survey)
+        mixer.blend(Answer, survey=survey)
+        req = RequestFactory().get(reverse('reports:update_stat', kwargs={'survey_id': survey.slug}))
+        req.user = mixer.blend(User)
+        update_stat(req, survey.slug)
+        update_stat(req, survey.slug)
+        assert EvaluationJob.objects.count() == 1, 'Pending job of the survey is reused'
+
+
+class TestJobStatus(TestCase):
+    def test_status(self):
+        job = EvaluationJob.objects.enqueue(mixer.blend(Survey), EvaluationJob.MODE_LAST)
+        req = RequestFactory().get(reverse('reports:job_status', kwargs={'job_id': job.pk}))
+        req.user = mixer.blend(User, is_staff=True)
+        resp = job_status(req, job.pk)
+        assert resp.status_code == 200
+        assert json.loads(resp.content.decode())['status'] == EvaluationJob.STATUS_PENDING
+
+    def test_not_staff(self):
+        job = EvaluationJob.objects.enqueue(mixer.blend(Survey), EvaluationJob.MODE_LAST)
+        req = RequestFactory().get(reverse('reports:job_status', kwargs={'job_id': job.pk}))
+        req.user = mixer.blend(User, is_staff=False)
+        assert job_status(req, job.pk).status_code == 302, 'Errors of jobs are for staff only'
+
+    def test_anonimous(self):
+        req = RequestFactory().get(reverse('reports:job_status', kwargs={'job_id': 1}))
+        req.user = AnonymousUser()
+        assert job_status(req, 1).status_code == 302, 'Should redirect to auth'
 
 
 class TestReports(TestCase):
@@ -91,6 +133,156 @@ class TestReports(TestCase):
         resp.render()
         assert resp.status_code == 200, 'Allowed'
 
+    def test_advanced_reads_current_generation(self):
+        survey = Survey.objects.get(pk=self.s1.pk)
+        stale = mixer.blend(SurveyStat, survey=survey, country=None, generation=survey.stat_generation + 1)
+        kwargs = {'country': 'europe', 'survey_id': self.s1.pk}
+        req = RequestFactory().get(reverse('reports:advanced', kwargs=kwargs))
+        req.user = mixer.blend(User)
+        resp = ReportsView.as_view()(req, **kwargs)
+        assert resp.context_data['survey_stat'] != stale
+        assert resp.context_data['survey_stat'].generation == survey.stat_generation
+
+    def test_advanced_cube_slice(self):
+        survey = Survey.objects.get(pk=self.s1.pk)
+        org = survey.organizations.first()
+        hcp = mixer.blend(HCPCategory)
+        mixer.blend(Answer, survey=survey, organization=org, hcp_category=hcp, country=self.c1)
+        stats = {cell: mixer.blend(QuestionStat, survey=survey, country=None, generation=survey.stat_generation,
+                                   organization=cell[0], hcp_category=cell[1], data={}, vars={})
+                 for cell in [(org, None), (None, hcp), (org, hcp)]}
+        for org_cell, hcp_cell in stats:
+            mixer.blend(CubeSlice, survey=survey, organization=org_cell, hcp_category=hcp_cell,
+                        generation=survey.stat_generation)
+        kwargs = {'country': 'europe', 'survey_id': self.s1.pk}
+        for params, cell in [({'org': org.pk}, (org, None)), ({'hcp': hcp.pk}, (None, hcp)),
+                             ({'org': org.pk, 'hcp': hcp.pk}, (org, hcp))]:
+            req = RequestFactory().get(reverse('reports:advanced', kwargs=kwargs), params)
+            req.user = mixer.blend(User)
+            resp = ReportsView.as_view()(req, **kwargs)
+            assert resp.context_data['question_stat'] == [stats[cell]]
+
+        req = RequestFactory().get(reverse('reports:advanced', kwargs=kwargs))
+        req.user = mixer.blend(User)
+        resp = ReportsView.as_view()(req, **kwargs)
+        assert not set(resp.context_data['question_stat']) & set(stats.values()), 'Totals by default'
+
+        other_org = mixer.blend(Organization)
+        other_hcp = mixer.blend(HCPCategory)
+        for params in [{'hcp': 'x'}, {'org': other_org.pk}, {'hcp': other_hcp.pk}]:
+            req = RequestFactory().get(reverse('reports:advanced', kwargs=kwargs), params)
+            req.user = mixer.blend(User)
+            with pytest.raises(Http404):
+                ReportsView.as_view()(req, **kwargs)
+
+    def test_advanced_new_cube_slice(self):
+        survey = Survey.objects.get(pk=self.s1.pk)
+        org = survey.organizations.first()
+        kwargs = {'country': 'europe', 'survey_id': self.s1.pk}
+        req = RequestFactory().get(reverse('reports:advanced', kwargs=kwargs), {'org': org.pk})
+        req.user = mixer.blend(User, is_staff=True)
+        resp = ReportsView.as_view()(req, **kwargs)
+        assert resp.context_data['slice_pending']
+        assert resp.context_data['question_stat'] == []
+        resp.render()
+        assert reverse('reports:register_slice', args=(survey.slug, 'all')) in resp.content.decode()
+        assert not CubeSlice.objects.exists(), 'Views don\'t register slices'
+        assert not EvaluationJob.objects.exists()
+
+    def test_register_slice(self):
+        survey = Survey.objects.get(pk=self.s1.pk)
+        org = survey.organizations.first()
+        kwargs = {'survey_id': survey.slug, 'country': 'all'}
+        req = RequestFactory().post(reverse('reports:register_slice', kwargs=kwargs), {'org': org.pk})
+        req.user = mixer.blend(User)
+        assert register_slice(req, **kwargs).status_code == 302, 'Staff only'
+        assert not CubeSlice.objects.exists()
+
+        req.user = mixer.blend(User, is_staff=True)
+        for _ in range(2):
+            resp = register_slice(req, **kwargs)
+            assert resp.status_code == 302
+            assert resp.url == '%s?org=%s' % (reverse('reports:advanced', kwargs=kwargs), org.pk)
+        assert CubeSlice.objects.get().cell == (org.pk, None), 'The slice is registered once'
+        job = EvaluationJob.objects.get()
+        assert job.mode == EvaluationJob.MODE_TOTAL, 'The slice is filled by a total recalculation'
+
+        req = RequestFactory().get(reverse('reports:register_slice', kwargs=kwargs), {'org': org.pk})
+        req.user = mixer.blend(User, is_staff=True)
+        assert register_slice(req, **kwargs).status_code == 405
+
+        for params in [{}, {'org': mixer.blend(Organization).pk}]:
+            req = RequestFactory().post(reverse('reports:register_slice', kwargs=kwargs), params)
+            req.user = mixer.blend(User, is_staff=True)
+            with pytest.raises(Http404):
+                register_slice(req, **kwargs)
+
+    def test_cube_slice_unique(self):
+        survey = Survey.objects.get(pk=self.s1.pk)
+        mixer.blend(CubeSlice, survey=survey, organization=survey.organizations.first(), hcp_category=None)
+        duplicate = CubeSlice(survey=survey, organization=survey.organizations.first(), hcp_category=None)
+        with pytest.raises(ValidationError):
+            duplicate.full_clean()
+
+    def test_advanced_sliced_totals(self):
+        survey = Survey.objects.get(pk=self.s1.pk)
+        org, other = survey.organizations.order_by('pk')
+        hcp = mixer.blend(HCPCategory)
+        c2 = survey.countries.exclude(pk=self.c1.pk).get()
+        for organization, hcp_category, country in [(org, hcp, self.c1), (org, None, self.c1), (other, hcp, self.c1),
+                                                    (org, hcp, c2)]:
+            mixer.blend(Answer, survey=survey, organization=organization, hcp_category=hcp_category,
+                        country=country, data={})
+        TotalEvaluator.process_answers(survey)
+        survey.refresh_from_db()
+        mixer.blend(CubeSlice, survey=survey, hcp_category=hcp, generation=survey.stat_generation)
+        mixer.blend(Answer, survey=survey, organization=org, hcp_category=hcp, country=self.c1, data={})
+
+        for country, expected in [('europe', {org.pk: 2, other.pk: 1}), (self.c1.slug, {org.pk: 1, other.pk: 1})]:
+            kwargs = {'country': country, 'survey_id': self.s1.pk}
+            req = RequestFactory().get(reverse('reports:advanced', kwargs=kwargs), {'hcp': hcp.pk})
+            req.user = mixer.blend(User)
+            ctx = ReportsView.as_view()(req, **kwargs).context_data
+            assert not ctx['slice_pending']
+            assert ctx['survey_stat'].total == sum(expected.values()), 'Answers the stats include'
+            assert {stat.organization_id: stat.total for stat in ctx['organization_stat']} == expected
+
+    def test_trends(self):
+        survey = Survey.objects.get(pk=self.s1.pk)
+        mixer.blend(TrendStat, survey=survey, country=None, generation=survey.stat_generation,
+                    period=TrendStat.PERIOD_WEEK, start=date(2017, 1, 2), total=3, data={})
+        mixer.blend(TrendStat, survey=survey, country=self.c1, generation=survey.stat_generation,
+                    period=TrendStat.PERIOD_WEEK, start=date(2017, 1, 2), total=1, data={})
+        kwargs = {'country': 'all', 'survey_id': survey.slug}
+        req = RequestFactory().get(reverse('reports:trends', kwargs=kwargs), {'period': 'week'})
+        req.user = mixer.blend(User)
+        resp = trends(req, **kwargs)
+        assert resp.status_code == 200
+        assert json.loads(resp.content.decode())['total'] == [3]
+
+        kwargs['country'] = self.c1.slug
+        req = RequestFactory().get(reverse('reports:trends', kwargs=kwargs))
+        req.user = mixer.blend(User)
+        assert json.loads(trends(req, **kwargs).content.decode())['total'] == [], 'Days by default'
+
+    def test_slice(self):
+        survey = Survey.objects.get(pk=self.s1.pk)
+        org = survey.organizations.first()
+        mixer.blend(Answer, survey=survey, country=self.c1, organization=org, data={})
+        kwargs = {'survey_id': survey.slug}
+        req = RequestFactory().get(reverse('reports:slice', kwargs=kwargs),
+                                   {'org': '%s,%s' % (org.pk, org.pk + 100), 'hcp': 'none', 'from': '2017-01-01'})
+        req.user = mixer.blend(User)
+        resp = answer_slice(req, **kwargs)
+        assert resp.status_code == 200
+        assert json.loads(resp.content.decode()) == {'total': 1, 'representations': []}
+
+        for params in [{'org': 'x'}, {'to': '2017-13-01'}]:
+            req = RequestFactory().get(reverse('reports:slice', kwargs=kwargs), params)
+            req.user = mixer.blend(User)
+            with pytest.raises(Http404):
+                answer_slice(req, **kwargs)
+
     def test_non_staff_recalculate(self):
         req = RequestFactory().get(reverse('reports:recalculate'))
         req.user = mixer.blend(User, is_staff=False)
@@ -102,6 +294,7 @@ class TestReports(TestCase):
         req.user = mixer.blend(User, is_staff=True)
         resp = recalculate(req)
         assert resp.status_code == 200, 'Allowed'
+        assert EvaluationJob.objects.filter(mode=EvaluationJob.MODE_TOTAL).count() == Survey.objects.count()
 
     def test_non_staff_update_vars(self):
         req = RequestFactory().get(reverse('reports:update_vars'))
@@ -114,3 +307,17 @@ class TestReports(TestCase):
         req.user = mixer.blend(User, is_staff=True)
         resp = update_vars(req)
         assert resp.status_code == 200, 'Allowed'
+
+    def test_update_vars_last_run(self):
+        survey = mixer.blend(Survey)
+        mixer.blend(EvaluationJob, survey=survey, mode=EvaluationJob.MODE_LAST, status=EvaluationJob.STATUS_DONE,
+                    messages=['Answer 7 is broken'], finished_at=timezone.now(),
+                    profile={'answers': 12, 'elapsed': 0.5, 'answers_per_second': 24.0, 'queries': 9,
+                             'json_bytes': 2048, 'process_peak_memory_kb': 1024,
+                             'phases': [{'name': 'update_vars', 'seconds': 0.25, 'queries': 2}]})
+        req = RequestFactory().get(reverse('reports:update_vars'))
+        req.user = mixer.blend(User, is_staff=True)
+        content = update_vars(req).content.decode()
+        assert '12 answers' in content
+        assert 'update_vars' in content
+        assert 'Answer 7 is broken' in content
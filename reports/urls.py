@@ -1,13 +1,18 @@
 from django.views.generic import TemplateView
 from django.conf.urls import url
 
-from .views import ReportsView, update_stat, recalculate, update_vars
+from .views import ReportsView, update_stat, recalculate, update_vars, job_status, trends, answer_slice, \
+    register_slice
 
 
 urlpatterns = [
     url(r'^update-vars/$', update_vars, name='update_vars'),
     url(r'^update-stat/(?P<survey_id>.+)/?$', update_stat, name='update_stat'),
     url(r'^recalculate/$', recalculate, name='recalculate'),
+    url(r'^jobs/(?P<job_id>\d+)/$', job_status, name='job_status'),
+    url(r'^trends/(?P<survey_id>[^/]+)/(?P<country>[^/]+)/$', trends, name='trends'),
+    url(r'^slice/(?P<survey_id>[^/]+)/$', answer_slice, name='slice'),
+    url(r'^slices/(?P<survey_id>[^/]+)/(?P<country>[^/]+)/$', register_slice, name='register_slice'),
 
     url(r'^(?P<survey_id>\d+)/(?P<country>.+)$', ReportsView.as_view(), name='advanced'),
     url(r'^(?P<survey_id>.+)/(?P<country>.+)$', ReportsView.as_view(), name='advanced'),
@@ -2,15 +2,20 @@ from django.contrib.auth.decorators import login_required
 from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.core.urlresolvers import reverse
-from django.http import HttpResponse, Http404, HttpResponseRedirect
+from django.db.models import Count, Max, Q
+from django.http import HttpResponse, Http404, HttpResponseRedirect, JsonResponse
 from django.shortcuts import render, get_object_or_404
+from django.utils.dateparse import parse_date
+from django.utils.http import urlencode
+from django.views.decorators.http import require_POST
 from django.views.generic import TemplateView
 
 from insights.users.models import Country
-from survey.models import Survey
+from survey.models import Survey, HCPCategory
 
-from .models import SurveyStat, OrganizationStat, QuestionStat
-from .evaluators import LastEvaluator, TotalEvaluator
+from .columnar import get_columns
+from .jobs import has_new_answers
+from .models import SurveyStat, OrganizationStat, QuestionStat, TrendStat, EvaluationJob, CubeSlice
 
 
 def get_by_slug_or_pk(cls, obj_id):
@@ -23,6 +28,61 @@ def get_by_slug_or_pk(cls, obj_id):
             raise Http404
 
 
+def get_slice_filter(params, name, queryset):
+    """
+    Object selected by a slice filter of the reports, None when the filter is not set.
+    """
+    obj_id = params.get(name)
+    if not obj_id:
+        return None
+    try:
+        return get_object_or_404(queryset, pk=obj_id)
+    except ValueError:
+        raise Http404
+
+
+def get_slice_filters(params, survey):
+    """
+    Organization and HCP category of a slice, only organizations of the survey and HCP categories
+    of its answers can be selected.
+    """
+    organization = get_slice_filter(params, 'org', survey.organizations.all())
+    hcp_category = get_slice_filter(params, 'hcp', HCPCategory.objects.filter(answer__survey=survey).distinct())
+    return organization, hcp_category
+
+
+def slice_stats(survey_stat, organization_stats, organization, hcp_category):
+    """
+    Survey and organization stats of the answers in a slice, counted with one GROUP BY query.
+
+    Only the answers the current stats include are counted, see ``SurveyStat.watermark``,
+    so the totals agree with the question stats of the cube cell of the slice.
+    """
+    europe_stat = survey_stat
+    if survey_stat.country_id is not None:
+        europe_stat = SurveyStat.objects.current(survey_stat.survey).get(country__isnull=True)
+    answers = survey_stat.survey.answers.filter(data__isnull=False)
+    answers = answers.filter(Q(pk__lte=europe_stat.watermark) | Q(pk__in=europe_stat.recent))
+    if survey_stat.country_id is not None:
+        answers = answers.filter(country_id=survey_stat.country_id)
+    if organization is not None:
+        answers = answers.filter(organization=organization)
+        organization_stats = [stat for stat in organization_stats if stat.organization_id == organization.pk]
+    if hcp_category is not None:
+        answers = answers.filter(hcp_category=hcp_category)
+
+    survey_stat.total = 0
+    survey_stat.last = None
+    totals = {}
+    for row in answers.values('organization').annotate(total=Count('id'), last=Max('created_at')).order_by():
+        totals[row['organization']] = row['total']
+        survey_stat.total += row['total']
+        survey_stat.last = max(survey_stat.last, row['last']) if survey_stat.last else row['last']
+    for stat in organization_stats:
+        stat.total = totals.get(stat.organization_id, 0)
+    return survey_stat, organization_stats
+
+
 class ReportsView(LoginRequiredMixin, TemplateView):
     template_name = 'reports/main.html'
     country_dict = {}
@@ -52,36 +112,139 @@ class ReportsView(LoginRequiredMixin, TemplateView):
 
         ctx['survey'] = survey
         ctx['country'] = self.country
-        ctx['survey_stat'] = SurveyStat.objects.filter(survey=survey, country_id=self.country_id).last()
-        ctx['organization_stat'] = OrganizationStat.objects.filter(survey=survey, country_id=self.country_id)
+        ctx['survey_stat'] = SurveyStat.objects.current(survey).filter(country_id=self.country_id).last()
+        ctx['organization_stat'] = OrganizationStat.objects.current(survey).filter(country_id=self.country_id)
         ctx['prepare_charts'] = prepare_charts
         ctx['preview_mode'] = prepare_charts == 'true'
-        ctx['question_stat'] = list(QuestionStat.objects.filter(survey=survey, country_id=self.country_id))
+        # Slices by organization and HCP category are read from the cells of the stats cube
+        organization, hcp_category = get_slice_filters(self.request.GET, survey)
+        ctx['organization'] = organization
+        ctx['hcp_category'] = hcp_category
+        ctx['question_stat'] = list(QuestionStat.objects.current(survey).filter(country_id=self.country_id)
+                                    .cell(organization and organization.pk, hcp_category and hcp_category.pk))
+        if organization or hcp_category:
+            # Cells are only kept for slices staff registered, a new one is filled by a total recalculation
+            cube_slice = CubeSlice.objects.filter(survey=survey, organization=organization,
+                                                  hcp_category=hcp_category).first()
+            ctx['cube_slice'] = cube_slice
+            ctx['slice_pending'] = cube_slice is None or cube_slice.generation is None
+            if ctx['slice_pending']:
+                ctx['question_stat'] = []
+            if ctx['survey_stat'] is not None:
+                ctx['survey_stat'], ctx['organization_stat'] = slice_stats(
+                    ctx['survey_stat'], list(ctx['organization_stat']), organization, hcp_category)
 
         return ctx
 
 
+def enqueue_surveys(mode):
+    """
+    Queue an evaluation of every survey, paired with the last finished evaluation of the survey.
+    """
+    surveys = Survey.objects.all()
+    return [(EvaluationJob.objects.enqueue(survey, mode), EvaluationJob.objects.last_finished(survey, mode))
+            for survey in surveys]
+
+
 @login_required()
 def update_stat(request, survey_id):
     survey = get_by_slug_or_pk(Survey, survey_id)
-    evaluator = TotalEvaluator if 'total' in request.GET else LastEvaluator
-    evaluator.process_answers(survey)
-    return HttpResponse('console.log("stat was successfully updated");', "application/javascript")
+    mode = EvaluationJob.MODE_TOTAL if 'total' in request.GET else EvaluationJob.MODE_LAST
+    if mode == EvaluationJob.MODE_LAST and not has_new_answers(survey):
+        # Every report view asks for an update, there is nothing to evaluate since the last one
+        return HttpResponse('console.log("stat is up to date");', "application/javascript")
+    job = EvaluationJob.objects.enqueue(survey, mode)
+    return HttpResponse('console.log("stat update was queued as job %s");' % job.pk, "application/javascript")
 
 
 @staff_member_required
 def recalculate(request):
-    messages = []
-    for survey in Survey.objects.prefetch_related('organizations', 'countries').all():
-        evaluator = TotalEvaluator.process_answers(survey)
-        messages += evaluator.messages
-    return render(request, 'reports/recalculate.html', {'evaluator_messages': messages})
+    jobs = enqueue_surveys(EvaluationJob.MODE_TOTAL)
+    return render(request, 'reports/recalculate.html', {'jobs': jobs})
 
 
 @staff_member_required
 def update_vars(request):
-    messages = []
-    for survey in Survey.objects.all():
-        evaluator = LastEvaluator.process_answers(survey)
-        messages += evaluator.messages
-    return render(request, 'reports/update_vars.html', {'evaluator_messages': messages})
+    jobs = enqueue_surveys(EvaluationJob.MODE_LAST)
+    return render(request, 'reports/update_vars.html', {'jobs': jobs})
+
+
+@staff_member_required
+@require_POST
+def register_slice(request, survey_id, country):
+    """
+    Register a slice of the reports by organization, HCP category or both, and queue the total
+    recalculation that fills it.
+    """
+    survey = get_by_slug_or_pk(Survey, survey_id)
+    organization, hcp_category = get_slice_filters(request.POST, survey)
+    if organization is None and hcp_category is None:
+        raise Http404
+    cube_slice, created = CubeSlice.objects.register(survey, organization, hcp_category)
+    if cube_slice.generation is None:
+        EvaluationJob.objects.enqueue(survey, EvaluationJob.MODE_TOTAL)
+    params = {name: obj.pk for name, obj in (('org', organization), ('hcp', hcp_category)) if obj is not None}
+    url = reverse('reports:advanced', kwargs={'survey_id': survey_id, 'country': country})
+    return HttpResponseRedirect('%s?%s' % (url, urlencode(params)))
+
+
+@staff_member_required
+def job_status(request, job_id):
+    job = get_object_or_404(EvaluationJob, pk=job_id)
+    return JsonResponse(job.to_dict())
+
+
+@login_required()
+def trends(request, survey_id, country):
+    survey = get_by_slug_or_pk(Survey, survey_id)
+    period = request.GET.get('period', TrendStat.PERIOD_DAY)
+    if period not in TrendStat.PERIOD_DAYS:
+        raise Http404
+    country_id = None if country in ('europe', 'all') else get_by_slug_or_pk(Country, country).pk
+    stats = TrendStat.objects.current(survey).filter(country_id=country_id, period=period)
+    return JsonResponse(TrendStat.get_series(stats, period))
+
+
+def get_id_list(request, name):
+    """
+    Ids of a filter given as ``?name=1,2`` or ``?name=1&name=2``, None when the filter is not set.
+    """
+    values = [value for param in request.GET.getlist(name) for value in param.split(',') if value]
+    if not values:
+        return None
+    try:
+        return [None if value == 'none' else int(value) for value in values]
+    except ValueError:
+        raise Http404
+
+
+def get_date(request, name):
+    value = request.GET.get(name)
+    if not value:
+        return None
+    try:
+        date = parse_date(value)
+    except ValueError:
+        date = None
+    if date is None:
+        raise Http404
+    return date
+
+
+@login_required()
+def answer_slice(request, survey_id):
+    """
+    Reports of the answers in a slice, e.g. ``?org=1,2&region=3&from=2017-01-01&to=2017-03-31``.
+
+    Dimensions take lists of ids, ``none`` selects answers without the dimension.
+    """
+    survey = get_by_slug_or_pk(Survey, survey_id)
+    columns = get_columns(survey)
+    mask = columns.get_mask(
+        countries=get_id_list(request, 'country'),
+        regions=get_id_list(request, 'region'),
+        organizations=get_id_list(request, 'org'),
+        hcp_categories=get_id_list(request, 'hcp'),
+        start=get_date(request, 'from'),
+        end=get_date(request, 'to'))
+    return JsonResponse(columns.summarize(mask))
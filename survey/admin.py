@@ -1,5 +1,3 @@
-from querystring_parser import parser as queryparser
-
 from django.contrib import admin
 from django.utils.translation import gettext as _
 from django import forms
@@ -7,6 +5,7 @@ from django.utils.html import format_html
 from django.utils.safestring import mark_safe, mark_for_escaping
 from .models import (Region, Organization, Question, QuestionTranslation,
                      Option, Survey, Answer, HCPCategory)
+from .parsers import parse_answer_body
 from reports.models import Representation
 import nested_admin
 
@@ -56,7 +55,8 @@ class QuestionTranslationInline(admin.StackedInline):
 @admin.register(Question)
 class QuestionAdmin(admin.ModelAdmin):
     inlines = [QuestionTranslationInline]
-    list_display = ('id', 'ordering', 'type', 'field', 'text', 'created_at', 'depends_on', 'dependency_type')
+    list_display = ('id', 'ordering', 'type', 'field', 'text', 'created_at', 'depends_on', 'dependency_type',
+                    'dependency_answer')
     search_fields = ['text']
     form = QuestionModelForm
 
@@ -130,11 +130,14 @@ class AnswerAdmin(admin.ModelAdmin):
         return bool(item.body)
 
     def get_data(self, item):
-        data = queryparser.parse(item.body)
-        if 'data' not in data:
-            return None
-
-        items = list(data['data'].items())
+        data = item.get_data()
+        if data is None:
+            results = parse_answer_body(item.body)
+            if 'data' not in results:
+                return None
+            data = results['data']
+
+        items = list(data.items())
         items.sort()
         out = ''
         for i, dt in items:
@@ -0,0 +1,34 @@
+import random
+from urllib.parse import urlencode
+
+from .models import Question
+
+OPTION_VALUES = [
+    'Age', 'Efficacy profile', 'Preference of the patients', 'Mechanism of Action', 'Aripiprazole-oral',
+    'Aripiprazole-LAI', 'Cost & reimbursement', 'Side effects (EPS)', '100% adherence', 'Co-morbidity+',
+    'Überweisung', "Patient's choice", '12', '',
+]
+
+
+def make_answer_body(questions, rnd=random):
+    """
+    Build a body the way pass_view stores it, for ``questions`` given as (pk, type) pairs.
+    """
+    pairs = [('csrfmiddlewaretoken', 'C7UlUxD6GI60dwB3PnGtA9en518LhHhRfqQwzXRb6pMVAs9jgaMIgWK0mq2AH8a6')]
+    for qid, question_type in questions:
+        key = 'data[%s]' % qid
+        if question_type in (Question.TYPE_YES_NO, Question.TYPE_YES_NO_JUMPING):
+            if rnd.random() < 0.9:
+                pairs.append((key, rnd.choice(['Yes', 'No'])))
+        elif question_type in (Question.TYPE_TWO_DEPENDEND_FIELDS, Question.TYPE_SIMPLE_INPUT):
+            main = rnd.choice(['', str(rnd.randint(0, 100)), '%.1f' % (rnd.random() * 100)])
+            pairs.append((key + '[main]', main))
+            if question_type == Question.TYPE_TWO_DEPENDEND_FIELDS:
+                pairs.append((key + '[additional]', '' if main else str(rnd.randint(0, 10))))
+        elif question_type in (Question.TYPE_MULTISELECT_ORDERED, Question.TYPE_MULTISELECT_WITH_OTHER):
+            for value in rnd.sample(OPTION_VALUES, rnd.randint(0, 6)):
+                pairs.append((key + '[]', value))
+            pairs.append((key + '[]', ''))
+            pairs.append((key + '[other]', rnd.choice(['', 'Other reason'])))
+    rnd.shuffle(pairs)
+    return urlencode(pairs)
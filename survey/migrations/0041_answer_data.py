@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.4 on 2026-10-18 08:14
+from __future__ import unicode_literals
+
+from django.db import migrations
+import jsonfield.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('survey', '0040_auto_20180701_2209'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='answer',
+            name='data',
+            field=jsonfield.fields.JSONField(blank=True, null=True, verbose_name='Structured answers'),
+        ),
+    ]
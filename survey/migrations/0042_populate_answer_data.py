@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+from survey.parsers import parse_answer_body, normalize_answer_data, MalformedQueryStringError
+
+
+def populate_answer_data(apps, schema_editor):
+    Answer = apps.get_model('survey', 'Answer')
+
+    answers = Answer.objects.filter(data__isnull=True).exclude(body='').only('id', 'body').order_by('pk')
+    for answer in answers.iterator():
+        try:
+            results = parse_answer_body(answer.body)
+        except MalformedQueryStringError:
+            continue
+        if isinstance(results.get('data'), dict):
+            Answer.objects.filter(pk=answer.pk).update(data=normalize_answer_data(results['data']))
+
+
+def dummy(apps, schema_editor):
+    pass
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('survey', '0041_answer_data'),
+    ]
+
+    operations = [
+        migrations.RunPython(populate_answer_data, dummy),
+    ]
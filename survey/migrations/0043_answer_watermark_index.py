@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.4 on 2026-10-18 08:25
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('survey', '0042_populate_answer_data'),
+        ('reports', '0022_surveystat_watermark'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='answer',
+            name='is_updated',
+        ),
+        migrations.AlterIndexTogether(
+            name='answer',
+            index_together=set([('survey', 'id')]),
+        ),
+    ]
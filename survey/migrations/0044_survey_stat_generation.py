@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.4 on 2026-10-18 08:42
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('survey', '0043_answer_watermark_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='survey',
+            name='stat_generation',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.4 on 2026-10-18 09:04
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('survey', '0044_survey_stat_generation'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='question',
+            name='dependency_answer',
+            field=models.CharField(blank=True, help_text='Evaluated as the answer of this question when the answer of the question it depends on includes one of the available_if options, separated by "|"', max_length=200, verbose_name='Answer implied by the dependency'),
+        ),
+    ]
@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+# The rules evaluators had hard-coded: https://app.asana.com/0/232511650961646/257462747620886
+RULES = [
+    (3, 5, ['Aripiprazole-oral', 'Aripiprazole-LAI'], 'Yes'),
+    (11, 13, ['Aripiprazole-oral', 'Aripiprazole-LAI'], 'Yes'),
+]
+
+
+def matches_rule(question, source_id, options):
+    """
+    Whether the dependency an editor set on the question is the one of the rule.
+    """
+    available_if = {option.strip().lower() for option in question.available_if.split('|') if option.strip()}
+    return question.depends_on_id == source_id and available_if == {option.lower() for option in options}
+
+
+def populate_dependency_answer(apps, schema_editor):
+    Question = apps.get_model('survey', 'Question')
+
+    for source_id, target_id, options, answer in RULES:
+        target = Question.objects.filter(pk=target_id).first()
+        # Questions whose dependency was edited are left alone, the rule may not apply to them
+        if target is None or target.dependency_answer or not matches_rule(target, source_id, options):
+            continue
+        Question.objects.filter(pk=target_id).update(dependency_answer=answer)
+
+
+def clear_dependency_answer(apps, schema_editor):
+    Question = apps.get_model('survey', 'Question')
+
+    for source_id, target_id, options, answer in RULES:
+        target = Question.objects.filter(pk=target_id, dependency_answer=answer).first()
+        if target is not None and matches_rule(target, source_id, options):
+            Question.objects.filter(pk=target_id).update(dependency_answer='')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('survey', '0045_question_dependency_answer'),
+    ]
+
+    operations = [
+        migrations.RunPython(populate_dependency_answer, clear_dependency_answer),
+    ]
@@ -1,9 +1,13 @@
+import jsonfield
+
 from django.db import models
 from django.forms import ValidationError
 from django.utils.translation import ugettext_lazy as _
 from insights.users.models import User, Country, Language, TherapeuticArea
 from django.utils import timezone
 
+from .parsers import parse_answer_body, normalize_answer_data, load_answer_data
+
 
 class Region(models.Model):
     name = models.CharField('Region name', max_length=100)
@@ -77,6 +81,8 @@ class Survey(models.Model):
     created_at = models.DateTimeField('Datetime of creation', auto_now_add=True)
     start = models.DateTimeField(_('Starts at'))
     end = models.DateTimeField(_('Ends at'))
+    # Generation of the report stats readers use, see switch_stat_generation
+    stat_generation = models.PositiveIntegerField(default=0, editable=False)
 
     def natural_key(self):
         return (self.slug,)
@@ -109,13 +115,42 @@ class Survey(models.Model):
                                   % {'max_organizations': cls.MAX_ORGANIZATIONS})
 
     def clear(self):
-        self.answers.all().delete()
+        # Stats go first, so that deleted answers are not retracted from them one by one
         self.clear_stats()
+        self.answers.all().delete()
+
+    def lock(self, nowait=False):
+        """
+        Lock the survey row until the end of the transaction.
+
+        Answers of a survey are evaluated under this lock, submissions don't wait for it.
+        With ``nowait`` a lock held by another transaction raises DatabaseError instead of waiting.
+        """
+        rows = list(Survey.objects.select_for_update(nowait=nowait).filter(pk=self.pk)
+                    .values_list('stat_generation', flat=True))
+        if rows:
+            # Stats are written to the generation in use when the lock is taken
+            self.stat_generation = rows[0]
 
     def clear_stats(self):
         self.surveystat_set.all().delete()
         self.organizationstat_set.all().delete()
         self.questionstat_set.all().delete()
+        self.trendstat_set.all().delete()
+
+    def switch_stat_generation(self, generation):
+        """
+        Make reports read the stats of ``generation`` and delete the stats of other generations.
+
+        Runs in the transaction that wrote the new generation, so readers switch from
+        the complete previous stats to the complete new ones at once.
+        """
+        Survey.objects.filter(pk=self.pk).update(stat_generation=generation)
+        self.stat_generation = generation
+        self.surveystat_set.exclude(generation=generation).delete()
+        self.organizationstat_set.exclude(generation=generation).delete()
+        self.questionstat_set.exclude(generation=generation).delete()
+        self.trendstat_set.exclude(generation=generation).delete()
 
 models.signals.m2m_changed.connect(Survey.on_organizations_changed, sender=Survey.organizations.through)
 
@@ -160,6 +195,9 @@ class Question(models.Model):
         (DEPENDENCY_CONTEXTUAL, 'Question availability depends on other question'),
     )
 
+    # Separates the options in available_if of questions with a dependency_answer
+    AVAILABLE_IF_SEPARATOR = '|'
+
     objects = QuestionManager()
 
     survey = models.ForeignKey(Survey, on_delete=models.CASCADE, related_name='questions',
@@ -171,6 +209,10 @@ class Question(models.Model):
     depends_on = models.ForeignKey('self', null=True, blank=True)
     available_if = models.CharField(_('Dependent question answer'), max_length=200, blank=True)
     dependency_type = models.PositiveIntegerField('Dependency Type', null=True, blank=True, choices=DEPENDENCY_CHOICES)
+    dependency_answer = models.CharField(
+        _('Answer implied by the dependency'), max_length=200, blank=True,
+        help_text=_('Evaluated as the answer of this question when the answer of the question it depends on '
+                    'includes one of the available_if options, separated by "|"'))
     script = models.CharField('Additional script', max_length=5000, null=True, blank=True)
     created_at = models.DateTimeField('Datetime of creation', auto_now_add=True)
     is_radio = models.BooleanField(_('Allow to select only one'), default=False)
@@ -186,6 +228,13 @@ class Question(models.Model):
     def __str__(self):
         return self.text
 
+    def get_available_if_options(self):
+        """
+        Lowered options of available_if that imply the dependency_answer.
+        """
+        options = (option.strip().lower() for option in self.available_if.split(self.AVAILABLE_IF_SEPARATOR))
+        return frozenset(option for option in options if option)
+
     def get_type_template_name(self):
         return "survey/question_types/%s.html" % self.type
 
@@ -249,8 +298,29 @@ class Answer(models.Model):
     hcp_category = models.ForeignKey(HCPCategory, null=True, blank=True)
     survey = models.ForeignKey(Survey, related_name="answers")
     body = models.TextField(default='')
+    data = jsonfield.JSONField(_('Structured answers'), null=True, blank=True)
     created_at = models.DateTimeField(_('Submitted'), auto_now_add=True)
-    is_updated = models.BooleanField(db_index=True, default=False)
+
+    class Meta:
+        # Evaluations read the answers of a survey above a watermark id
+        index_together = [('survey', 'id')]
 
     def __str__(self):
         return "%s - %s Response" % (self.pk, self.created_at)
+
+    def parse_body(self):
+        """
+        Structured form of body to store in data, None if body has no answers.
+        """
+        results = parse_answer_body(self.body)
+        if not isinstance(results.get('data'), dict):
+            return None
+        return normalize_answer_data(results['data'])
+
+    def get_data(self):
+        """
+        Answers keyed by question id, None if the structured form was not stored.
+        """
+        if self.data is None:
+            return None
+        return load_answer_data(self.data)
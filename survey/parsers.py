@@ -0,0 +1,160 @@
+"""
+Parser for the urlencoded answer bodies stored by ``pass_view``.
+
+Answers are saved as ``request.POST.urlencode()``, a flat list of keys like
+``data[12]``, ``data[12][main]`` or ``data[12][]``. ``parse_answer_body``
+returns exactly what ``querystring_parser.parser.parse`` returns for such
+strings, but caches the bracket parsing of keys, which repeat in every answer,
+and builds the nested dicts in place instead of merging one dict per pair.
+
+``normalize_answer_data`` turns the parsed answers into the structured form
+kept in ``Answer.data``, so evaluators don't have to parse bodies again.
+"""
+from functools import lru_cache
+from urllib.parse import unquote_plus
+
+from querystring_parser import parser as queryparser
+from querystring_parser.parser import MalformedQueryStringError
+
+__all__ = ['parse_answer_body', 'normalize_answer_data', 'load_answer_data', 'MalformedQueryStringError']
+
+
+class _Fallback(Exception):
+    pass
+
+
+def _is_number(s):
+    if s and s[0] in ('-', '+'):
+        return s[1:].isdigit()
+    return s.isdigit()
+
+
+def _to_key(s):
+    return int(s) if _is_number(s) else s
+
+
+def _get_key(s):
+    start = s.find('[')
+    end = s.find(']')
+    if start == -1 or end == -1:
+        return None
+    if s[start + 1] == "'":
+        start += 1
+    if s[end - 1] == "'":
+        end -= 1
+    return s[start + 1:end]
+
+
+def _split_key(key):
+    # Mirrors querystring_parser.parser.parser_helper, but returns the path of keys
+    # and whether the value is an array item, which is converted to int when numeric.
+    start_bracket = key.find('[')
+    end_bracket = key.find(']')
+    if start_bracket > 0:
+        path, is_item = _split_key(key[start_bracket:])
+        return (key[:start_bracket],) + path, is_item
+    if queryparser.more_than_one_index(key):
+        path, is_item = _split_key(key[end_bracket + 1:])
+        return (_to_key(_get_key(key)),) + path, is_item
+
+    new_key = key
+    if start_bracket != -1:
+        new_key = _get_key(key)
+        if new_key is None:
+            raise MalformedQueryStringError
+    return (_to_key(new_key),), key == '[]'
+
+
+@lru_cache(maxsize=4096)
+def _parse_key(raw_key):
+    return _split_key(unquote_plus(raw_key))
+
+
+def _unquote(value):
+    if '%' in value or '+' in value:
+        return unquote_plus(value)
+    return value
+
+
+def _parse(body):
+    result = {}
+    for element in body.split('&'):
+        pair = element.split('=')
+        if len(pair) != 2:
+            raise MalformedQueryStringError
+        path, is_item = _parse_key(pair[0])
+        value = _unquote(pair[1])
+        if is_item and _is_number(value):
+            value = int(value)
+
+        node = result
+        for key in path[:-1]:
+            child = node.get(key)
+            if child is None:
+                if key in node:
+                    raise _Fallback
+                child = node[key] = {}
+            elif type(child) is not dict:
+                raise _Fallback
+            node = child
+
+        key = path[-1]
+        if key not in node:
+            node[key] = value
+        elif type(node[key]) is list:
+            node[key].append(value)
+        else:
+            node[key] = [node[key], value]
+    return result
+
+
+def parse_answer_body(body):
+    """
+    Parse an answer body into nested dicts, e.g. ``{'data': {12: {'main': '10'}}}``.
+
+    Raises ``MalformedQueryStringError`` for strings that are not urlencoded pairs.
+    """
+    if isinstance(body, bytes):
+        body = body.decode()
+    if body == '':
+        return {}
+    try:
+        return _parse(body)
+    except _Fallback:
+        # A key is used both as a value and as a nested dict, which never happens in
+        # answers, so leave the odd merge rules to the generic parser.
+        return queryparser.parse(body)
+
+
+def _normalize_value(value):
+    if isinstance(value, dict):
+        normalized = {}
+        for key, item in value.items():
+            if key == '':
+                # Option lists, in the submitted order, which is the ranking for ordered multiselects
+                items = item if isinstance(item, list) else [item]
+                normalized[''] = [option for option in map(_normalize_value, items) if option]
+            else:
+                normalized[str(key)] = _normalize_value(item)
+        return normalized
+    if isinstance(value, list):
+        return [_normalize_value(item) for item in value]
+    return str(value).strip()
+
+
+def normalize_answer_data(data):
+    """
+    Convert the parsed ``data`` dict of an answer into the structured form stored in ``Answer.data``.
+
+    Keys are question ids as strings. Choices become stripped strings, numeric answers
+    keep their ``main``/``additional`` strings, and option lists are always lists of
+    non-empty strings under the ``''`` key.
+    """
+    return {str(qid): _normalize_value(value) for qid, value in data.items()}
+
+
+def load_answer_data(structured):
+    """
+    Turn the stored structured form back into the dict evaluators process, keyed by question id.
+    """
+    return {_to_key(qid): value for qid, value in structured.items()}
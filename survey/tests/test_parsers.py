@@ -0,0 +1,67 @@
+import random
+
+from querystring_parser import parser as queryparser
+
+from django.test import SimpleTestCase
+
+from ..models import Question
+from ..parsers import parse_answer_body, normalize_answer_data, load_answer_data, MalformedQueryStringError
+from ..factories import make_answer_body
+
+REAL_BODY = 'data%5B12%5D%5B%5D=&data%5B4%5D%5B%5D=Age&data%5B4%5D%5B%5D=Preference+of+the+patients&data%5B4%5D%5B%5D=Efficacy+profile&data%5B4%5D%5B%5D=&csrfmiddlewaretoken=C7UlUxD6GI60dwB3PnGtA9en518LhHhRfqQwzXRb6pMVAs9jgaMIgWK0mq2AH8a6&data%5B14%5D%5B%5D=&data%5B3%5D%5Bother%5D=&data%5B7%5D=No&data%5B9%5D%5Badditional%5D=&data%5B2%5D=Yes&data%5B3%5D%5B%5D=Ari-oral&data%5B3%5D%5B%5D=Resperidol-oral&data%5B3%5D%5B%5D=Ari-LAI&data%5B3%5D%5B%5D=&data%5B11%5D%5Bother%5D=&data%5B9%5D%5Bmain%5D=&data%5B6%5D%5B%5D=Age&data%5B6%5D%5B%5D=Mechanism+of+Action&data%5B6%5D%5B%5D=Preference+of+the+patients&data%5B6%5D%5B%5D=&data%5B16%5D=xxx&data%5B11%5D%5B%5D=&data%5B14%5D%5Bother%5D=&data%5B1%5D%5Bmain%5D=10&data%5B4%5D%5Bother%5D=&data%5B12%5D%5Bother%5D=&data%5B6%5D%5Bother%5D=&data%5B1%5D%5Badditional%5D='  # noqa
+
+
+class TestParseAnswerBody(SimpleTestCase):
+
+    def assertCompatible(self, body):
+        try:
+            expected = queryparser.parse(body)
+        except Exception as e:
+            self.assertRaises(type(e), parse_answer_body, body)
+        else:
+            self.assertEqual(parse_answer_body(body), expected, body)
+
+    def test_real_body(self):
+        self.assertCompatible(REAL_BODY)
+        data = parse_answer_body(REAL_BODY)['data']
+        assert data[1] == {'main': '10', 'additional': ''}
+        assert data[3] == {'': ['Ari-oral', 'Resperidol-oral', 'Ari-LAI', ''], 'other': ''}
+        assert data[16] == 'xxx'
+
+    def test_generated_bodies(self):
+        rnd = random.Random(42)
+        types = [t for t, _ in Question.TYPE_CHOICES]
+        for _ in range(500):
+            questions = [(qid, rnd.choice(types)) for qid in range(1, rnd.randint(2, 30))]
+            self.assertCompatible(make_answer_body(questions, rnd))
+
+    def test_edge_cases(self):
+        bodies = [
+            '', 'a=1', 'data=1', 'data[1]=Yes', 'data[1][]=5', 'data[1][]=5&data[1][]=x', 'data[1][]=-5',
+            '12=Yes', '[a]=1', 'a]=1', 'a[b]c=1', "a['x']=1", 'a[b]=1&a=2', 'data[1]=%C3%9C+x%26y',
+            b'data[1]=Yes',
+        ]
+        for body in bodies:
+            self.assertCompatible(body)
+
+    def test_malformed(self):
+        for body in ('111', 'a=1&', '&a=1', 'a=1=2', 'a[=1'):
+            self.assertRaises(MalformedQueryStringError, parse_answer_body, body)
+
+
+class TestNormalizeAnswerData(SimpleTestCase):
+
+    def test_normalize(self):
+        data = parse_answer_body(REAL_BODY + '&data%5B20%5D%5B%5D=12')['data']
+        structured = normalize_answer_data(data)
+        assert structured['1'] == {'main': '10', 'additional': ''}
+        assert structured['2'] == 'Yes'
+        assert structured['3'] == {'': ['Ari-oral', 'Resperidol-oral', 'Ari-LAI'], 'other': ''}
+        assert structured['11'] == {'': [], 'other': ''}
+        assert structured['20'] == {'': ['12']}, 'Single and numeric options are lists of strings'
+
+    def test_load(self):
+        structured = normalize_answer_data(parse_answer_body(REAL_BODY)['data'])
+        data = load_answer_data(structured)
+        assert sorted(data) == [1, 2, 3, 4, 6, 7, 9, 11, 12, 14, 16]
+        assert data[4] == {'': ['Age', 'Preference of the patients', 'Efficacy profile'], 'other': ''}
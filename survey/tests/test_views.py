@@ -7,7 +7,7 @@ import pytest
 from django.core.urlresolvers import reverse, resolve
 from django.test import RequestFactory, Client
 from test_plus import TestCase
-from django.contrib.auth.models import AnonymousUser, Group
+from django.contrib.auth.models import AnonymousUser, Group, Permission
 from django.utils import timezone
 
 from insights.users.models import User, Country
@@ -280,6 +280,29 @@ class TestSurveyPass(AssertHTMLMixin, TestCase):
         assert resp.url == reverse('survey:thanks', kwargs={"survey_id": 'test'})
         answer = Answer.objects.get()
         assert answer.body
+        assert answer.get_data()[1] == {'main': '33', 'additional': ''}
+        assert answer.get_data()[3] == {'': ['Quetapin-oral', 'Aloperidol-oral'], 'other': ''}
+
+
+class TestSurveyPassMalformed(TestCase):
+
+    def test_malformed_body(self):
+        country = mixer.blend(Country)
+        user = mixer.blend(User, country=country)
+        user.user_permissions.add(Permission.objects.get(codename='add_answer'))
+        survey = mixer.blend(Survey)
+        organization = mixer.blend(Organization)
+        request = RequestFactory().post(reverse('survey:pass', kwargs={'id': survey.pk}), {'data[1': ['33']})
+        request.user = user
+        request.session = {
+            "org_id": organization.pk,
+        }
+        resp = pass_view(request, survey.pk)
+
+        self.response_302(resp)
+        answer = Answer.objects.get()
+        assert answer.body == 'data%5B1=33'
+        assert answer.data is None
 
 
 class TestSurveyDefinition(AssertHTMLMixin, TestCase):
@@ -1,3 +1,5 @@
+import logging
+
 from django.shortcuts import render, get_object_or_404
 from django.http import HttpResponseRedirect
 from django.contrib import messages
@@ -9,6 +11,9 @@ from django.utils.translation import ugettext_lazy as _
 
 from survey.models import Answer, Survey
 from survey.forms import StartForm
+from survey.parsers import MalformedQueryStringError
+
+logger = logging.getLogger(__name__)
 
 
 @login_required
@@ -118,6 +123,12 @@ def pass_view(request, id):
         if request.session.get('region'):
             answer.region_id = request.session.pop('region')
         answer.body = request.POST.urlencode()
+        try:
+            answer.data = answer.parse_body()
+        except MalformedQueryStringError:
+            # The answer is kept, evaluators report bodies they can't parse
+            logger.warning("Answer of survey %s has a malformed body: %s", id, answer.body)
+            answer.data = None
         answer.save()
         return HttpResponseRedirect(reverse('survey:thanks', kwargs={'survey_id': survey.slug}))
 